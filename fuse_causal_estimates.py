@@ -6,6 +6,12 @@ from libs.model import *
 from libs.model.COmnivore_V import COmnivore_V
 from libs.model.COmnivore_G import COmnivore_G
 from libs.model.LF import LF
+from libs.model.CausalClassifier import set_early_stopping
+from libs.model.lf_executor import get_lf_executor
+from libs.model.lf_cache import get_lf_cache
+from libs.model.lf_sampling import get_lf_sampler
+from libs.model.cb_search import get_cb_search, get_nodes_key
+from libs.model.spurious_samples_exp_utils import get_pca_nodes
 from libs.utils import *
 from libs.utils.logger import log, set_log_path
 
@@ -66,6 +72,8 @@ def main(args):
     # set up optimizer
     opt = cfg['opt']
     epochs = opt['epochs']
+    # patience: validation evaluations without improvement before stopping (default: train all epochs)
+    set_early_stopping(opt.get('patience', None), opt.get('eval_interval', 1))
     if 'learning_rate' in args and not isinstance(args.learning_rate,type(None)):
         lr = args.learning_rate
     else:
@@ -138,18 +146,9 @@ def main(args):
         return baseline_accs, None
     
     active_lfs = cfg['model']['active_lfs']
-    G_estimates = {}
-    for lf in active_lfs['notears']:
-        log(f"Running {lf}...")
-        G_estimates[lf] = run_notears_lfs(samples_dict,tasks, lf_factory.lf_dict[lf], lf, False)
-
-    for lf in active_lfs['classic']:
-        log(f"Running {lf}...")
-        G_estimates[lf] = run_classic_lfs(samples_dict,tasks, lf_factory.lf_dict[lf], lf, False)
-
-    for lf in active_lfs['pycausal']:
-        log(f"Running {lf}...")
-        G_estimates[lf] = run_classic_lfs(samples_dict, tasks,lf_factory.lf_dict['pycausal'], lf, False, pycausal=True)
+    lf_cache = get_lf_cache(cfg['model'], load_path)
+    lf_executor = get_lf_executor(cfg['model'], lf_cache, get_lf_sampler(cfg['model']))
+    G_estimates = lf_executor.run(samples_dict, tasks, active_lfs, lf_factory, log_graph=True)
 
     if pipline['indiv_training']:
         log("Training using individual LF estimates...")
@@ -173,7 +172,6 @@ def main(args):
     cache_nodes = []
     if fuser == 'COmnivore_V':
         COmnivore_params = opt['comnivore_v']
-        all_negative_balance = np.arange(COmnivore_params['all_negative_balance'][0],COmnivore_params['all_negative_balance'][1],COmnivore_params['all_negative_balance'][2])
         if 'snorkel_lr' in args and args.snorkel_lr is not None:
             snorkel_lr = args.snorkel_lr
         else:
@@ -183,7 +181,17 @@ def main(args):
         else:
             snorkel_ep = COmnivore_params['snorkel_ep']
         log(f"SNORKEL PARAMS: lr {snorkel_lr} | ep {snorkel_ep}")
-        COmnivore = COmnivore_V(G_estimates, snorkel_lr, snorkel_ep)
+        label_model = COmnivore_params.get('label_model', 'batched')
+        warm_start_ep = COmnivore_params.get('warm_start_ep', None)
+        warm_start_cb = COmnivore_params.get('warm_start_cb', 0.5)
+        COmnivore = COmnivore_V(G_estimates, snorkel_lr, snorkel_ep, label_model, warm_start_ep, warm_start_cb)
+        def get_nodes_key_of_cb(cb):
+            return get_nodes_key(get_pca_nodes(samples_dict, COmnivore.fuse_estimates(cb, n_pca_features)))
+        def fit_label_models(cbs):
+            COmnivore.fit_label_models(cbs, n_pca_features)
+        # the end model only depends on the selected nodes, one cb per regime is enough
+        all_negative_balance, _ = get_cb_search(COmnivore_params['all_negative_balance'], get_nodes_key_of_cb, \
+                                    COmnivore_params, prefit=fit_label_models)
         
         for cb in all_negative_balance:
             log(f"###### {cb} ######")
@@ -218,14 +226,25 @@ def main(args):
         min_iters = COmnivore_params['min_iters']
         max_iters = COmnivore_params['max_iters']
         step = COmnivore_params['step']
-        COmnivore = COmnivore_G(G_estimates, n_triplets, min_iters, max_iters, step)
-        g_hats_per_task = COmnivore.fuse_estimates()
-        n_iters = np.array([i for i in range(min_iters, max_iters+step, step)])
-        for i, iter_ in enumerate(n_iters):
+        COmnivore = COmnivore_G(G_estimates, n_triplets, min_iters, max_iters, step, \
+                                n_chains=COmnivore_params.get('n_chains', 1), \
+                                temperature_ratio=COmnivore_params.get('temperature_ratio', 10.), \
+                                n_workers=COmnivore_params.get('n_workers', 1))
+        if COmnivore_params.get('stream', False):
+            # train on every iteration budget as soon as all tasks reach it
+            budget_estimates = COmnivore.iter_budget_estimates(COmnivore_params.get('checkpoint_path', None), \
+                                                                COmnivore_params.get('background', True))
+        else:
+            g_hats_per_task = COmnivore.fuse_estimates()
+            n_iters = np.array([i for i in range(min_iters, max_iters+step, step)])
+            budget_estimates = []
+            for i, iter_ in enumerate(n_iters):
+                g_hats = {}
+                for task in g_hats_per_task:
+                    g_hats[task] = g_hats_per_task[task][i]
+                budget_estimates.append((iter_, g_hats))
+        for iter_, g_hats in budget_estimates:
             log(f"##### ITER: {iter_} #####")
-            g_hats = {}
-            for task in g_hats_per_task:
-                g_hats[task] = g_hats_per_task[task][i]
             traindata, valdata_processed, testdata_processed, pca_nodes, all_train_nodes = get_data_from_feat_label_array(samples_dict, G_estimates=g_hats, scale=False)
             if test_baseline_nodes(pca_nodes, n_pca_features):
                 print("Same as baseline nodes.. skipping training")
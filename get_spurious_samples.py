@@ -5,6 +5,12 @@ from libs.core import load_config
 from libs.model import *
 from libs.model.COmnivore_V import COmnivore_V
 from libs.model.LF import LF
+from libs.model.CausalClassifier import set_early_stopping
+from libs.model.lf_executor import get_lf_executor
+from libs.model.lf_cache import get_lf_cache
+from libs.model.lf_sampling import get_lf_sampler
+from libs.utils.fork_pool import run_configs
+from libs.model.cb_search import get_cb_search, get_nodes_key, golden_section_search
 from libs.utils import *
 from libs.utils.logger import log, set_log_path
 from libs.model.spurious_samples_exp_utils import *
@@ -66,6 +72,8 @@ def main(args):
     # set up optimizer
     opt = cfg['opt']
     epochs = opt['epochs']
+    # patience: validation evaluations without improvement before stopping (default: train all epochs)
+    set_early_stopping(opt.get('patience', None), opt.get('eval_interval', 1))
     if 'learning_rate' in args and not isinstance(args.learning_rate,type(None)):
         lr = args.learning_rate
     else:
@@ -123,18 +131,9 @@ def main(args):
     
 
     active_lfs = cfg['model']['active_lfs']
-    G_estimates = {}
-    for lf in active_lfs['notears']:
-        log(f"Running {lf}...")
-        G_estimates[lf] = run_notears_lfs(samples_dict,tasks, lf_factory.lf_dict[lf], lf, False, log_graph=False)
-
-    for lf in active_lfs['classic']:
-        log(f"Running {lf}...")
-        G_estimates[lf] = run_classic_lfs(samples_dict,tasks, lf_factory.lf_dict[lf], lf, False, log_graph=False)
-
-    for lf in active_lfs['pycausal']:
-        log(f"Running {lf}...")
-        G_estimates[lf] = run_classic_lfs(samples_dict, tasks,lf_factory.lf_dict['pycausal'], lf, False, pycausal=True, log_graph=False)
+    lf_cache = get_lf_cache(cfg['model'], load_path)
+    lf_executor = get_lf_executor(cfg['model'], lf_cache, get_lf_sampler(cfg['model']))
+    G_estimates = lf_executor.run(samples_dict, tasks, active_lfs, lf_factory, log_graph=False)
 
     log("Training with fused causal estimates...")
     eval_accs_spur = {}
@@ -142,7 +141,6 @@ def main(args):
     eval_accs_remove_feats = {}
     eval_accs_combined = {}
     
-    cache_nodes = []
     if 'images_path' in args and not isinstance(args.images_path,type(None)):
         images_path = args.images_path
         csv_file = os.path.join(images_path, "metadata.csv")
@@ -174,7 +172,6 @@ def main(args):
 
     if fuser == 'COmnivore_V':
         COmnivore_params = opt['comnivore_v']
-        all_negative_balance = np.arange(COmnivore_params['all_negative_balance'][0],COmnivore_params['all_negative_balance'][1],COmnivore_params['all_negative_balance'][2])
         if 'snorkel_lr' in args and args.snorkel_lr is not None:
             snorkel_lr = args.snorkel_lr
         else:
@@ -184,22 +181,40 @@ def main(args):
         else:
             snorkel_ep = COmnivore_params['snorkel_ep']
             
-        COmnivore = COmnivore_V(G_estimates, snorkel_lr, snorkel_ep)
+        label_model = COmnivore_params.get('label_model', 'batched')
+        warm_start_ep = COmnivore_params.get('warm_start_ep', None)
+        warm_start_cb = COmnivore_params.get('warm_start_cb', 0.5)
+        COmnivore = COmnivore_V(G_estimates, snorkel_lr, snorkel_ep, label_model, warm_start_ep, warm_start_cb)
+
+        def get_nodes_key_of_cb(cb):
+            return get_nodes_key(get_pca_nodes(samples_dict, COmnivore.fuse_estimates(cb, n_pca_features)))
+        def fit_label_models(cbs):
+            COmnivore.fit_label_models(cbs, n_pca_features)
+        all_negative_balance, cb_search = get_cb_search(COmnivore_params['all_negative_balance'], get_nodes_key_of_cb, \
+                                            COmnivore_params, prefit=fit_label_models)
         
-        # best_diff = float("-inf")
-        # best_cb = 0
-        for cb in all_negative_balance:
-            log(f"###### {cb} ######")
+        # phase 1: fuse every cb and group the cbs by selected nodes, in cb order
+        node_groups = {}
+        for cb_idx, cb in enumerate(all_negative_balance):
             g_hats, edge_probs = COmnivore.fuse_estimates(cb, n_pca_features, return_probs=True)
-            feature_weights = get_features_weights(samples_dict, edge_probs, n_orig_features)
-            traindata, valdata_processed, testdata_processed, pca_nodes = get_data(samples_dict, g_hats)
-            
-            if test_duplicate_nodes(pca_nodes, cache_nodes) or len(traindata) == 0:
-                print("Nodes cached.. skipping training")
-                continue
+            if cb_idx == 0:
+                # the data does not depend on the fused graphs, only the selected nodes do
+                traindata, valdata_processed, testdata_processed, _ = get_data(samples_dict, g_hats)
+            if len(traindata) == 0:
+                break
+            pca_nodes = get_pca_nodes(samples_dict, g_hats)
             if test_empty_nodes(pca_nodes):
-                print("No causal features predicted, skipping training")
+                log(f"cb {cb}: no causal features predicted, skipping training")
                 continue
+            feature_weights = get_features_weights(samples_dict, edge_probs, n_orig_features)
+            node_groups.setdefault(get_nodes_key(pca_nodes), []).append((cb_idx, (cb, g_hats, feature_weights)))
+        log(f"{len(node_groups)} node sets in {len(all_negative_balance)} cb values")
+
+        # phase 2: train and evaluate the unique configurations, run_cb returns None without point weights
+        def run_cb(config):
+            cb, g_hats, feature_weights = config
+            log(f"###### {cb} ######")
+            accs = {}
             # print("CAUSAL FEATURES TO COMPUTE WEIGHT")
             points_weights, base_predictor, _ = get_points_weights(traindata, model, \
                                                 feature_weights, epochs, lr, \
@@ -210,7 +225,7 @@ def main(args):
             # points_weights = np.random.rand(traindata.shape[0])
             if points_weights is None:
                 print("No causal features predicted, skipping training")
-                continue
+                return None
             
             if sample_weighting:
                 log("="*100)
@@ -231,10 +246,6 @@ def main(args):
                                                                                     store_path=os.path.join('spurious_samples_exp',f'{dataset_name}'),
                                                                                     root_dir = os.path.join(images_path),\
                                                                                     dataset_name = dataset_name)
-                    # log("% SPURIOUS SAMPLES SEPARATION: {:.3f}".format(diff))
-                    # if diff > best_diff:
-                    #     best_diff = diff
-                    #     best_cb = cb
                 
                 log("="*100)
                 log("WITH SAMPLE WEIGHT")
@@ -248,21 +259,20 @@ def main(args):
                                         model=model, n_layers=n_layers,\
                                         evaluate_func=evaluate_func, log_freq=log_freq, \
                                         tune_by_metric=tune_by_metric, verbose=True)
-                eval_accs_spur[cb] = acc_spur
-                eval_accs_baselne[cb] = acc_baseline
+                accs['spur'] = acc_spur
+                accs['baseline'] = acc_baseline
                 
             if remove_features:
                 train_causal, val_causal, test_causal, _, _ = get_data_from_feat_label_array(samples_dict, G_estimates=g_hats, scale=False)
                 log("="*100)
                 log("REMOVE CAUSAL ONLY")
-                # if not test_baseline_nodes(pca_nodes, n_pca_features):
                 acc_remove = train_and_evaluate_end_model_causal(train_causal, val_causal, metadata_val, \
                                     test_causal, metadata_test,rng, \
                                     epochs, lr, bs, l2, dropout=dropout, \
                                     model=model, n_layers=n_layers, \
                                     evaluate_func=evaluate_func, \
                                     log_freq=log_freq, tune_by_metric=tune_by_metric)
-                eval_accs_remove_feats[cb] = acc_remove
+                accs['remove'] = acc_remove
                 log("="*100)
                 log("REMOVE CAUSAL + WEIGHTED")
                 acc_combined = train_and_evaluate_end_model_weighted(train_causal, val_causal,\
@@ -275,9 +285,59 @@ def main(args):
                                     model=model, n_layers=n_layers,\
                                     evaluate_func=evaluate_func, log_freq=log_freq, \
                                     tune_by_metric=tune_by_metric, verbose=True)
-                
-                eval_accs_combined[cb] = acc_combined
-            cache_nodes.append(pca_nodes)
+                accs['combined'] = acc_combined
+            return accs
+
+        def store_accs(cb, accs):
+            if accs is None:
+                return
+            if 'spur' in accs:
+                eval_accs_spur[cb] = accs['spur']
+                eval_accs_baselne[cb] = accs['baseline']
+            if 'remove' in accs:
+                eval_accs_remove_feats[cb] = accs['remove']
+                eval_accs_combined[cb] = accs['combined']
+
+        # as in a serial sweep, a node set counts as trained once a cb produced point weights:
+        # until then the next cb with the same nodes is tried
+        trained = {}
+        attempts = {key: 0 for key in node_groups}
+        pending = list(node_groups.keys())
+        while len(pending) > 0:
+            configs = [node_groups[key][attempts[key]] for key in pending]
+            sweep_results = run_configs(run_cb, [config for _, config in configs], COmnivore_params.get('n_workers', 1))
+            retry = []
+            for key, (cb_idx, config), accs in zip(pending, configs, sweep_results):
+                if accs is not None:
+                    trained[cb_idx] = (config[0], accs)
+                    continue
+                attempts[key] += 1
+                if attempts[key] < len(node_groups[key]):
+                    retry.append(key)
+            pending = retry
+        log(f"{len(trained)} of {len(all_negative_balance)} cb values trained")
+        for cb_idx in sorted(trained):
+            store_accs(*trained[cb_idx])
+
+        # refine the cb within the best regime, the nodes are fixed but the feature weights still change
+        refine_key = 'spur' if sample_weighting else 'combined'
+        eval_accs_refine = eval_accs_spur if sample_weighting else eval_accs_combined
+        cb_refine_iters = COmnivore_params.get('cb_refine_iters', 0)
+        if cb_search is not None and cb_refine_iters > 0 and len(eval_accs_refine) > 0:
+            _, best_cb_ = get_best_model_acc(eval_accs_refine, tune_by=tune_by_metric, return_best_key=True)
+            first_idx, last_idx = cb_search.get_regime(best_cb_)
+            def refine_cb(idx):
+                cb = cb_search.grid[idx]
+                g_hats, edge_probs = COmnivore.fuse_estimates(cb, n_pca_features, return_probs=True)
+                feature_weights = get_features_weights(samples_dict, edge_probs, n_orig_features)
+                accs = run_cb((cb, g_hats, feature_weights))
+                store_accs(cb, accs)
+                if accs is None or refine_key not in accs:
+                    return None
+                return accs[refine_key]['val'][tune_by_metric]
+            log(f"refining cb in [{cb_search.grid[first_idx]}, {cb_search.grid[last_idx]}]")
+            golden_section_search(refine_cb, first_idx, last_idx, cb_refine_iters, \
+                                    {first_idx: eval_accs_refine[best_cb_]['val'][tune_by_metric]})
         
         best_model_base = {}
         best_model_spur = {}
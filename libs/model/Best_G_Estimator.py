@@ -1,9 +1,32 @@
 import numpy as np
-from ..utils.metrics import shd, sid
+from ..utils.metrics import shd, sid, pairwise_shd, shd_matrix, sid_matrix
 from ..utils.graph_modules import modify_single_edge, get_ordered_edge_sets
-import networkx as nx
 
 from tqdm import tqdm
+
+# metrics with a batched version, candidates x LF graphs in one call
+DIST_MATRICES = {shd: shd_matrix, sid: sid_matrix}
+
+def weighted_distances(candidates, G_lambdas, weights, dist_metric):
+    '''
+    objective of every candidate: weighted mean distance to the LF graphs
+    '''
+    dist_matrix = DIST_MATRICES.get(dist_metric)
+    if dist_matrix is None:
+        dist = [[dist_metric(candidate, G) for G in G_lambdas] for candidate in candidates]
+    else:
+        dist = dist_matrix(np.stack([np.asarray(c) for c in candidates]), np.stack([np.asarray(G) for G in G_lambdas])).tolist()
+    return [sum([w * d for w, d in zip(weights, row)])/len(G_lambdas) for row in dist]
+
+def random_graph(n_node, p=0.5):
+    '''
+    directed graph with every edge i -> j, i != j, drawn with probability p, as nx.gnp_random_graph(n_node, p, directed=True)
+    but from numpy's random state, so a seeded task draws the same initial graph in every process
+    '''
+    G = (np.random.random_sample((n_node, n_node)) < p).astype(float)
+    np.fill_diagonal(G, 0)
+    return G
+
 class State:
     def __init__(self, current_G, current_cost):
         self.G = current_G
@@ -14,24 +37,21 @@ class HillClimbing:
         self.G_lambdas = G_lambdas
         self.maxiter = maxiter
         self.dist_metric = dist_metric
+        if len(weights) == 0:
+            self.weights = [1 for i in range(len(self.G_lambdas))]
+        else:
+            self.weights = weights
 
         if initial_state is None:
             n_node = self.G_lambdas[0].shape[0]
-            initial_state = nx.to_numpy_matrix(nx.gnp_random_graph(n_node, 0.5, directed=True))
+            initial_state = random_graph(n_node, 0.5)
         self.state = State(initial_state, self.objective(initial_state))
 
         self.edge_set = get_ordered_edge_sets(self.state.G)
         self.smallest_cost = 1
-        if len(weights) == 0:
-            self.weights = [1 for i in range(len(self.G_lambdas))]
-        else:
-            self.weights = weights
     
     def objective(self, G_candidate):
-        sum_dist = 0
-        for i, G in enumerate(self.G_lambdas):
-            sum_dist += self.weights[i] * self.dist_metric(G_candidate, G)
-        return sum_dist/len(self.G_lambdas)
+        return weighted_distances([G_candidate], self.G_lambdas, self.weights, self.dist_metric)[0]
     
     def get_neighbors(self):
         neighbors = []
@@ -42,8 +62,8 @@ class HillClimbing:
     
     def evaluate_candidates(self, candidates):
         best_candidates = {}
-        for candidate in candidates:
-            cost = self.objective(candidate)
+        costs = weighted_distances(candidates, self.G_lambdas, self.weights, self.dist_metric)
+        for candidate, cost in zip(candidates, costs):
             if cost <= self.state.cost:
                 if cost not in best_candidates:
                     best_candidates[cost] = [candidate]
@@ -74,6 +94,12 @@ class HillClimbing:
             
         
 class SimulatedAnnealing:
+    '''
+    With dist_metric=shd the objective is updated incrementally: shd counts the entries where the
+    edge indicators of two graphs differ, so a single edge flip changes the count of every LF by -1, 0 or +1.
+    Moves flip the edge of the current graph in place and flip it back when rejected.
+    Other metrics recompute the objective on every move.
+    '''
     def __init__(self, G_lambdas, initial_state='avg', maxiter=1000, decrease_t_iter=100, dist_metric = shd, T=10000, alpha=0.1, reduction_rule='geometric', gt_dag=None, weights=[]):
         self.G_lambdas = G_lambdas
         self.maxiter = maxiter
@@ -81,19 +107,30 @@ class SimulatedAnnealing:
         self.T = T
         self.alpha = alpha
         self.dist_metric = dist_metric
+        self.incremental = dist_metric is shd
+        if self.incremental:
+            # n x n x n_LF edge indicators of the LF graphs
+            self.lf_edges = np.stack([np.asarray(G) != 0 for G in self.G_lambdas], axis=-1)
         if len(weights) == 0:
             self.weights = [1 for i in range(len(self.G_lambdas))]
         else:
             self.weights = weights
-        if initial_state == 'random':
+        # compare strings only, a graph compared to a string is an elementwise comparison in numpy 2
+        if isinstance(initial_state, str) and initial_state == 'random':
             n_node = self.G_lambdas[0].shape[0]
-            self.initial_G = nx.to_numpy_matrix(nx.gnp_random_graph(n_node, 0.5, directed=True))
-        elif initial_state == 'avg':
+            self.initial_G = random_graph(n_node, 0.5)
+        elif isinstance(initial_state, str) and initial_state == 'avg':
             self.initial_G = self.get_average_G()
         else:
             assert type(initial_state) != str
-            self.initial_G = np.copy(initial_state)
-        self.state = State(self.initial_G, self.objective(self.initial_G))
+            self.initial_G = initial_state
+        # the state is modified in place, never alias an LF graph (dense float, CompactGraph stores uint8)
+        self.initial_G = np.array(self.initial_G, dtype=float)
+        if self.incremental:
+            self.counts = self.get_counts(self.initial_G)
+            self.state = State(self.initial_G, self.get_cost(self.counts))
+        else:
+            self.state = State(self.initial_G, self.objective(self.initial_G))
 
         self.edge_set = get_ordered_edge_sets(self.state.G)
         self.reduction_rule = reduction_rule
@@ -104,9 +141,12 @@ class SimulatedAnnealing:
             print('G* objective is', self.G_star_cost)
 
     def get_average_G(self):
-        distances = []
-        for i, G_i in enumerate(self.G_lambdas):
-            distances.append(self.calculate_avg_dist(G_i, i))
+        if self.incremental:
+            distances = pairwise_shd(np.stack(self.G_lambdas)).sum(axis=1) / len(self.G_lambdas)
+        else:
+            distances = []
+            for i, G_i in enumerate(self.G_lambdas):
+                distances.append(self.calculate_avg_dist(G_i, i))
         best_idx = np.argmin(distances)
         best_average_G = self.G_lambdas[best_idx]
         return best_average_G
@@ -120,10 +160,30 @@ class SimulatedAnnealing:
         return sum_dist/len(self.G_lambdas)
 
     def objective(self, G_candidate):
-        sum_dist = 0
-        for i, G in enumerate(self.G_lambdas):
-            sum_dist += self.weights[i] * self.dist_metric(G_candidate, G)
-        return sum_dist/len(self.G_lambdas)
+        return weighted_distances([G_candidate], self.G_lambdas, self.weights, self.dist_metric)[0]
+
+    def get_counts(self, G):
+        # shd between G and every LF graph
+        return (self.lf_edges != (np.asarray(G) != 0)[:, :, None]).sum(axis=(0, 1))
+
+    def get_cost(self, counts):
+        # same sum as objective, in the same order
+        return sum([w * d for w, d in zip(self.weights, counts.tolist())])/len(self.G_lambdas)
+
+    def flip_edge(self, edge):
+        '''
+        in place modify_single_edge on the current graph
+        returns the previous value of the edge and the new per LF counts (None without incremental objective)
+        '''
+        i, j = edge
+        old_value = self.state.G[i, j]
+        self.state.G[i, j] = np.abs(old_value - 1)
+        if not self.incremental:
+            return old_value, None
+        is_edge = self.state.G[i, j] != 0
+        if is_edge == (old_value != 0):
+            return old_value, self.counts
+        return old_value, self.counts + np.where(self.lf_edges[i, j] == is_edge, -1, 1)
 
     def get_neighbors(self):
         neighbors = []
@@ -157,17 +217,27 @@ class SimulatedAnnealing:
 
     def optimize(self, verbose=True):
         print("initial objective value:", self.state.cost)
+        n_edges = len(self.edge_set)
         # smallest_cost_attained = False
         for i in range(0, self.maxiter, self.decrease_t_iter):
             for j in range(self.decrease_t_iter):
-                candidate = self.random_move_optimized()
-                possible_state = State(candidate, self.objective(candidate))
-                if possible_state.cost < self.state.cost:
-                    self.state = possible_state
+                # same draws as np.random.choice over the edges and over [state, candidate]
+                edge = self.edge_set[np.random.randint(n_edges)]
+                old_value, counts = self.flip_edge(edge)
+                if self.incremental:
+                    cost = self.get_cost(counts)
+                else:
+                    cost = self.objective(self.state.G)
+                if cost < self.state.cost:
+                    accept = True
+                else:
+                    p_accept = self.calculate_p_accept(cost - self.state.cost)
+                    accept = np.random.random_sample() >= 1 - p_accept
+                if accept:
+                    self.state.cost = cost
+                    self.counts = counts
                 else:
-                    delta_cost = possible_state.cost - self.state.cost
-                    p_accept = self.calculate_p_accept(delta_cost)
-                    self.state = np.random.choice([self.state, possible_state], p=[1-p_accept, p_accept])
+                    self.state.G[edge[0], edge[1]] = old_value
             if verbose and i%10 == 0:
                 print(i, self.state.cost)
             self.decrease_T()
@@ -175,5 +245,3 @@ class SimulatedAnnealing:
         # print("optimizer finished")
         print("final objective value", self.state.cost)
         return self.state
-
-
@@ -1,10 +1,28 @@
+import os
+import pickle
+import multiprocessing as mp
+from queue import Empty
+
 import numpy as np
-from ..utils.metrics import shd
+from libs.utils.logger import log
+from ..utils.metrics import pairwise_shd
 from .Best_G_Estimator import SimulatedAnnealing
+from .lf_cache import feature_digest
+from libs.utils.fork_pool import run_configs
 from tqdm import tqdm
 
 class COmnivore_G:
-    def __init__(self, G_estimates, n_triplets=7, min_iters = 100, max_iters = 10000, step = 100):
+    '''
+    Every task is annealed for max_iters iterations, restarting SimulatedAnnealing from the current graph
+    every step iterations and keeping the graph of each budget min_iters, min_iters + step, ..., max_iters.
+    n_chains > 1 runs parallel tempering: chain k anneals from temperature T / temperature_ratio ** k,
+    neighbouring chains exchange their graphs after every step iterations and each budget keeps the graph
+    of the lowest cost chain. n_workers tasks are annealed at once in forked processes.
+    fuse_estimates returns the graphs once every budget is annealed, iter_estimates / iter_budget_estimates
+    stream them budget by budget and can checkpoint the chains to resume an interrupted run.
+    '''
+    def __init__(self, G_estimates, n_triplets=7, min_iters = 100, max_iters = 10000, step = 100, \
+                    n_chains=1, T=10000, temperature_ratio=10., n_workers=1):
         self.G_estimates = G_estimates
         self.lf_names = list(self.G_estimates.keys())
         self.n_triplets = n_triplets
@@ -12,6 +30,10 @@ class COmnivore_G:
         self.min_iters = min_iters
         self.max_iters = max_iters
         self.step = step
+        self.n_chains = n_chains
+        self.T = T
+        self.temperature_ratio = temperature_ratio
+        self.n_workers = n_workers
         # self.n_iters = np.array([i for i in range(min_iters, max_iters+step, step)])
     
     def get_distance_matrix(self):
@@ -24,38 +46,36 @@ class COmnivore_G:
                 L_matrix[i, j, :, :] = lf_g
         
         # compute rate of LF agreement => average dist between pairs of LFs across all tasks
-        dist_mat = np.zeros((L_matrix.shape[1], L_matrix.shape[1]))
-        for LF_id_1 in range(L_matrix.shape[1]):
-            LF_curr = L_matrix[:,LF_id_1, :, :]
-            for LF_id_2 in range(L_matrix.shape[1]):
-                if LF_id_1 == LF_id_2:
-                    continue
-                LF_other = L_matrix[:,LF_id_2, :, :]
-                dist_tasks = []
-                for task in range(LF_curr.shape[0]):
-                    dist_tasks.append(shd(LF_curr[task], LF_other[task]))
-                dist_mat[LF_id_1][LF_id_2] = np.mean(dist_tasks)
+        dist_mat = pairwise_shd(L_matrix).mean(axis=0)
         self.distance_matrix = dist_mat
         return dist_mat
     
     def triplet_solver(self, dist_a_b, dist_a_c, dist_b_c):
         return (dist_a_b + dist_a_c - dist_b_c) / 2
 
+    def get_triplets(self, n_lfs):
+        '''
+        for every LF a, the pairs (b, c), b < c, of the other LFs
+        returns n_lfs x n_pairs arrays a, b, c
+        '''
+        a, b, c = np.meshgrid(np.arange(n_lfs), np.arange(n_lfs), np.arange(n_lfs), indexing='ij')
+        triplets = (b != a) & (c != a) & (b < c)
+        n_pairs = (n_lfs - 1) * (n_lfs - 2) // 2
+        return a[triplets].reshape(n_lfs, n_pairs), b[triplets].reshape(n_lfs, n_pairs), c[triplets].reshape(n_lfs, n_pairs)
+
     def get_empirical_LF_acc(self):
-        LF_empirical_acc = []
+        '''
+        1 / median triplet distance of every LF, over n_triplets random pairs of other LFs (drawn with replacement)
+        or over every pair with n_triplets=None
+        '''
         distance_matrix = self.get_distance_matrix()
-        LF_all = np.arange(0, distance_matrix.shape[0], dtype=int)
-        for LF_idx in LF_all:
-            lf_other = np.delete(LF_all, LF_idx)
-            LF_accs = []
-            for i in range(self.n_triplets):
-                lf_rand_0, lf_rand_1 = np.random.choice(lf_other, 2, replace=False)
-                dist_a_b = distance_matrix[LF_idx, lf_rand_0]
-                dist_a_c = distance_matrix[LF_idx, lf_rand_1]
-                dist_b_c = distance_matrix[lf_rand_0, lf_rand_1]
-                LF_accs.append(self.triplet_solver(dist_a_b, dist_a_c, dist_b_c))
-            emp_acc = 1/np.median(LF_accs) if np.median(LF_accs) != 0 else 0
-            LF_empirical_acc.append(emp_acc)
+        a, b, c = self.get_triplets(distance_matrix.shape[0])
+        if self.n_triplets is not None:
+            sampled = np.random.randint(a.shape[1], size=(a.shape[0], self.n_triplets))
+            a, b, c = [np.take_along_axis(x, sampled, axis=1) for x in [a, b, c]]
+        LF_accs = self.triplet_solver(distance_matrix[a, b], distance_matrix[a, c], distance_matrix[b, c])
+        medians = np.median(LF_accs, axis=1)
+        LF_empirical_acc = np.where(medians != 0, 1 / np.where(medians != 0, medians, 1), 0).tolist()
         
         self.empirical_acc = LF_empirical_acc
         return LF_empirical_acc
@@ -66,26 +86,252 @@ class COmnivore_G:
             task_lfs.append(self.G_estimates[lf][task])
         return task_lfs
     
+    def get_n_budgets(self):
+        return len(range(self.min_iters, self.max_iters+self.step, self.step))
+
+    def sort_by_cost(self, g_hats, obj_value):
+        # sort ascending based on objective value (cost)
+        obj_value = np.array(obj_value)
+        sorted_idx = np.argsort(obj_value).flatten()
+        g_hats = np.array(g_hats)
+        return g_hats[sorted_idx]
+
+    def anneal_task(self, task):
+        lfs = self.get_task_lfs(task)
+        initial_state = 'random'
+        g_hats = []
+        obj_value = []
+        for i in tqdm(range(self.get_n_budgets())):
+            if i > 0: 
+                initial_state = np.copy(best_estimated_G)
+            search_optimizer = SimulatedAnnealing(lfs, initial_state, self.step, T=self.T, reduction_rule='geometric', weights=self.empirical_acc)
+            search_optimizer.optimize(verbose=False)
+            best_estimated_G = search_optimizer.state.G
+            g_hats.append(best_estimated_G)
+            obj_value.append(search_optimizer.state.cost)
+        return self.sort_by_cost(g_hats, obj_value)
+
+    def swap_chains(self, states, temperatures, offset):
+        '''
+        replica exchange between chains k, k+1 for k = offset, offset + 2, ...,
+        accepted with probability min(1, exp((1/T_k - 1/T_k+1) (E_k - E_k+1)))
+        '''
+        for k in range(offset, len(states) - 1, 2):
+            delta = (1 / temperatures[k] - 1 / temperatures[k + 1]) * (states[k].cost - states[k + 1].cost)
+            if delta >= 0 or np.random.random_sample() < np.exp(delta):
+                states[k], states[k + 1] = states[k + 1], states[k]
+        return states
+
+    def get_temperatures(self):
+        return [self.T / self.temperature_ratio ** k for k in range(self.n_chains)]
+
+    def run_segment(self, budget_idx, lfs, initial_states):
+        '''
+        step iterations of every chain followed by the chain exchange
+        returns the chain states and (graph, cost) of the lowest cost chain before the exchange
+        '''
+        temperatures = self.get_temperatures()
+        states = []
+        for k in range(self.n_chains):
+            search_optimizer = SimulatedAnnealing(lfs, initial_states[k], self.step, T=temperatures[k], reduction_rule='geometric', weights=self.empirical_acc)
+            states.append(search_optimizer.optimize(verbose=False))
+        best_chain = int(np.argmin([state.cost for state in states]))
+        best = (np.copy(states[best_chain].G), states[best_chain].cost)
+        states = self.swap_chains(states, temperatures, budget_idx % 2)
+        return states, best
+
+    def temper_task(self, config):
+        task, seed = config
+        np.random.seed(seed)
+        lfs = self.get_task_lfs(task)
+        initial_states = ['random' for k in range(self.n_chains)]
+        g_hats = []
+        obj_value = []
+        for i in range(self.get_n_budgets()):
+            states, (G, cost) = self.run_segment(i, lfs, initial_states)
+            g_hats.append(G)
+            obj_value.append(cost)
+            initial_states = [state.G for state in states]
+        return self.sort_by_cost(g_hats, obj_value)
+
+    def anneal_segment(self, config):
+        # one budget of one task from its chain graphs and random state, run in the sweep workers
+        task, initial_states, random_state, budget_idx = config
+        np.random.set_state(random_state)
+        states, (G, cost) = self.run_segment(budget_idx, self.get_task_lfs(task), initial_states)
+        return [state.G for state in states], np.random.get_state(), G, cost
+
+    def get_lf_digest(self):
+        # content hash of the LF graphs, in LF and task order
+        return feature_digest(np.stack([[np.asarray(self.G_estimates[lf][task], dtype=float) for task in self.tasks] \
+                                        for lf in self.lf_names]))
+
+    def get_checkpoint_params(self):
+        # a checkpoint is only resumed by the same schedule on the same LF graphs
+        return (tuple(self.lf_names), tuple(self.tasks), self.get_lf_digest(), self.min_iters, self.max_iters, self.step, \
+                self.n_chains, self.T, self.temperature_ratio)
+
+    def load_checkpoint(self, checkpoint_path):
+        if checkpoint_path is None or not os.path.isfile(checkpoint_path):
+            return None
+        try:
+            with open(checkpoint_path, 'rb') as f:
+                checkpoint = pickle.load(f)
+        except Exception as e:
+            log(f"could not read annealing checkpoint {checkpoint_path}: {e}")
+            return None
+        if checkpoint['params'] != self.get_checkpoint_params():
+            log(f"annealing checkpoint {checkpoint_path} is for another schedule or other LF graphs, starting over")
+            return None
+        return checkpoint
+
+    def save_checkpoint(self, checkpoint, checkpoint_path):
+        if checkpoint_path is None:
+            return
+        tmp_path = checkpoint_path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(checkpoint, f)
+            os.replace(tmp_path, checkpoint_path)
+        except OSError as e:
+            log(f"could not write annealing checkpoint {checkpoint_path}: {e}")
+
+    def get_snapshots_path(self, checkpoint_path):
+        return checkpoint_path + '.snapshots'
+
+    def load_snapshots(self, checkpoint_path, n_budgets):
+        '''
+        snapshots of the first n_budgets budgets, one pickled list per budget in the snapshots file,
+        None when the file has fewer budgets
+        '''
+        budgets = []
+        if n_budgets == 0:
+            return budgets
+        try:
+            with open(self.get_snapshots_path(checkpoint_path), 'rb') as f:
+                while len(budgets) < n_budgets:
+                    budgets.append(pickle.load(f))
+        except Exception as e:
+            log(f"could not read the snapshots of annealing checkpoint {checkpoint_path}: {e}")
+            return None
+        return budgets
+
+    def write_snapshots(self, budgets, checkpoint_path, append=False):
+        if checkpoint_path is None:
+            return
+        try:
+            with open(self.get_snapshots_path(checkpoint_path), 'ab' if append else 'wb') as f:
+                for snapshots in budgets:
+                    pickle.dump(snapshots, f)
+        except OSError as e:
+            log(f"could not write the snapshots of annealing checkpoint {checkpoint_path}: {e}")
+
+    def iter_estimates(self, checkpoint_path=None):
+        '''
+        Generator over (iteration, task, G, cost) snapshots, budget by budget: every task is annealed
+        step more iterations (n_workers tasks at once) before the snapshots of that budget are yielded.
+        With checkpoint_path, the chain graphs and random states of every task are written to checkpoint_path after
+        every budget and the snapshots of the budget are appended to checkpoint_path.snapshots; a rerun yields
+        the stored snapshots then resumes annealing where the previous run stopped.
+        '''
+        iterations = list(range(self.min_iters, self.max_iters+self.step, self.step))
+        checkpoint = self.load_checkpoint(checkpoint_path)
+        budgets = []
+        if checkpoint is not None:
+            budgets = self.load_snapshots(checkpoint_path, checkpoint['budget_idx'])
+            if budgets is None:
+                log(f"annealing checkpoint {checkpoint_path} has no snapshots, starting over")
+                checkpoint = None
+                budgets = []
+        if checkpoint is None:
+            self.get_empirical_LF_acc()
+            seeds = np.random.randint(2 ** 31 - 1, size=len(self.tasks)).tolist()
+            checkpoint = {
+                'params': self.get_checkpoint_params(),
+                'empirical_acc': self.empirical_acc,
+                'budget_idx': 0,
+                'chains': {task: ['random' for k in range(self.n_chains)] for task in self.tasks},
+                'random_states': {task: np.random.RandomState(seed).get_state() for task, seed in zip(self.tasks, seeds)},
+            }
+        else:
+            self.empirical_acc = checkpoint['empirical_acc']
+            log(f"resuming annealing at iteration {iterations[min(checkpoint['budget_idx'], len(iterations) - 1)]}")
+        # drops the snapshots of a budget interrupted before its checkpoint was written
+        self.write_snapshots(budgets, checkpoint_path)
+        for snapshots in budgets:
+            for snapshot in snapshots:
+                yield snapshot
+        for budget_idx in range(checkpoint['budget_idx'], len(iterations)):
+            configs = [(task, checkpoint['chains'][task], checkpoint['random_states'][task], budget_idx) for task in self.tasks]
+            results = run_configs(self.anneal_segment, configs, self.n_workers)
+            snapshots = []
+            for config, result in zip(configs, results):
+                if result is None:
+                    result = self.anneal_segment(config)
+                task = config[0]
+                checkpoint['chains'][task], checkpoint['random_states'][task], G, cost = result
+                snapshots.append((iterations[budget_idx], task, G, cost))
+            self.write_snapshots([snapshots], checkpoint_path, append=True)
+            checkpoint['budget_idx'] = budget_idx + 1
+            self.save_checkpoint(checkpoint, checkpoint_path)
+            for snapshot in snapshots:
+                yield snapshot
+
+    def stream_estimates(self, checkpoint_path=None, background=False):
+        '''
+        iter_estimates, with background=True run in a forked process so the consumer (e.g. end model training)
+        overlaps with the annealing of the next budgets
+        '''
+        if not background:
+            yield from self.iter_estimates(checkpoint_path)
+            return
+        ctx = mp.get_context('fork')
+        queue = ctx.Queue()
+        process = ctx.Process(target=self.put_estimates, args=(queue, checkpoint_path))
+        process.start()
+        try:
+            while True:
+                try:
+                    snapshot = queue.get(timeout=1.)
+                except Empty:
+                    if not process.is_alive():
+                        raise RuntimeError(f"annealing process exited with code {process.exitcode}")
+                    continue
+                if snapshot is None:
+                    break
+                yield snapshot
+        finally:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+    def put_estimates(self, queue, checkpoint_path):
+        for snapshot in self.iter_estimates(checkpoint_path):
+            queue.put(snapshot)
+        queue.put(None)
+
+    def iter_budget_estimates(self, checkpoint_path=None, background=False):
+        '''
+        groups the snapshots of stream_estimates by iteration: yields (iteration, {task: G}) once every task reached it
+        '''
+        pending = {}
+        for iteration, task, G, cost in self.stream_estimates(checkpoint_path, background):
+            pending.setdefault(iteration, {})[task] = G
+            if len(pending[iteration]) == len(self.tasks):
+                yield iteration, pending.pop(iteration)
+
     def fuse_estimates(self):
-        empirical_acc = self.get_empirical_LF_acc()
+        self.get_empirical_LF_acc()
         g_hats_per_task = {}
-        for n, task in tqdm(enumerate(self.tasks)):
-            lfs = self.get_task_lfs(task)
-            initial_state = 'random'
-            g_hats_per_task[task] = []
-            obj_value = []
-            for i, iteration in tqdm(enumerate(range(self.min_iters, self.max_iters+self.step, self.step))):
-                if i > 0: 
-                    initial_state = np.copy(best_estimated_G)
-                search_optimizer = SimulatedAnnealing(lfs, initial_state, self.step, reduction_rule='geometric', weights=empirical_acc)
-                search_optimizer.optimize(verbose=False)
-                best_estimated_G = search_optimizer.state.G
-                g_hats_per_task[task].append(best_estimated_G)
-                obj_value.append(search_optimizer.state.cost)
-            # sort ascending based on objective value (cost)
-            obj_value = np.array(obj_value)
-            sorted_idx = np.argsort(obj_value).flatten()
-            g_hats_per_task[task] = np.array(g_hats_per_task[task])
-            g_hats_per_task[task] = g_hats_per_task[task][sorted_idx]
+        if self.n_chains == 1 and self.n_workers <= 1:
+            for task in tqdm(self.tasks):
+                g_hats_per_task[task] = self.anneal_task(task)
+            return g_hats_per_task
+        # forked workers share the random state, every task gets its own seed
+        configs = list(zip(self.tasks, np.random.randint(2 ** 31 - 1, size=len(self.tasks)).tolist()))
+        results = run_configs(self.temper_task, configs, self.n_workers)
+        for config, g_hats in zip(configs, results):
+            if g_hats is None:
+                g_hats = self.temper_task(config)
+            g_hats_per_task[config[0]] = g_hats
         return g_hats_per_task
-                        
\ No newline at end of file
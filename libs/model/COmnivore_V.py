@@ -1,15 +1,37 @@
 import numpy as np
-import networkx as nx
-from snorkel.labeling.model import LabelModel
+from libs.utils.graph_modules import reachability
+from .label_model import BatchedLabelModel, TripletLabelModel
+
+LABEL_MODELS = ['batched', 'snorkel', 'triplet']
 
 class COmnivore_V:
-    def __init__(self, G_estimates, snorkel_lr=1e-3, snorkel_ep=100):
+    '''
+    label_model: 'batched' fits the label models of every feature (and class balance) at once with
+    BatchedLabelModel, 'snorkel' fits one snorkel LabelModel per feature and class balance,
+    'triplet' estimates the LF accuracies in closed form with TripletLabelModel.
+    Fits are memoized by vote pattern: features with the same votes share one fit.
+    warm_start_ep: with the batched label model, fit the anchor class balance warm_start_cb for snorkel_ep epochs and
+    every other cb for warm_start_ep epochs starting from the parameters of the anchor, so a fit does not depend
+    on which cbs were fit before it (grid, breakpoints or a single cb)
+    '''
+    def __init__(self, G_estimates, snorkel_lr=1e-3, snorkel_ep=100, label_model='batched', warm_start_ep=None, \
+                    warm_start_cb=0.5):
+        assert label_model in LABEL_MODELS
         self.G_estimates = G_estimates
         self.T = 1
         self.lf_names = list(self.G_estimates.keys())
         self.tasks = list(self.G_estimates[self.lf_names[0]].keys())
         self.snorkel_lr = snorkel_lr
         self.snorkel_ep = snorkel_ep
+        self.label_model = label_model
+        self.warm_start_ep = warm_start_ep
+        self.warm_start_cb = float(warm_start_cb)
+        # (vote pattern bytes, cb, lr, epochs or (anchor cb, epochs, warm start epochs)) -> (preds, probs of class 1, mu)
+        self.label_model_fits = {}
+        # n_pca_features -> vote tensor, the LF graphs do not change across cbs
+        self.votes = {}
+        n_pca_features = np.asarray(self.G_estimates[self.lf_names[0]][self.tasks[0]]).shape[0]
+        self.get_votes(n_pca_features)
     
     def get_g_hat_from_edge_preds(self, edge_preds):
         # edge_preds: n_features x n_task
@@ -27,46 +49,103 @@ class COmnivore_V:
     def get_cb(self, cb):
         return np.array([cb] + [0 for i in range(2 ** self.T - 2)] + [1 - cb])
     
+    def get_votes(self, n_pca_features):
+        '''
+        Votes of every LF on every task for every feature: 1 causal path to the label,
+        -1 anti-causal path (abstain), 0 none. Read from the reachability matrix of each LF graph.
+        returns n_features x n_tasks x n_lfs
+        '''
+        if n_pca_features in self.votes:
+            return self.votes[n_pca_features]
+        label_node = n_pca_features -1
+        n_features = n_pca_features - 1
+        L = np.zeros((n_features, len(self.tasks), len(self.lf_names)))
+        for lf_idx, lf_name in enumerate(self.lf_names):
+            for task_idx, task in enumerate(self.tasks):
+                R = reachability(self.G_estimates[lf_name][task])
+                causal_path = R[:n_features, label_node]
+                anti_causal_path = R[label_node, :n_features]
+                L[:, task_idx, lf_idx] = np.where(anti_causal_path, -1., np.where(causal_path, 1., 0.))
+        self.votes[n_pca_features] = L
+        return L
+
+    def is_warm_started(self, cb):
+        return self.label_model == 'batched' and self.warm_start_ep is not None and float(cb) != self.warm_start_cb
+
+    def get_fit_key(self, pattern, cb):
+        n_epochs = self.snorkel_ep
+        if self.is_warm_started(cb):
+            n_epochs = (self.warm_start_cb, self.snorkel_ep, self.warm_start_ep)
+        return (pattern.tobytes(), float(cb), self.snorkel_lr, n_epochs)
+
+    def get_patterns(self, n_pca_features):
+        # unique vote patterns and, for every feature, the index of its pattern
+        L = self.get_votes(n_pca_features)
+        patterns, inverse = np.unique(L.reshape(L.shape[0], -1), axis=0, return_inverse=True)
+        return patterns.reshape((-1,) + L.shape[1:]), inverse.reshape(-1)
+
+    def fit_label_models(self, cbs, n_pca_features):
+        '''
+        Fit the batched label models of every vote pattern for every class balance in cbs,
+        get_ws_edge_prediction then reads the memoized fits
+        '''
+        if self.label_model == 'snorkel':
+            return
+        patterns, _ = self.get_patterns(n_pca_features)
+        is_missing = lambda cb: any([self.get_fit_key(pattern, cb) not in self.label_model_fits for pattern in patterns])
+        missing = [cb for cb in dict.fromkeys(np.atleast_1d(cbs).astype(float).tolist()) if is_missing(cb)]
+        warm = [cb for cb in missing if self.is_warm_started(cb)]
+        cold = [cb for cb in missing if not self.is_warm_started(cb)]
+        if len(warm) > 0 and self.warm_start_cb not in cold and is_missing(self.warm_start_cb):
+            cold.append(self.warm_start_cb)
+        if len(cold) > 0:
+            self.fit_patterns(patterns, cold, self.snorkel_ep)
+        if len(warm) > 0:
+            mu = np.stack([self.label_model_fits[self.get_fit_key(pattern, self.warm_start_cb)][2] for pattern in patterns])
+            self.fit_patterns(patterns, warm, self.warm_start_ep, mu[None])
+
+    def fit_patterns(self, patterns, cbs, n_epochs, mu_init=None):
+        if self.label_model == 'triplet':
+            model = TripletLabelModel(cardinality=2)
+        else:
+            model = BatchedLabelModel(cardinality=2)
+        model.fit(patterns, np.stack([self.get_cb(cb) for cb in cbs]), \
+                    n_epochs=n_epochs, lr=self.snorkel_lr, seed=123, mu_init=mu_init)
+        preds, proba = model.predict(patterns, return_probs=True)
+        for cb_idx, cb in enumerate(cbs):
+            for pattern_idx, pattern in enumerate(patterns):
+                self.label_model_fits[self.get_fit_key(pattern, cb)] = \
+                    (preds[cb_idx, pattern_idx], proba[cb_idx, pattern_idx, :, 1], model.mu[cb_idx, pattern_idx])
+
+    def fit_snorkel(self, L_edge, cb):
+        from snorkel.labeling.model import LabelModel
+        triplet_model = LabelModel(
+            cardinality=2, verbose=False, 
+        )
+        triplet_model.fit(
+            L_edge,
+            n_epochs=self.snorkel_ep, seed=123, lr=self.snorkel_lr,
+            class_balance=self.get_cb(cb), 
+            progress_bar=False
+        )
+        preds = triplet_model.predict(L_edge)
+        proba = triplet_model.predict_proba(L_edge)
+        return preds.flatten(), proba[:,1].flatten(), None
+
     # predict edge for each node to label (e.g., predict whether G is causal (has path) or not to label)
     # will run FS prediction n_node times and get prediction for each node
     def get_ws_edge_prediction(self, cb, n_pca_features):
-        class_balance = self.get_cb(cb)
-        m = len(self.lf_names)
-        v = 1
-        label_node = n_pca_features -1
-        n_features = n_pca_features - 1
-        edge_predictions = []
-        edge_probs = []
-        n_tasks = len(self.tasks)
-        for feat_idx in range(n_features):
-            node = feat_idx
-            L_edge = np.zeros((n_tasks, m))
-            for lf_idx, lf_name in enumerate(self.lf_names):
-                for task_idx, task in enumerate(self.tasks):
-                    lf_g_hat = self.G_estimates[lf_name][task]
-                    causal_path = nx.has_path(nx.DiGraph(lf_g_hat),node,label_node)
-                    anti_causal_path = nx.has_path(nx.DiGraph(lf_g_hat),label_node,node)
-                    if causal_path and not anti_causal_path:
-                        L_edge[task_idx][lf_idx] = 1.
-                    elif anti_causal_path:
-                        L_edge[task_idx][lf_idx] = -1.
-                    else:
-                        L_edge[task_idx][lf_idx] = 0
-            triplet_model = LabelModel(
-                cardinality=2, verbose=False, 
-            )
-            triplet_model.fit(
-                L_edge,
-                n_epochs=self.snorkel_ep, seed=123, lr=self.snorkel_lr,
-                class_balance=class_balance, 
-                progress_bar=False
-            )
-            preds = triplet_model.predict(L_edge)
-            proba = triplet_model.predict_proba(L_edge)
-            edge_predictions.append(preds.flatten())
-            edge_probs.append(proba[:,1].flatten())
-        edge_predictions = np.vstack(edge_predictions) # n_features x n_task
-        edge_probs = np.vstack(edge_probs)
+        patterns, inverse = self.get_patterns(n_pca_features)
+        if self.label_model != 'snorkel':
+            self.fit_label_models([cb], n_pca_features)
+        fits = []
+        for pattern in patterns:
+            key = self.get_fit_key(pattern, cb)
+            if key not in self.label_model_fits:
+                self.label_model_fits[key] = self.fit_snorkel(pattern, cb)
+            fits.append(self.label_model_fits[key])
+        edge_predictions = np.vstack([fits[pattern_idx][0] for pattern_idx in inverse]) # n_features x n_task
+        edge_probs = np.vstack([fits[pattern_idx][1] for pattern_idx in inverse])
         g_hats = self.get_g_hat_from_edge_preds(edge_predictions)
         return g_hats, edge_probs
 
@@ -1,11 +1,13 @@
 import numpy as np
 import torch
 from torch.optim import SGD, Adam, lr_scheduler
-from torch.utils.data import TensorDataset, DataLoader
+from .batch_iterator import TensorBatches, to_tensor, get_device, get_inference_batch_size
 # from torch.autograd import Variable
 import torch.nn.functional as F
 from tqdm import tqdm
 import copy
+from libs.utils.compact_graph import as_compact, graph_key
+from libs.utils.lru_cache import LRUCache
 
 root_dir = "wilds_data"
 cuda = True if torch.cuda.is_available() else False
@@ -13,26 +15,90 @@ cuda = True if torch.cuda.is_available() else False
 
 FloatTensor = torch.cuda.FloatTensor if cuda else torch.FloatTensor
 LongTensor = torch.cuda.LongTensor if cuda else torch.LongTensor
+# node selections kept in CausalClassifier.selection_cache
+MAX_SELECTION_CACHE = 1024
+
+def set_early_stopping(patience=None, eval_interval=1):
+    '''
+    defaults of every end model training: stop after patience validation evaluations without improvement
+    of the tune_by metric (None never stops early), evaluate every eval_interval epochs (and after the last one)
+    '''
+    CausalClassifier.patience = patience
+    CausalClassifier.eval_interval = eval_interval
+
+class BestStateTracker:
+    '''
+    Best model on the validation metric, kept in one copy of the model allocated up front:
+    an improvement copies the state_dict tensors into it instead of deep-copying the module
+    '''
+    def __init__(self, model, patience=None):
+        self.best_chkpt = copy.deepcopy(model)
+        self.buffers = list(self.best_chkpt.state_dict().values())
+        self.patience = patience
+        self.best_val_perf = 0
+        self.best_epoch = 0
+        self.improved = False
+        self.n_bad_evals = 0
+
+    def store(self, model):
+        with torch.no_grad():
+            for buffer, tensor in zip(self.buffers, model.state_dict().values()):
+                buffer.copy_(tensor)
+
+    def update(self, model, val_perf, epoch):
+        if val_perf > self.best_val_perf:
+            self.best_val_perf = val_perf
+            self.best_epoch = epoch
+            self.improved = True
+            self.n_bad_evals = 0
+            self.store(model)
+        else:
+            self.n_bad_evals += 1
+
+    def should_stop(self):
+        return self.patience is not None and self.n_bad_evals >= self.patience
+
+    def get_best(self, model):
+        # the last model when the metric never improved
+        if not self.improved:
+            self.store(model)
+        self.best_chkpt.train(model.training)
+        return self.best_chkpt
 
 class CausalClassifier:
+    # early stopping defaults, see set_early_stopping
+    patience = None
+    eval_interval = 1
+    # graph key -> (nodes_to_train, unsure_nodes), shared by the classifiers built for every task and cb,
+    # the MAX_SELECTION_CACHE most recently used graphs are kept
+    selection_cache = LRUCache(MAX_SELECTION_CACHE)
+    # evaluate in batches sized to the features instead of the training batch size
+    auto_inference_batch = True
+
     def __init__(self, G_causal=None):
         self.G_causal = G_causal
         if G_causal is not None:
-            self.nodes_to_train = self.get_all_label_ancestors(G_causal, G_causal.shape[1]-1)
-            self.unsure_nodes = np.copy(self.nodes_to_train)
-            self.nodes_to_train = self.get_directly_dependent_nodes(G_causal)
-            self.unsure_nodes = np.setdiff1d(self.unsure_nodes, self.nodes_to_train)
+            self.nodes_to_train, self.unsure_nodes = self.select_nodes(G_causal)
 
-    def get_directly_dependent_nodes(self, G_causal):
+    def select_nodes(self, G_causal):
+        '''
+        nodes_to_train: ancestors of the label (last node) that have no other label ancestor as ancestor,
+        unsure_nodes: the other ancestors of the label
+        '''
+        key = graph_key(G_causal)
+        if key not in CausalClassifier.selection_cache:
+            label_ancestors = np.flatnonzero(self.get_ancestors(G_causal, [G_causal.shape[1]-1])[0])
+            ancestors = self.get_ancestors(G_causal, label_ancestors)
+            nodes_to_train = self.get_directly_dependent_nodes(ancestors, label_ancestors)
+            unsure_nodes = np.setdiff1d(label_ancestors, nodes_to_train)
+            CausalClassifier.selection_cache[key] = (nodes_to_train, unsure_nodes)
+        nodes_to_train, unsure_nodes = CausalClassifier.selection_cache[key]
+        return list(nodes_to_train), np.copy(unsure_nodes)
+
+    def get_directly_dependent_nodes(self, ancestors, label_ancestors):
         # does node share a parent with label? if no, put in direct_dependent_node
-        direct_dependent_nodes = []
-        for node in self.nodes_to_train:
-            other_label_parents = np.delete(self.nodes_to_train, np.argwhere(self.nodes_to_train==node))
-            node_parents = self.get_all_label_ancestors(G_causal, node)
-            intersection = list(set(other_label_parents) & set(node_parents))
-            if len(intersection) == 0:
-                direct_dependent_nodes.append(node)
-        return direct_dependent_nodes
+        shared = ancestors[:, label_ancestors].any(axis=1)
+        return label_ancestors[~shared].tolist()
     
     # def get_all_label_ancestors(self, G_causal, label_node):
     #     nodes = np.arange(G_causal.shape[1], dtype=int)[:-1]
@@ -44,43 +110,41 @@ class CausalClassifier:
     #             ancestors.append(node)
     #     return ancestors
 
-    # @jit
+    def get_ancestors(self, G_causal, targets):
+        '''
+        A[i, u]: u is an ancestor of targets[i], same sets as the original parent by parent traversal:
+        the search never goes through the target, does not start from parents the target also points to
+        (u <-> target) and the children of the target are not its ancestors. Self loops are ignored.
+        One breadth first search over the parents of all the targets at once.
+        '''
+        edges = as_compact(G_causal).edges != 0
+        targets = np.asarray(targets, dtype=int)
+        rows = np.arange(len(targets))
+        children = edges[targets]
+        frontier = edges[:, targets].T & ~children
+        frontier[rows, targets] = False
+        reached = frontier.copy()
+        parents_of = edges.T.astype(np.float32)
+        while frontier.any():
+            frontier = (frontier.astype(np.float32) @ parents_of > 0) & ~reached
+            frontier[rows, targets] = False
+            reached |= frontier
+        return reached & ~children
+
     def get_all_label_ancestors(self, G_causal, label_node):
-        assert G_causal.shape[0] == G_causal.shape[1]
-        G_causal[-1,-1] = 0
-        ancestors = np.argwhere(G_causal[:, label_node] != 0).flatten()
-        edge_towards = np.argwhere(G_causal[label_node, :] != 0).flatten()
-        edge_towards = np.array([e for e in edge_towards if e in ancestors])
-        if len(edge_towards) > 0:
-            ancestors = np.delete(ancestors, np.argwhere(ancestors==edge_towards))
-        to_visit = np.copy(ancestors).tolist()
-        visited = set([])
-        while len(to_visit) > 0:
-            # print(to_visit)
-            curr_node = to_visit[0]
-            parents = np.argwhere(G_causal[:, curr_node]).flatten()
-            # is there any edge from the label node to ancestors? if yes, remove from list of ancestors 
-            edge_towards = np.argwhere(G_causal[label_node, :] != 0).flatten()
-            edge_towards = np.array([e for e in edge_towards if e in ancestors])
-            if len(edge_towards) > 0:
-                ancestors = np.delete(ancestors, np.argwhere(ancestors==edge_towards))
-            parents = np.asarray([node for node in parents if node not in visited and node != label_node])
-            ancestors = np.append(ancestors, parents)
-            ancestors = np.unique(ancestors)
-            if len(parents) > 0:
-                to_visit = np.append(to_visit, parents)
-            to_visit = np.unique(to_visit)
-            visited.add(curr_node)
-            to_visit = np.delete(to_visit, np.argwhere(to_visit == curr_node))
-        return list(set(ancestors.astype(int).tolist()))
+        return np.flatnonzero(self.get_ancestors(G_causal, [label_node])[0]).tolist()
 
     def new_loss(self, y_pred, y_true):
         regular_loss_f = torch.nn.CrossEntropyLoss()
         regular_loss = regular_loss_f(y_pred, y_true)
         return regular_loss
 
+    def is_eval_epoch(self, epoch, epochs, eval_interval=None):
+        eval_interval = self.eval_interval if eval_interval is None else eval_interval
+        return (epoch+1) % eval_interval == 0 or epoch == epochs-1
+
     def train(self, model, trainloader, epochs=30, lr = 1e-3, verbose=False, l2_penalty=0.1, valdata=None, metadata_val=None, batch_size=32,\
-        evaluate_func=None, log_freq=50, tune_by_metric='acc_wg'):
+        evaluate_func=None, log_freq=50, tune_by_metric='acc_wg', patience=None, eval_interval=None):
         # optimizer = SGD(model.parameters(), lr, momentum=0.9)
         optimizer = Adam(model.parameters(), lr, weight_decay=1.e-3)
         scheduler = lr_scheduler.CosineAnnealingLR(optimizer, len(trainloader), eta_min=1.e-8)
@@ -88,16 +152,11 @@ class CausalClassifier:
             model = model.cuda()
         model.train()
         val_perf = []
-        best_chkpt = None
-        best_val_perf = 0
-        best_epoch = 0
+        tracker = BestStateTracker(model, self.patience if patience is None else patience)
         for epoch in tqdm(range(epochs)):
             for batch_idx, (data, target) in enumerate(trainloader):
-                if cuda:
-                    data = data.cuda()
-                    target = target.cuda()
-                data = data.type(FloatTensor)
-                target = target.type(LongTensor)
+                # the batches are float32 tensors on the training device
+                target = target.long()
                 optimizer.zero_grad()
                 # Forward pass
                 y_pred = model(data)
@@ -113,20 +172,21 @@ class CausalClassifier:
                 loss += l2
                 loss.backward()
                 optimizer.step()
-            if valdata is not None:
+            if valdata is not None and self.is_eval_epoch(epoch, epochs, eval_interval):
                 outputs_val, labels_val, _, metadata_ = self.evaluate(model, valdata,  metadata=metadata_val, batch_size=batch_size)
                 results_obj_val, results_str_val = evaluate_func(outputs_val, labels_val, metadata_)
                 val_perf.append(results_obj_val)
-                if results_obj_val[tune_by_metric] > best_val_perf:
-                    best_val_perf = results_obj_val[tune_by_metric]
-                    best_chkpt = copy.deepcopy(model)
-                    best_epoch = epoch
+                tracker.update(model, results_obj_val[tune_by_metric], epoch)
                 if (epoch+1) % log_freq == 0:
                     print(f"epoch: {epoch} Val \n {results_str_val}")
+                if tracker.should_stop():
+                    print(f"early stopping at epoch {epoch}")
+                    break
             scheduler.step()
-        if best_chkpt is None:
-            best_chkpt = copy.deepcopy(model)
-        print("BEST EPOCH", best_epoch)
+        # release the validation tensors kept for the evaluations of this training
+        self.eval_loader_cache = None
+        best_chkpt = tracker.get_best(model)
+        print("BEST EPOCH", tracker.best_epoch)
         return model, val_perf, best_chkpt
 
     def features_to_dataloader(self, data, batch_size, nodes_to_train=None, metadata=None, shuffle=True, generator=None):
@@ -136,15 +196,32 @@ class CausalClassifier:
         
         X = data[:, nodes_to_train]
         y = data[:, -1]
-        tensor_x = torch.Tensor(X) # transform to torch tensor
-        tensor_y = torch.Tensor(y)
-        if metadata is None:
-            my_dataset = TensorDataset(tensor_x, tensor_y) # create your datset
-        else:
-            metadata = torch.Tensor(metadata)
-            my_dataset = TensorDataset(tensor_x, tensor_y, metadata) # create your datset
-        my_dataloader = DataLoader(my_dataset, batch_size, shuffle, generator=generator)
+        device = get_device()
+        tensors = [to_tensor(X, device), to_tensor(y, device)]
+        if metadata is not None:
+            # metadata is only collected on the cpu
+            tensors.append(to_tensor(metadata))
+        my_dataloader = TensorBatches(tensors, batch_size, shuffle, generator=generator)
         return my_dataloader, X, y
+
+    def get_eval_loader(self, test_data, batch_size, nodes_to_train=None, metadata=None):
+        '''
+        unshuffled batches of test_data, the tensors of the last evaluated arrays are reused
+        (the validation set is evaluated after every epoch), arrays must not be modified in place in between
+        '''
+        key = (batch_size, None if nodes_to_train is None else tuple(nodes_to_train))
+        cached = getattr(self, 'eval_loader_cache', None)
+        if cached is not None and cached[0] is test_data and cached[1] is metadata and cached[2] == key:
+            return cached[3]
+        if self.auto_inference_batch:
+            n_features = test_data.shape[1]-1 if nodes_to_train is None else len(nodes_to_train)
+            batch_size = get_inference_batch_size(test_data.shape[0], n_features, batch_size)
+        if nodes_to_train is not None:
+            testloader, _,_ = self.features_to_dataloader(test_data, batch_size, nodes_to_train, metadata=metadata, shuffle=False)
+        else:
+            testloader, _,_ = self.features_to_dataloader(test_data, batch_size, metadata=metadata, shuffle=False)
+        self.eval_loader_cache = (test_data, metadata, key, testloader)
+        return testloader
         
     def train_baseline(self, model, train_data, \
                         batch_size=128, lr=1e-3, epochs=20, \
@@ -171,10 +248,7 @@ class CausalClassifier:
     def evaluate(self, model, test_data, batch_size=None, nodes_to_train=None, metadata=None):
         if batch_size == None:
             batch_size = self.batch_size
-        if nodes_to_train is not None:
-            testloader, _,_ = self.features_to_dataloader(test_data, batch_size, nodes_to_train, metadata=metadata, shuffle=False)
-        else:
-            testloader, _,_ = self.features_to_dataloader(test_data, batch_size, metadata=metadata, shuffle=False)
+        testloader = self.get_eval_loader(test_data, batch_size, nodes_to_train, metadata)
         correct = 0
         model.eval()
         y_preds = []
@@ -185,13 +259,10 @@ class CausalClassifier:
             for chunk in testloader:
                 if len(chunk) == 3:
                     test_data, y_true, metadata = chunk
-                    metadata_all.extend(metadata)
+                    metadata_all.append(metadata.numpy())
                 else:
                     test_data, y_true = chunk
                     metadata = None
-                if cuda:
-                    test_data = test_data.cuda()
-                    y_true = y_true.cuda()
                 output = model(test_data)
                 y_pred = F.log_softmax(output, dim=1)
                 
@@ -1,55 +1,81 @@
 from numpy.core.fromnumeric import take
-#from libs.notears.nonlinear import linear, nonlinear
-import libs.notears.nonlinear as nonlinear
-import libs.notears.linear as linear
+import importlib
+from collections.abc import Mapping
 import numpy as np
 
 import pandas as pd
-from pycausal.pycausal import pycausal
-from pycausal import search as s
-
-from causallearn.search.ConstraintBased.FCI import fci
-from causallearn.search.ConstraintBased.PC import pc
-from causallearn.search.ConstraintBased.CDNOD import cdnod
-
-
-from causallearn.utils.cit import fisherz, chisq, kci, gsq, mv_fisherz
-from causallearn.search.ScoreBased.ExactSearch import bic_exact_search
+from .lf_cache import feature_digest
+from libs.utils.logger import log
+from libs.utils.lru_cache import LRUCache
 
 # from causallearn.search.FCMBased.lingam import CAMUV
 # from causallearn.search.FCMBased import GIN
 # from causallearn.search.Granger.Granger import Granger
 
-import lingam
-
-from cdt.causality.graph import GS, MMPC, IAMB, Inter_IAMB
-from cdt.metrics import retrieve_adjacency_matrix
-
 # from cdt.causality.pairwise import RECI
 # from cdt.causality.graph import 
 # from cdt.causality.graph import SAM
 
-from causallearn.search.FCMBased import lingam
+# CI oracles kept by the LF factory, e.g. one per task for the default test
+MAX_CI_ORACLES = 16
+
+# LF name -> (LF method, backend modules imported the first time the LF is requested)
+LF_REGISTRY = {
+    'NoTears Sobolev': ('LF_nonlinear_sobolev', ['libs.notears.nonlinear']),
+    'NoTears MLP': ('LF_nonlinear_mlp', ['libs.notears.nonlinear']),
+    'PC': ('LF_pc', ['causallearn.search.ConstraintBased.PC', 'libs.model.skeleton']),
+    'FCI': ('LF_fci', ['causallearn.search.ConstraintBased.FCI', 'libs.model.skeleton']),
+    'Exact Search': ('LF_bic_exact_search', ['libs.model.exact_search', 'libs.model.skeleton']),
+    'Lingam': ('LF_lingam', ['libs.model.lingam_parallel']),
+    'pycausal': ('LF_pycausal', ['libs.model.pycausal_session']),
+    'MMPC': ('LF_MMPC', ['libs.model.markov_blanket']),
+    'GS': ('LF_GS', ['libs.model.markov_blanket']),
+    'IAMB': ('LF_IAMB', ['libs.model.markov_blanket']),
+    'Inter_IAMB': ('LF_Inter_IAMB', ['libs.model.markov_blanket']),
+    'ICA_Lingam': ('LF_ICA_Lingam', ['causallearn.search.FCMBased.lingam']),
+    'Direct_Lingam': ('LF_Direct_Lingam', ['libs.model.lingam_parallel']),
+    'Var_Lingam': ('LF_Var_Lingam', ['causallearn.search.FCMBased.lingam']),
+    'RCD': ('LF_RCD', ['causallearn.search.FCMBased.lingam']),
+}
+
+class LFRegistry(Mapping):
+    '''
+    Read-only mapping LF name -> LF method of lf_factory. The backend of an LF
+    (pycausal, causal-learn, notears, ...) is imported the first time the LF is requested,
+    so a run only pays for the libraries of the LFs it enables.
+    '''
+    def __init__(self, lf_factory, registry=LF_REGISTRY):
+        self.lf_factory = lf_factory
+        self.registry = dict(registry)
+        self.loaded = set([])
+
+    def register(self, lf_name, method_name, backends=[]):
+        self.registry[lf_name] = (method_name, backends)
+        self.loaded.discard(lf_name)
+
+    def get_method(self, lf_name):
+        # the LF method without importing its backend, e.g. to read its signature
+        return getattr(self.lf_factory, self.registry[lf_name][0])
+
+    def __getitem__(self, lf_name):
+        method_name, backends = self.registry[lf_name]
+        if lf_name not in self.loaded:
+            for backend in backends:
+                importlib.import_module(backend)
+            self.loaded.add(lf_name)
+        return getattr(self.lf_factory, method_name)
+
+    def __iter__(self):
+        return iter(self.registry)
+
+    def __len__(self):
+        return len(self.registry)
 
 class LF:
     def __init__(self):
-        self.lf_dict = {
-            'NoTears Sobolev': self.LF_nonlinear_sobolev,
-            'NoTears MLP': self.LF_nonlinear_mlp,
-            'PC': self.LF_pc,
-            'FCI': self.LF_fci,
-            'Exact Search': self.LF_bic_exact_search,
-            'Lingam': self.LF_lingam,
-            'pycausal': self.LF_pycausal,
-            'MMPC': self.LF_MMPC,
-            'GS': self.LF_GS,
-            'IAMB': self.LF_IAMB,
-            'Inter_IAMB': self.LF_Inter_IAMB,
-            'ICA_Lingam': self.LF_ICA_Lingam,
-            'Direct_Lingam': self.LF_Direct_Lingam, 
-            'Var_Lingam': self.LF_Var_Lingam,
-            'RCD': self.LF_RCD,
-        }
+        self.pycausal_session = None
+        self.ci_oracles = LRUCache(MAX_CI_ORACLES)
+        self.lf_dict = LFRegistry(self)
     
     def get_operating_subgraph(features, dag_manual):
         operating_nodes = np.argwhere(dag_manual[:, -1] ==1).flatten().tolist()
@@ -94,38 +120,41 @@ class LF:
             dag[color_features, -1] = 1
         return dag, color_features
 
-    def LF_linear(self, feature):
+    def LF_linear(self, feature, lambda1=0.1):
         '''
         Linear DAGs with No Tears: https://arxiv.org/pdf/1803.01422.pdf
         https://github.com/xunzheng/notears
         '''
-        W_linear = linear.notears_linear(feature, lambda1=0.1, loss_type='l2')
+        import libs.notears.linear as linear
+        W_linear = linear.notears_linear(feature, lambda1=lambda1, loss_type='l2')
         dag = self.get_adjacency(W_linear)
         processed_cpdag = self.process_cpdag(dag)
         # if np.argwhere(dag_linear < 0).shape[0] > 0:
         #     self.cpdag_to_dags(dag_linear)
         return dag, W_linear, processed_cpdag
     
-    def LF_nonlinear_sobolev(self, feature):
+    def LF_nonlinear_sobolev(self, feature, lambda1=0.01, lambda2=0.01):
         '''
         Sobolev Nonlinear DAGs with No Tears: https://arxiv.org/pdf/1909.13189.pdf
         https://github.com/xunzheng/notears
         '''
+        import libs.notears.nonlinear as nonlinear
         d = feature.shape[1]
         model = nonlinear.NotearsSobolev(d, k=1)
-        W_basis_exp = nonlinear.notears_nonlinear(model, feature.astype(np.float32), lambda1=0.01, lambda2=0.01)
+        W_basis_exp = nonlinear.notears_nonlinear(model, feature.astype(np.float32), lambda1=lambda1, lambda2=lambda2)
         dag = self.get_adjacency(W_basis_exp)
         processed_cpdag = self.process_cpdag(dag)
         return dag, W_basis_exp, processed_cpdag
     
-    def LF_nonlinear_mlp(self, feature):
+    def LF_nonlinear_mlp(self, feature, lambda1=0.01, lambda2=0.01):
         '''
         MLP Nonlinear DAGs with No Tears: https://arxiv.org/pdf/1909.13189.pdf
         https://github.com/xunzheng/notears
         '''
+        import libs.notears.nonlinear as nonlinear
         d = feature.shape[1]
         model = nonlinear.NotearsMLP(dims=[d, 10, 1], bias=True)
-        W_mlp = nonlinear.notears_nonlinear(model, feature.astype(np.float32), lambda1=0.01, lambda2=0.01)
+        W_mlp = nonlinear.notears_nonlinear(model, feature.astype(np.float32), lambda1=lambda1, lambda2=lambda2)
         dag = self.get_adjacency(W_mlp)
         processed_cpdag = self.process_cpdag(dag)
         return dag, W_mlp, processed_cpdag
@@ -136,70 +165,90 @@ class LF:
         In Proceedings of the Twenty-Second Conference on Uncertainty in Artificial Intelligence (pp. 445-452).
         https://github.com/bd2kccd/py-causal
         '''
-        pc = pycausal()
-        pc.start_vm()
-        df = pd.DataFrame(feature)
-        tetrad = s.tetradrunner()
-        tetrad.run(algoId, dfs = df, scoreId = 'sem-bic', dataType = 'continuous',
-                maxDegree = -1, faithfulnessAssumed = True, verbose = True)
-        graph = tetrad.getTetradGraph()
-        dot_str = pc.tetradGraphToDot(graph)
-        matrix = np.zeros((feature.shape[1], feature.shape[1]))
-        lines = dot_str.split("\n")
-        for edge in lines[1:-1]:
-            source=int(edge.split("->")[0].strip().rstrip()[1])
-            dest = int(edge.split("->")[1].strip().rstrip()[1])
-            relation = edge.split("->")[1].strip().rstrip()[5:-2].split(", ")
-            for item in relation:
-                if 'arrowhead' in item:
-                    arrowhead = item.split('=')[1]
-                elif 'arrowtail' in item:
-                    arrowtail = item.split('=')[1]
-            if arrowhead == 'none' and arrowtail == 'none':
-                matrix[source,dest] = 0
-            elif arrowhead == 'none' and arrowtail == 'normal':
-                matrix[dest, source] = 1
-            else:
-                matrix[source,dest] = 1
-        return matrix
+        return self.get_pycausal_session().run(feature, algoId)
+
+    def LF_pycausal_batch(self, features, algo_ids):
+        '''
+        Run all Tetrad algorithms on all tasks (features: dict task -> feature array) in one session
+        '''
+        return self.get_pycausal_session().run_batch(features, algo_ids)
+
+    def get_pycausal_session(self):
+        if self.pycausal_session is None:
+            from .pycausal_session import PycausalSession
+            self.pycausal_session = PycausalSession()
+        return self.pycausal_session
     
-    def LF_fci(self, feature, score_func=mv_fisherz, p_threshold=0.04):
+    def get_ci_oracle(self, feature, score_func=None):
+        '''
+        CI oracle shared by every constraint based LF running on the same features.
+        score_func None is mv_fisherz, the test of the original PC and FCI LFs; fisherz (two-sided p-values) is opt-in.
+        The oracles of the MAX_CI_ORACLES most recently used (features, test) pairs are kept.
+        '''
+        from .ci_oracle import CIOracle, CI_TESTS, get_ci_test
+        score_func = get_ci_test(score_func if score_func is not None else 'mv_fisherz')
+        key = (feature_digest(feature), score_func.__name__)
+        if key not in self.ci_oracles:
+            self.ci_oracles[key] = CIOracle(feature, score_func)
+        return self.ci_oracles[key]
+
+    def LF_fci(self, feature, score_func=None, p_threshold=0.04, stable=False, n_workers=1):
         '''
         Fast Causal Inference: Spirtes, P., Meek, C., & Richardson, T. (1995, August). 
         Causal inference in the presence of latent variables and selection bias. In Proceedings of the Eleventh conference on Uncertainty in artificial intelligence (pp. 499-506)
 
-        Score func can be either one of: fisherz, chisq, kci, gsq, mv_fisherz
+        Score func can be either one of: fisherz, chisq, kci, gsq, mv_fisherz, None is mv_fisherz
+        stable=True runs the adjacency search through stable_skeleton, with its CI tests spread over n_workers processes.
+        causal-learn's adjacency search is already stable, the graph is the same as with stable=False
         https://causal-learn.readthedocs.io/en/latest/search_methods_index/Constrained-based%20causal%20discovery%20methods/FCI.html#id3 
         '''
-        G = fci(feature, score_func, p_threshold, verbose=False)
+        from causallearn.search.ConstraintBased.FCI import fci
+        from .skeleton import stable_fas
+        ci_oracle = self.get_ci_oracle(feature, score_func)
+        if stable:
+            with stable_fas(n_workers):
+                G = fci(feature, ci_oracle, p_threshold, verbose=False)
+        else:
+            G = fci(feature, ci_oracle, p_threshold, verbose=False)
         return self.get_adjacency(G[0].__dict__['graph'])
     
-    def LF_pc(self, feature, score_func=mv_fisherz, p_threshold=0.04, uc_rule=0):
+    def LF_pc(self, feature, score_func=None, p_threshold=0.04, uc_rule=0, n_workers=1):
         '''
         PC algorithm: Spirtes, P., Glymour, C. N., Scheines, R., & Heckerman, D. (2000). Causation, prediction, and search. MIT press. 
-        Score func can be either one of: fisherz, chisq, kci, gsq, mv_fisherz
+        Score func can be either one of: fisherz, chisq, kci, gsq, mv_fisherz, None is mv_fisherz
         uc_rule can be 0,1,2 
+        n_workers > 1 spreads the CI tests of each depth of the (stable) skeleton search over worker processes
         https://causal-learn.readthedocs.io/en/latest/search_methods_index/Constrained-based%20causal%20discovery%20methods/PC.html
         '''
-        cg = pc(feature, p_threshold, score_func, True, uc_rule, -1)
+        from causallearn.search.ConstraintBased.PC import pc
+        from .skeleton import pc_parallel
+        ci_oracle = self.get_ci_oracle(feature, score_func)
+        if n_workers > 1:
+            cg = pc_parallel(feature, p_threshold, ci_oracle, uc_rule, -1, n_workers=n_workers)
+        else:
+            cg = pc(feature, p_threshold, ci_oracle, True, uc_rule, -1)
         return cg.G.dpath
     
     def LF_ICA_Lingam(self, feature):
+        from causallearn.search.FCMBased import lingam
         model = lingam.ICALiNGAM()
         model.fit(feature)
         return model.adjacency_matrix_
 
-    def LF_Direct_Lingam(self, feature):
-        model = lingam.DirectLiNGAM()
+    def LF_Direct_Lingam(self, feature, n_workers=1):
+        from .lingam_parallel import ParallelDirectLiNGAM
+        model = ParallelDirectLiNGAM(n_workers=n_workers)
         model.fit(feature)
         return model.adjacency_matrix_
 
     def LF_Var_Lingam(self, feature):
+        from causallearn.search.FCMBased import lingam
         model = lingam.VARLiNGAM()
         model.fit(feature)
         return model.adjacency_matrices_[0]
     
     def LF_RCD(self, feature):
+        from causallearn.search.FCMBased import lingam
         model = lingam.RCD()
         model.fit(feature)
         return model.adjacency_matrix_
@@ -209,47 +258,76 @@ class LF:
         output = obj.predict(pd.DataFrame(feature))
         return output
 
-    def LF_bic_exact_search(self, feature):
+    def LF_bic_exact_search(self, feature, super_structure=None, alpha=0.04, max_parents=None, max_vars=20, max_degree=5, \
+                            time_budget=600, return_mode=False):
         '''
         Exact Search: Silander, T., & Myllymäki, P. (2006, July). A simple approach for finding the globally optimal Bayesian network structure. 
         In Proceedings of the Twenty-Second Conference on Uncertainty in Artificial Intelligence (pp. 445-452).
 
+        super_structure restricts the parents of each node to its neighbours in the stable PC skeleton (CI tests at level alpha),
+        None applies it only with more than max_vars variables. max_parents caps the parent set size.
+        Up to max_vars variables the search is exact, over the super-structure if super_structure=True.
+        Above max_vars it is exact only over a super-structure whose nodes have at most max_degree neighbours.
+        Otherwise, or when the search takes longer than time_budget seconds, a greedy BIC search
+        (over the super-structure, if any) is used instead.
+        return_mode=True also returns the mode that produced the graph (exact_search.EXACT or GREEDY).
         https://causal-learn.readthedocs.io/en/latest/search_methods_index/Score-based%20causal%20discovery%20methods/ExactSearch.html 
         '''
-        dag_est, _ = bic_exact_search(feature)
+        from .skeleton import stable_skeleton
+        from .exact_search import budgeted_exact_search
+        super_graph = None
+        if super_structure is None:
+            super_structure = feature.shape[1] > max_vars
+        if super_structure:
+            adjacency, _ = stable_skeleton(self.get_ci_oracle(feature), alpha)
+            super_graph = adjacency.astype(int)
+        dag_est, mode = budgeted_exact_search(feature, super_graph, max_parents, max_vars, time_budget, max_degree)
+        log(f"Exact Search: {mode} search on {feature.shape[1]} variables")
+        if return_mode:
+            return dag_est, mode
         return dag_est
     
-    def LF_lingam(self, feature):
+    def LF_lingam(self, feature, n_workers=1):
         '''
         Lingam: https://sites.google.com/view/sshimizu06/lingam
+        DirectLiNGAM with the causal order search vectorized and spread over n_workers threads
         '''
-        model = lingam.DirectLiNGAM()
+        from .lingam_parallel import ParallelDirectLiNGAM
+        model = ParallelDirectLiNGAM(n_workers=n_workers)
         model.fit(feature)
         return model.adjacency_matrix_
     
-    def LF_MMPC(self, feature):
-        obj = MMPC()
-        output = obj.predict(pd.DataFrame(feature))
-        dag = retrieve_adjacency_matrix(output)
-        return dag
+    def LF_MMPC(self, feature, score_func='fisherz', alpha=0.05):
+        '''
+        Max-Min Parents and Children: Tsamardinos, I., Brown, L. E., & Aliferis, C. F. (2006). The max-min hill-climbing Bayesian network structure learning algorithm.
+        Native implementation on the shared CI oracle, returns the undirected skeleton like bnlearn's mmpc.
+        The defaults of the MB LFs follow cdt 0.5.23 / bnlearn: alpha=0.05 and a two-sided Gaussian test (fisherz)
+        '''
+        from . import markov_blanket
+        return markov_blanket.mmpc(self.get_ci_oracle(feature, score_func), alpha)
     
-    def LF_GS(self, feature):
-        obj = GS()
-        output = obj.predict(pd.DataFrame(feature))
-        dag = retrieve_adjacency_matrix(output)
-        return dag
+    def LF_GS(self, feature, score_func='fisherz', alpha=0.05):
+        '''
+        Grow-Shrink: Margaritis, D., & Thrun, S. (1999). Bayesian network induction via local neighborhoods.
+        Native implementation on the shared CI oracle
+        '''
+        from . import markov_blanket
+        return markov_blanket.gs(self.get_ci_oracle(feature, score_func), alpha)
 
-    def LF_IAMB(self, feature):
-        obj = IAMB()
-        output = obj.predict(pd.DataFrame(feature))
-        dag = retrieve_adjacency_matrix(output)
-        return dag
+    def LF_IAMB(self, feature, score_func='fisherz', alpha=0.05):
+        '''
+        Incremental Association Markov Blanket: Tsamardinos, I., Aliferis, C. F., & Statnikov, A. (2003). Algorithms for Large Scale Markov Blanket Discovery.
+        Native implementation on the shared CI oracle
+        '''
+        from . import markov_blanket
+        return markov_blanket.iamb(self.get_ci_oracle(feature, score_func), alpha)
     
-    def LF_Inter_IAMB(self, feature):
-        obj = Inter_IAMB()
-        output = obj.predict(pd.DataFrame(feature))
-        dag = retrieve_adjacency_matrix(output)
-        return dag
+    def LF_Inter_IAMB(self, feature, score_func='fisherz', alpha=0.05):
+        '''
+        Interleaved IAMB, native implementation on the shared CI oracle
+        '''
+        from . import markov_blanket
+        return markov_blanket.inter_iamb(self.get_ci_oracle(feature, score_func), alpha)
 
 # lf = LF()
 
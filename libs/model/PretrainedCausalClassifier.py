@@ -14,6 +14,9 @@ class Resnet50_Extractor(nn.Module):
         return clf
     
 class PretrainedCausalClf(CausalClassifier):
+    # the resnet keeps the given batch size at inference
+    auto_inference_batch = False
+
     def __init__(self, dataset_name, model_path):
         super(CausalClassifier, self).__init__()
         self.model = self.initialize_torchvision_model(
@@ -1,12 +1,12 @@
 import torch
 import numpy as np
 from tqdm import tqdm
-from .CausalClassifier import CausalClassifier
+from .CausalClassifier import CausalClassifier, BestStateTracker
 from torch.optim import SGD, Adam, lr_scheduler
 # from torch.autograd import Variable
 import torch.nn.functional as F
 from tqdm import tqdm
-from torch.utils.data import TensorDataset, DataLoader
+from .batch_iterator import TensorBatches, to_tensor, get_device
 import copy
 from libs.utils.logger import log
 
@@ -134,7 +134,7 @@ class WeightedCausalClassifier(CausalClassifier):
                 valdata=None, metadata_val=None,\
                 evaluate_func=None, \
                 batch_size=64, log_freq=20,\
-                tune_by_metric='acc_wg'):
+                tune_by_metric='acc_wg', patience=None, eval_interval=None):
         optimizer = SGD(model.parameters(), lr, momentum=0.8)
         # optimizer = Adam(model.parameters(), lr, weight_decay=1.e-5)
         scheduler = lr_scheduler.CosineAnnealingLR(optimizer, len(trainloader), eta_min=1.e-8)
@@ -142,9 +142,7 @@ class WeightedCausalClassifier(CausalClassifier):
             model = model.cuda()
         model.train()
         val_perf = []
-        best_val_perf = 0
-        best_chkpt = None
-        best_epoch = 0
+        tracker = BestStateTracker(model, self.patience if patience is None else patience)
         for epoch in tqdm(range(epochs)):
             metadata_all = []
             for _, chunk in enumerate(trainloader):
@@ -155,13 +153,8 @@ class WeightedCausalClassifier(CausalClassifier):
                 else:
                     data, target = chunk
                     weights = None
-                if cuda:
-                    data = data.cuda()
-                    target = target.cuda()
-                    if weights is not None:
-                        weights = weights.cuda()
-                data = data.type(FloatTensor)
-                target = target.type(LongTensor)
+                # the batches are float32 tensors on the training device
+                target = target.long()
                 optimizer.zero_grad()
                 # Forward pass
                 y_pred = model(data)
@@ -178,21 +171,22 @@ class WeightedCausalClassifier(CausalClassifier):
                 loss += l2
                 loss.backward()
                 optimizer.step()
-            if valdata is not None:
+            if valdata is not None and self.is_eval_epoch(epoch, epochs, eval_interval):
                 outputs_, labels_, _, metadata_ = self.evaluate(model, valdata, metadata=metadata_val, batch_size=batch_size)
                 results_obj_, results_str_ = evaluate_func(outputs_, labels_, metadata_)
                 val_perf.append(results_obj_)
-                if results_obj_[tune_by_metric] > best_val_perf:
-                    best_val_perf = results_obj_[tune_by_metric]
-                    best_chkpt = copy.deepcopy(model)
-                    best_epoch = epoch
+                tracker.update(model, results_obj_[tune_by_metric], epoch)
                 if verbose and (epoch+1)%log_freq == 0:
                     print(f"Epoch: {epoch} \n {results_str_}")
+                if tracker.should_stop():
+                    print(f"early stopping at epoch {epoch}")
+                    break
             # scheduler.step()        
-        if best_chkpt is None:
-            best_chkpt = copy.deepcopy(model)
+        # release the validation tensors kept for the evaluations of this training
+        self.eval_loader_cache = None
+        best_chkpt = tracker.get_best(model)
         if valdata is not None:
-            print("BEST EPOCH", best_epoch)
+            print("BEST EPOCH", tracker.best_epoch)
         return model, best_chkpt
     
     def train_end_model(self, model, train_data, evaluate_func, points_weights=None, valdata=None, metadata_val=None,\
@@ -213,19 +207,12 @@ class WeightedCausalClassifier(CausalClassifier):
         points_weights = np.array(points_weights)
         X = data[:, :-1]
         y = data[:, -1]
-        tensor_x = torch.Tensor(X) # transform to torch tensor
-        tensor_y = torch.Tensor(y)
-        if len(points_weights) == 0 and metadata is None:
-            my_dataset = TensorDataset(tensor_x,tensor_y) # create your datset
-        elif len(points_weights) > 0 and metadata is None:
-            points_weights = torch.Tensor(points_weights).reshape(-1,1)
-            my_dataset = TensorDataset(tensor_x,tensor_y, points_weights)
-        elif len(points_weights) == 0 and metadata is not None:
-            metadata = torch.Tensor(metadata)
-            my_dataset = TensorDataset(tensor_x,tensor_y, metadata)
-        else:
-            metadata = torch.Tensor(metadata)
-            points_weights = torch.Tensor(points_weights).reshape(-1,1)
-            my_dataset = TensorDataset(tensor_x,tensor_y, points_weights, metadata)
-        my_dataloader = DataLoader(my_dataset, batch_size, shuffle) 
-        return my_dataloader, X, y
\ No newline at end of file
+        device = get_device()
+        tensors = [to_tensor(X, device), to_tensor(y, device)]
+        if len(points_weights) > 0:
+            tensors.append(to_tensor(points_weights, device).reshape(-1,1))
+        if metadata is not None:
+            # metadata is only collected on the cpu
+            tensors.append(to_tensor(metadata))
+        my_dataloader = TensorBatches(tensors, batch_size, shuffle)
+        return my_dataloader, X, y
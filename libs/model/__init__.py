@@ -1,8 +1,27 @@
+import importlib
+
 from .model import select_model
 from .CausalClassifier import CausalClassifier
-from .PretrainedCausalClassifier import PretrainedCausalClf
 from .WeightedCausalClassifier import WeightedCausalClassifier
 from .model_backbone import MLP, CLIPMLP
 from .train_tools import *
-from .Phi import Phi, Extractor_CLIP, Extractor_CNN, Extractor_VAE
 from .Spuriousness_Profiler import Spuriousness_Profiler
+
+# feature extractors pull in transformers / torchvision, they are imported on first access
+_LAZY_ATTRIBUTES = {
+    'Phi': '.Phi',
+    'Extractor_CLIP': '.Phi',
+    'Extractor_CNN': '.Phi',
+    'Extractor_VAE': '.Phi',
+    'PretrainedCausalClf': '.PretrainedCausalClassifier',
+}
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(_LAZY_ATTRIBUTES[name], __name__)
+    # importing the submodule .Phi binds the module to `Phi`, rebind the classes over it
+    for attribute, module_name in _LAZY_ATTRIBUTES.items():
+        if module_name == _LAZY_ATTRIBUTES[name]:
+            globals()[attribute] = getattr(module, attribute)
+    return globals()[name]
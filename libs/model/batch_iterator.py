@@ -0,0 +1,54 @@
+import math
+import numpy as np
+import torch
+
+# elements (rows x features) per inference batch, 64MB of float32
+INFERENCE_BATCH_ELEMENTS = 2 ** 24
+
+def get_device():
+    return torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+def to_tensor(array, device=None):
+    '''
+    float32 tensor of array, zero copy on the cpu when array is already a contiguous float32 array
+    '''
+    tensor = torch.from_numpy(np.ascontiguousarray(array, dtype=np.float32))
+    if device is not None:
+        tensor = tensor.to(device)
+    return tensor
+
+def get_inference_batch_size(n_rows, n_features, min_batch_size=1):
+    # batches of about INFERENCE_BATCH_ELEMENTS elements, the whole set when it fits
+    batch_size = max(min_batch_size or 1, INFERENCE_BATCH_ELEMENTS // max(n_features, 1))
+    return max(1, min(batch_size, n_rows))
+
+class TensorBatches:
+    '''
+    DataLoader replacement for in-memory features: the tensors are moved to their device once and every
+    epoch slices minibatches out of them, shuffling with one index permutation (drawn from generator if given).
+    tensors: tensors with the same number of rows, each is sliced on its own device
+    (e.g. features on the gpu, metadata on the cpu).
+    '''
+    def __init__(self, tensors, batch_size, shuffle=True, generator=None):
+        self.tensors = list(tensors)
+        self.n_rows = self.tensors[0].shape[0]
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.generator = generator
+
+    def __len__(self):
+        return math.ceil(self.n_rows / self.batch_size)
+
+    def __iter__(self):
+        if not self.shuffle:
+            for start in range(0, self.n_rows, self.batch_size):
+                yield tuple([tensor[start:start + self.batch_size] for tensor in self.tensors])
+            return
+        permutation = torch.randperm(self.n_rows, generator=self.generator)
+        # one copy of the permutation per device
+        indices = {}
+        for tensor in self.tensors:
+            if tensor.device not in indices:
+                indices[tensor.device] = permutation.to(tensor.device)
+        for start in range(0, self.n_rows, self.batch_size):
+            yield tuple([tensor[indices[tensor.device][start:start + self.batch_size]] for tensor in self.tensors])
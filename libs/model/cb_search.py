@@ -0,0 +1,137 @@
+import numpy as np
+from libs.utils.logger import log
+
+GRID = 'grid'
+BREAKPOINTS = 'breakpoints'
+CB_SEARCH_MODES = [GRID, BREAKPOINTS]
+
+def get_cb_grid(cb_range):
+    # all_negative_balance: [start, stop, step]
+    return np.arange(cb_range[0], cb_range[1], cb_range[2])
+
+def get_nodes_key(pca_nodes):
+    # hashable key of the selected nodes of every task, equal keys pass test_duplicate_nodes
+    return tuple([(task, tuple(np.sort(pca_nodes[task]).tolist())) for task in sorted(pca_nodes)])
+
+class CBSearch:
+    '''
+    Finds the cb values of a grid where the fused graph changes without training on every cb.
+    regime_func(cb) returns a hashable key of the fused graph (e.g. get_nodes_key of the selected nodes),
+    it only runs the label models so probing is cheap compared to an end model training.
+    n_probes evenly spaced grid points are probed first (fit in one batch by prefit(cbs) if given),
+    then every interval between probes with different keys is bisected down to adjacent grid points.
+    A regime that starts and ends between two probes with the same key is not found,
+    raise n_probes when the selected nodes are not monotone in cb.
+    '''
+    def __init__(self, grid, regime_func, n_probes=8, prefit=None):
+        self.grid = np.asarray(grid)
+        self.regime_func = regime_func
+        self.n_probes = n_probes
+        self.prefit = prefit
+        # grid index -> key
+        self.keys = {}
+        self.regimes = None
+
+    def get_key(self, idx):
+        if idx not in self.keys:
+            self.keys[idx] = self.regime_func(self.grid[idx])
+        return self.keys[idx]
+
+    def bisect(self, lo, hi):
+        # keys of lo and hi differ, probe until every change between them is located
+        if hi - lo <= 1:
+            return
+        mid = (lo + hi) // 2
+        key = self.get_key(mid)
+        if key != self.get_key(lo):
+            self.bisect(lo, mid)
+        if key != self.get_key(hi):
+            self.bisect(mid, hi)
+
+    def find_regimes(self):
+        '''
+        returns [(first grid index, last grid index, key)] of every run of equal keys, in grid order
+        '''
+        if self.regimes is not None:
+            return self.regimes
+        n = len(self.grid)
+        self.regimes = []
+        if n == 0:
+            return self.regimes
+        probes = np.unique(np.linspace(0, n - 1, min(max(self.n_probes, 2), n)).round().astype(int)).tolist()
+        if self.prefit is not None:
+            self.prefit(self.grid[probes])
+        for lo, hi in zip(probes[:-1], probes[1:]):
+            if self.get_key(lo) != self.get_key(hi):
+                self.bisect(lo, hi)
+        # probes with different keys are adjacent now, a run starts at its first probe
+        probed = sorted(self.keys.keys())
+        starts = [idx for i, idx in enumerate(probed) if i == 0 or self.keys[idx] != self.keys[probed[i - 1]]]
+        ends = [start - 1 for start in starts[1:]] + [n - 1]
+        self.regimes = [(start, end, self.keys[start]) for start, end in zip(starts, ends)]
+        log(f"cb search: {len(self.regimes)} regimes, {len(probed)} of {n} cb values probed")
+        return self.regimes
+
+    def get_cbs(self):
+        '''
+        first cb of every distinct regime, the cb a full grid sweep would train for these nodes
+        '''
+        cbs = []
+        seen = set()
+        for start, _, key in self.find_regimes():
+            if key in seen:
+                continue
+            seen.add(key)
+            cbs.append(self.grid[start])
+        return np.array(cbs)
+
+    def get_regime(self, cb):
+        # grid indices (first, last) of the regime of cb
+        idx = int(np.argmin(np.abs(self.grid - cb)))
+        for start, end, _ in self.find_regimes():
+            if start <= idx <= end:
+                return start, end
+
+def golden_section_search(f, lo, hi, n_iters, values=None):
+    '''
+    Maximizes f over the integers lo ... hi with at most n_iters new evaluations, assuming f unimodal there.
+    values: known {index: f(index)}, f returning None counts as -inf.
+    returns {index: f(index)} of every evaluated index
+    '''
+    values = {} if values is None else dict(values)
+    n_evals = [0]
+    def evaluate(idx):
+        if idx not in values:
+            values[idx] = f(idx)
+            n_evals[0] += 1
+        return float('-inf') if values[idx] is None else values[idx]
+    inv_phi = (np.sqrt(5) - 1) / 2
+    a, b = lo, hi
+    while b - a >= 3 and n_evals[0] < n_iters:
+        c = a + int(round((1 - inv_phi) * (b - a)))
+        d = a + int(round(inv_phi * (b - a)))
+        d = max(d, c + 1)
+        if evaluate(c) >= evaluate(d):
+            b = d
+        else:
+            a = c
+    for idx in range(a, b + 1):
+        if n_evals[0] >= n_iters:
+            break
+        evaluate(idx)
+    return values
+
+def get_cb_search(cb_range, regime_func, comnivore_params, prefit=None):
+    '''
+    cb values to train: the whole grid with cb_search 'grid', the first cb of every regime with 'breakpoints'
+    returns (cbs, CBSearch or None)
+    '''
+    grid = get_cb_grid(cb_range)
+    mode = comnivore_params.get('cb_search', GRID)
+    assert mode in CB_SEARCH_MODES
+    if mode == GRID:
+        if prefit is not None:
+            prefit(grid)
+        return grid, None
+    search = CBSearch(grid, regime_func, comnivore_params.get('cb_probes', 8), prefit)
+    return search.get_cbs(), search
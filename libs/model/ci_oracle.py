@@ -0,0 +1,114 @@
+from math import log, sqrt
+
+import numpy as np
+from scipy.stats import norm
+from causallearn.utils.cit import fisherz, chisq, kci, gsq, mv_fisherz
+
+CI_TESTS = {
+    'fisherz': fisherz,
+    'mv_fisherz': mv_fisherz,
+    'chisq': chisq,
+    'kci': kci,
+    'gsq': gsq,
+}
+
+class CIOracle:
+    '''
+    Conditional independence oracle for the PCA features of one task, shared by the
+    constraint based LFs. The correlation matrix is computed once and every
+    (x, y, conditioning set) p-value is memoized, so PC, FCI, ... pay for each test once.
+
+    Can be passed wherever causal-learn expects an independence test function.
+    The default test is mv_fisherz, as in the original PC and FCI LFs. Without missing values
+    fisherz and mv_fisherz are computed on the shared correlation matrix, each with its own
+    p-value: 1 - cdf(|z|) for mv_fisherz, 2 * (1 - cdf(|z|)) for fisherz.
+    '''
+    def __init__(self, data, test=None):
+        self.data = data
+        self.n_samples, self.n_vars = data.shape
+        self.has_missing = bool(np.isnan(data).any())
+        if test is None:
+            test = mv_fisherz
+        self.test = test
+        # causal-learn dispatches on the test name
+        self.__name__ = test.__name__
+        self.use_correlation = test in [fisherz, mv_fisherz] and not self.has_missing
+        self.n_sides = 2 if test is fisherz else 1
+        if self.use_correlation:
+            self.covariance = np.cov(data, rowvar=False)
+            self.correlation = np.corrcoef(data, rowvar=False)
+            self.precision = np.linalg.pinv(self.correlation)
+        self.pvalues = {}
+        self.n_tests = 0
+        self.n_cached = 0
+
+    def __call__(self, data, X, Y, condition_set, *args, **kwargs):
+        if data is not None and data.shape != self.data.shape:
+            return self.test(data, X, Y, condition_set)
+        return self.pvalue(X, Y, condition_set)
+
+    def get_key(self, X, Y, condition_set):
+        X, Y = (X, Y) if X < Y else (Y, X)
+        return (X, Y, frozenset([int(s) for s in condition_set]))
+
+    def pvalue(self, X, Y, condition_set=()):
+        key = self.get_key(X, Y, condition_set)
+        if key in self.pvalues:
+            self.n_cached += 1
+            return self.pvalues[key]
+        self.n_tests += 1
+        condition_set = tuple(sorted(key[2]))
+        if self.use_correlation:
+            p = self.fisherz(key[0], key[1], condition_set)
+        else:
+            p = self.test(self.data, key[0], key[1], condition_set)
+        self.pvalues[key] = p
+        return p
+
+    def pvalue_vector(self, X, candidates, condition_set=()):
+        '''
+        p-values of X _||_ c | condition_set for every c in candidates, computed in one
+        pass from the conditional correlation matrix given condition_set
+        '''
+        candidates = [int(c) for c in candidates]
+        condition_set = [int(s) for s in condition_set]
+        if len(candidates) == 0:
+            return np.zeros(0)
+        if not self.use_correlation:
+            return np.array([self.pvalue(X, c, condition_set) for c in candidates])
+        var = [X] + candidates
+        conditional = self.correlation[np.ix_(var, var)]
+        if len(condition_set) > 0:
+            cross = self.correlation[np.ix_(var, condition_set)]
+            conditional = conditional - cross @ np.linalg.solve(self.correlation[np.ix_(condition_set, condition_set)], cross.T)
+        r = conditional[0, 1:] / np.sqrt(conditional[0, 0] * np.diag(conditional)[1:])
+        r = np.clip(r, -1 + 1e-12, 1 - 1e-12)
+        Z = 0.5 * np.log((1 + r) / (1 - r))
+        stat = sqrt(max(self.n_samples - len(condition_set) - 3, 0)) * np.abs(Z)
+        p = self.n_sides * (1 - norm.cdf(stat))
+        for c, p_c in zip(candidates, p):
+            self.pvalues[self.get_key(X, c, condition_set)] = p_c
+        self.n_tests += len(candidates)
+        return p
+
+    def partial_correlation(self, X, Y, condition_set):
+        if len(condition_set) == self.n_vars - 2:
+            # conditioning on every other variable, read it from the precision matrix
+            inv = self.precision[np.ix_([X, Y], [X, Y])]
+        else:
+            var = [X, Y] + list(condition_set)
+            inv = np.linalg.inv(self.correlation[np.ix_(var, var)])
+        return -inv[0, 1] / sqrt(inv[0, 0] * inv[1, 1])
+
+    def fisherz(self, X, Y, condition_set):
+        # same statistic as causallearn.utils.cit.fisherz / mv_fisherz without missing values
+        r = self.partial_correlation(X, Y, condition_set)
+        Z = 0.5 * log((1 + r) / (1 - r))
+        X = sqrt(self.n_samples - len(condition_set) - 3) * abs(Z)
+        p = self.n_sides * (1 - norm.cdf(abs(X)))
+        return p
+
+def get_ci_test(score_func):
+    if isinstance(score_func, str):
+        return CI_TESTS[score_func]
+    return score_func
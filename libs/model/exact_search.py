@@ -0,0 +1,161 @@
+import time
+import multiprocessing as mp
+from queue import Empty
+
+import numpy as np
+from causallearn.search.ScoreBased.ExactSearch import bic_exact_search
+
+'''
+Exact Search under a size and time budget. The search space is restricted to a
+super-structure (a cheap CI skeleton) and to at most max_parents parents per node;
+when the problem is too large (too many variables and no sparse enough super-structure)
+or the search runs out of time, a greedy BIC hill climbing over the same super-structure is used instead.
+'''
+
+EXACT = 'exact'
+GREEDY = 'greedy'
+
+def _exact_search_worker(queue, feature, super_graph, max_parents):
+    try:
+        dag, _ = bic_exact_search(feature, super_graph=super_graph, max_parents=max_parents)
+        queue.put(dag)
+    except Exception as e:
+        queue.put(e)
+
+def exact_search_with_budget(feature, super_graph=None, max_parents=None, time_budget=None):
+    '''
+    Returns the exact search DAG, or None when it does not finish within time_budget seconds
+    '''
+    if time_budget is None:
+        dag, _ = bic_exact_search(feature, super_graph=super_graph, max_parents=max_parents)
+        return dag
+    ctx = mp.get_context('fork')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_exact_search_worker, args=(queue, feature, super_graph, max_parents))
+    process.start()
+    start = time.time()
+    result = None
+    try:
+        while time.time() - start < time_budget:
+            try:
+                result = queue.get(timeout=min(1., time_budget))
+                break
+            except Empty:
+                if not process.is_alive() and queue.empty():
+                    break
+    finally:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+class LocalBIC:
+    '''
+    Memoized BIC of a node given its parents for linear Gaussian data (lower is better),
+    the same score as causal-learn's bic_score_node: no centering and no intercept
+    '''
+    def __init__(self, feature):
+        self.X = np.asarray(feature)
+        self.n_samples = self.X.shape[0]
+        self.scores = {}
+
+    def __call__(self, node, parents):
+        key = (node, frozenset(parents))
+        if key not in self.scores:
+            y = self.X[:, node]
+            if len(parents) > 0:
+                X_pa = self.X[:, sorted(parents)]
+                beta = np.linalg.lstsq(X_pa, y, rcond=None)[0]
+                y = y - X_pa @ beta
+            rss = max(y @ y, 1e-12)
+            self.scores[key] = self.n_samples * np.log(rss / self.n_samples) + len(parents) * np.log(self.n_samples)
+        return self.scores[key]
+
+def has_path(dag, source, target):
+    visited = np.zeros(dag.shape[0], dtype=bool)
+    stack = [source]
+    while len(stack) > 0:
+        node = stack.pop()
+        if node == target:
+            return True
+        if visited[node]:
+            continue
+        visited[node] = True
+        stack.extend(np.flatnonzero(dag[node] & ~visited))
+    return False
+
+def greedy_bic_search(feature, super_graph=None, max_parents=None, max_iter=1000):
+    '''
+    Hill climbing over edge additions, removals and reversals, taking the best BIC
+    improvement at each step. super_graph[i, j] = 1 allows i -> j.
+    '''
+    n_vars = feature.shape[1]
+    local_bic = LocalBIC(feature)
+    if super_graph is None:
+        allowed = ~np.eye(n_vars, dtype=bool)
+    else:
+        allowed = np.asarray(super_graph).astype(bool)
+    if max_parents is None:
+        max_parents = n_vars - 1
+    dag = np.zeros((n_vars, n_vars), dtype=bool)
+    parents = [set() for _ in range(n_vars)]
+    scores = [local_bic(j, parents[j]) for j in range(n_vars)]
+    for _ in range(max_iter):
+        best_delta = -1e-9
+        best_move = None
+        for i in range(n_vars):
+            for j in range(n_vars):
+                if i == j:
+                    continue
+                if dag[i, j]:
+                    removal = local_bic(j, parents[j] - {i}) - scores[j]
+                    if removal < best_delta:
+                        best_delta, best_move = removal, ('remove', i, j)
+                    if allowed[j, i] and len(parents[i]) < max_parents:
+                        dag[i, j] = False
+                        acyclic = not has_path(dag, i, j)
+                        dag[i, j] = True
+                        if acyclic:
+                            reversal = removal + local_bic(i, parents[i] | {j}) - scores[i]
+                            if reversal < best_delta:
+                                best_delta, best_move = reversal, ('reverse', i, j)
+                elif not dag[j, i] and allowed[i, j] and len(parents[j]) < max_parents \
+                        and not has_path(dag, j, i):
+                    addition = local_bic(j, parents[j] | {i}) - scores[j]
+                    if addition < best_delta:
+                        best_delta, best_move = addition, ('add', i, j)
+        if best_move is None:
+            break
+        move, i, j = best_move
+        if move == 'add':
+            dag[i, j] = True
+            parents[j].add(i)
+        else:
+            dag[i, j] = False
+            parents[j].discard(i)
+            if move == 'reverse':
+                dag[j, i] = True
+                parents[i].add(j)
+                scores[i] = local_bic(i, parents[i])
+        scores[j] = local_bic(j, parents[j])
+    return dag.astype(float)
+
+def is_sparse(super_graph, max_degree=None):
+    # every node has at most max_degree candidate parents in the super-structure
+    return super_graph is not None and max_degree is not None and \
+        np.asarray(super_graph).astype(bool).sum(axis=0).max(initial=0) <= max_degree
+
+def budgeted_exact_search(feature, super_graph=None, max_parents=None, max_vars=None, time_budget=None, max_degree=None):
+    '''
+    Exact search up to max_vars variables, or above it over a super_graph with at most max_degree
+    candidate parents per node, greedy search otherwise or after time_budget seconds.
+    returns the DAG and the mode that produced it (EXACT or GREEDY)
+    '''
+    n_vars = feature.shape[1]
+    if max_vars is None or n_vars <= max_vars or is_sparse(super_graph, max_degree):
+        dag = exact_search_with_budget(feature, super_graph, max_parents, time_budget)
+        if dag is not None:
+            return np.asarray(dag), EXACT
+    return greedy_bic_search(feature, super_graph, max_parents), GREEDY
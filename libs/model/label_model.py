@@ -0,0 +1,220 @@
+import numpy as np
+import torch
+from scipy.optimize import linear_sum_assignment
+
+class BatchedLabelModel:
+    '''
+    Snorkel's LabelModel (Ratner et al. 2019, Training Complex Models with Multi-Task Weak Supervision)
+    fit on a batch of label matrices and class balances in one vectorized optimization.
+    Every (class balance, label matrix) pair gets its own mu, fit with the same objective,
+    initialization, optimizer (SGD, momentum 0.9) and post-processing as
+    snorkel.labeling.model.LabelModel with independent LFs, so the predictions match
+    a separate snorkel fit for each pair.
+
+    Label matrices use snorkel's convention: -1 abstains, 0 ... cardinality-1 are class votes.
+    '''
+    def __init__(self, cardinality=2, prec_init=0.7, mu_eps=None, device='cpu'):
+        self.cardinality = cardinality
+        self.prec_init = prec_init
+        self.mu_eps = mu_eps
+        self.device = device
+        self.mu = None
+        self.p = None
+
+    def get_augmented_label_matrix(self, L):
+        # one-hot votes, column lf * cardinality + y as in snorkel's _create_L_ind
+        L = np.asarray(L)
+        L_aug = np.zeros(L.shape[:-1] + (L.shape[-1] * self.cardinality,))
+        for y in range(self.cardinality):
+            L_aug[..., y::self.cardinality] = (L == y)
+        return L_aug
+
+    def get_mask(self, m):
+        # entries of O between votes of the same LF are not used
+        k = self.cardinality
+        mask = torch.ones(m * k, m * k, device=self.device)
+        for i in range(m):
+            mask[i * k:(i + 1) * k, i * k:(i + 1) * k] = 0
+        return mask
+
+    def get_mu_eps(self, n):
+        if self.mu_eps is not None:
+            return self.mu_eps
+        return min(0.01, 1 / 10 ** np.ceil(np.log10(n)))
+
+    def fit(self, L, class_balances, n_epochs=100, lr=0.01, seed=123, mu_init=None):
+        '''
+        L: n_batch x n x m label matrices
+        class_balances: n_cb x cardinality priors
+        mu is n_cb x n_batch x (m * cardinality) x cardinality
+        mu_init: optional starting mu (broadcastable to that shape) instead of snorkel's initialization
+        '''
+        L = np.asarray(L)
+        n_batch, n, m = L.shape
+        k = self.cardinality
+        d = m * k
+        self.p = np.atleast_2d(np.asarray(class_balances, dtype=float))
+        n_cb = self.p.shape[0]
+
+        L_aug = torch.from_numpy(self.get_augmented_label_matrix(L)).float().to(self.device)
+        O = L_aug.transpose(1, 2) @ L_aug / n
+        diag_O = torch.diagonal(O, dim1=1, dim2=2)
+        mask = self.get_mask(m)
+        p = torch.from_numpy(self.p).float().to(self.device)
+
+        # mu_init[i * k + y, y] = P(lf = y | Y = y) = P(lf = y) * prec_init / P(Y = y)
+        vote_class = torch.arange(d, device=self.device) % k
+        init = torch.clamp(diag_O[None, :, :] * self.prec_init / p[:, None, vote_class], 0, 1)
+        if mu_init is None:
+            mu = torch.zeros(n_cb, n_batch, d, k, device=self.device)
+            mu[:, :, torch.arange(d, device=self.device), vote_class] = init
+            # snorkel scales the initialization by one np.random.random() draw after seeding
+            mu = mu * np.random.RandomState(seed).random_sample()
+        else:
+            mu = torch.from_numpy(np.broadcast_to(mu_init, (n_cb, n_batch, d, k)).copy()).float().to(self.device)
+        mu = mu.requires_grad_()
+
+        optimizer = torch.optim.SGD([mu], lr=lr, momentum=0.9)
+        p_row = p[:, None, None, :]
+        for epoch in range(n_epochs):
+            optimizer.zero_grad()
+            mu_P = mu * p_row
+            loss_1 = (((O[None] - mu_P @ mu.transpose(-1, -2)) ** 2) * mask).sum()
+            loss_2 = ((mu_P.sum(-1) - diag_O[None]) ** 2).sum()
+            loss = loss_1 + loss_2
+            loss.backward()
+            optimizer.step()
+
+        mu_eps = self.get_mu_eps(n)
+        mu = mu.detach().clamp(mu_eps, 1 - mu_eps).cpu().numpy()
+        self.mu = self.break_col_permutation_symmetry(mu, m)
+        return self
+
+    def break_col_permutation_symmetry(self, mu, m):
+        '''
+        Among classes with the same prior, pick the column permutation that maximizes
+        the sum of the LF accuracies, as snorkel's _break_col_permutation_symmetry
+        '''
+        k = self.cardinality
+        for c in range(mu.shape[0]):
+            groups = {}
+            for y, f in enumerate(self.p[c]):
+                groups.setdefault(np.around(f, 3), []).append(y)
+            groups = [group for group in groups.values() if len(group) > 1]
+            if len(groups) == 0:
+                continue
+            for b in range(mu.shape[1]):
+                probs_sum = sum([mu[c, b, i:i + k] for i in range(0, m * k, k)]) @ np.diag(self.p[c])
+                Z = np.eye(k)
+                for group in groups:
+                    probs_proj = probs_sum[np.ix_(group, group)]
+                    rows, cols = linear_sum_assignment(-probs_proj.T)
+                    for y in group:
+                        Z[y, y] = 0.
+                    for i, j in zip(rows, cols):
+                        Z[group[i], group[j]] = 1.
+                mu[c, b] = mu[c, b] @ Z
+        return mu
+
+    def predict_proba(self, L):
+        '''
+        returns n_cb x n_batch x n x cardinality
+        '''
+        L_aug = self.get_augmented_label_matrix(L)
+        X = np.exp(L_aug[None] @ np.log(self.mu) + np.log(self.p)[:, None, None, :])
+        return X / X.sum(axis=-1, keepdims=True)
+
+    def predict(self, L, return_probs=False):
+        '''
+        returns n_cb x n_batch x n, ties abstain (-1) as with snorkel's default tie break policy
+        '''
+        probs = self.predict_proba(L)
+        diffs = np.abs(probs - probs.max(axis=-1, keepdims=True))
+        n_max = (diffs < 1e-5).sum(axis=-1)
+        preds = np.where(n_max == 1, probs.argmax(axis=-1), -1)
+        if return_probs:
+            return preds, probs
+        return preds
+
+class TripletLabelModel:
+    '''
+    Closed form label model for binary tasks: Fu, D. Y., et al. (2020). Fast and Three-rious: Speeding Up
+    Weak Supervision with Triplet Methods. Votes are mapped to {-1, +1} (0 for abstains); with conditionally
+    independent LFs E[l_i l_j] = a_i a_j for a_i = E[l_i Y], so |a_i| = sqrt(|M_ij M_ik / M_jk|) averaged over
+    every triplet. Accuracies do not depend on the class balance, only the posteriors do.
+
+    Same interface and output shapes as BatchedLabelModel; training parameters (epochs, lr, seed) are ignored.
+    With fewer than 3 LFs, or when no triplet is informative, the accuracy falls back to prec_init.
+    '''
+    def __init__(self, cardinality=2, prec_init=0.7, acc_eps=0.01):
+        assert cardinality == 2, "the triplet method is for binary tasks"
+        self.cardinality = cardinality
+        self.prec_init = prec_init
+        self.acc_eps = acc_eps
+        self.mu = None
+        self.p = None
+
+    def get_signed_votes(self, L):
+        # class 1 -> +1, class 0 -> -1, abstain -> 0
+        L = np.asarray(L)
+        return np.where(L == 1, 1., np.where(L == 0, -1., 0.))
+
+    def fit(self, L, class_balances, *args, **kwargs):
+        '''
+        L: n_batch x n x m label matrices
+        class_balances: n_cb x 2 priors
+        mu holds the accuracy P(l_i = Y | l_i votes) of every LF, n_cb x n_batch x m
+        '''
+        votes = self.get_signed_votes(L)
+        n_batch, n, m = votes.shape
+        self.p = np.atleast_2d(np.asarray(class_balances, dtype=float))
+        M = np.einsum('bni,bnj->bij', votes, votes) / n
+        coverage = (votes != 0).mean(axis=1)
+
+        accuracy = np.full((n_batch, m), self.prec_init)
+        if m >= 3:
+            i, j, k = np.meshgrid(np.arange(m), np.arange(m), np.arange(m), indexing='ij')
+            triplets = (i != j) & (i != k) & (j < k)
+            i, j, k = i[triplets], j[triplets], k[triplets]
+            M_jk = M[:, j, k]
+            valid = np.abs(M_jk) > 1e-12
+            ratio = np.abs(M[:, i, j] * M[:, i, k] / np.where(valid, M_jk, 1.))
+            a = np.sqrt(np.where(valid, ratio, 0.))
+            # mean of a_i over the informative triplets of each LF
+            a_sum = np.zeros((n_batch, m))
+            n_valid = np.zeros((n_batch, m))
+            np.add.at(a_sum, (slice(None), i), a)
+            np.add.at(n_valid, (slice(None), i), valid)
+            estimated = (n_valid > 0) & (coverage > 0)
+            a_mean = a_sum / np.maximum(n_valid, 1)
+            accuracy = np.where(estimated, (1 + a_mean / np.maximum(coverage, 1e-12)) / 2, accuracy)
+        accuracy = np.clip(accuracy, self.acc_eps, 1 - self.acc_eps)
+        self.mu = np.broadcast_to(accuracy, (self.p.shape[0], n_batch, m))
+        return self
+
+    def predict_proba(self, L):
+        '''
+        returns n_cb x n_batch x n x 2
+        '''
+        votes = self.get_signed_votes(L)[None]
+        accuracy = self.mu[:, :, None, :]
+        # abstains contribute the same factor to both classes
+        log_correct = np.log(accuracy)
+        log_wrong = np.log(1 - accuracy)
+        log_1 = ((votes == 1) * log_correct + (votes == -1) * log_wrong).sum(axis=-1) + np.log(self.p[:, None, None, 1])
+        log_0 = ((votes == -1) * log_correct + (votes == 1) * log_wrong).sum(axis=-1) + np.log(self.p[:, None, None, 0])
+        log_probs = np.stack([log_0, log_1], axis=-1)
+        X = np.exp(log_probs - log_probs.max(axis=-1, keepdims=True))
+        return X / X.sum(axis=-1, keepdims=True)
+
+    def predict(self, L, return_probs=False):
+        '''
+        returns n_cb x n_batch x n, ties abstain (-1) as with BatchedLabelModel
+        '''
+        probs = self.predict_proba(L)
+        diffs = np.abs(probs - probs.max(axis=-1, keepdims=True))
+        n_max = (diffs < 1e-5).sum(axis=-1)
+        preds = np.where(n_max == 1, probs.argmax(axis=-1), -1)
+        if return_probs:
+            return preds, probs
+        return preds
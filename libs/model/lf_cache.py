@@ -0,0 +1,117 @@
+import os
+import hashlib
+import inspect
+
+import numpy as np
+from libs.utils.logger import log
+
+CACHE_FILE_NAME = 'lf_cache.npz'
+# parameters that change how an LF runs but not the graph it returns
+RUNTIME_PARAMS = ['n_workers', 'return_mode']
+# archive entry of the mode that produced a graph (e.g. exact or greedy Exact Search), next to the graph entry
+MODE_SUFFIX = '.mode'
+# implementation version of each LF, part of the cache key: bump it whenever an LF changes the graphs it returns
+# (MB LFs: native implementations with the bnlearn defaults, Exact Search: budgeted search over the skeleton)
+LF_VERSIONS = {
+    'MMPC': 2,
+    'GS': 2,
+    'IAMB': 2,
+    'Inter_IAMB': 2,
+    'Exact Search': 3,
+}
+DEFAULT_LF_VERSION = 1
+
+def feature_digest(features):
+    '''
+    Content hash of a feature array, independent of the file it was loaded from
+    '''
+    features = np.ascontiguousarray(features)
+    h = hashlib.sha1()
+    h.update(str(features.dtype).encode())
+    h.update(str(features.shape).encode())
+    h.update(features.tobytes())
+    return h.hexdigest()
+
+def get_lf_params(lf_func, lf_params={}):
+    '''
+    Keyword arguments an LF runs with: its defaults overridden by the configured lf_params
+    '''
+    params = {}
+    for name, param in inspect.signature(lf_func).parameters.items():
+        if param.default is not inspect.Parameter.empty:
+            params[name] = param.default
+    params.update(lf_params)
+    for name in RUNTIME_PARAMS:
+        params.pop(name, None)
+    return params
+
+def param_to_str(value):
+    # CI tests and other callables are identified by name, not by address
+    if callable(value) and hasattr(value, '__name__'):
+        return value.__name__
+    return repr(value)
+
+def get_cache_key(digest, lf_name, params):
+    h = hashlib.sha1()
+    h.update(digest.encode())
+    h.update(lf_name.encode())
+    h.update(f"version={LF_VERSIONS.get(lf_name, DEFAULT_LF_VERSION)};".encode())
+    for name in sorted(params):
+        h.update(f"{name}={param_to_str(params[name])};".encode())
+    return h.hexdigest()
+
+class LFCache:
+    '''
+    Persistent store of LF graph estimates, one npz archive per feature directory.
+    Entries are keyed by the hash of the PCA features, the LF name, its implementation version and its parameters, so
+    reruns and hyperparameter sweeps on the same features skip causal discovery.
+    The mode reported by an LF is stored with its graph.
+    '''
+    def __init__(self, cache_dir, file_name=CACHE_FILE_NAME):
+        self.path = os.path.join(cache_dir, file_name)
+        self.entries = self.load()
+        self.new_entries = {}
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with np.load(self.path) as archive:
+                return {key: archive[key] for key in archive.files}
+        except Exception as e:
+            log(f"could not read LF cache {self.path}: {e}")
+            return {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def get_mode(self, key):
+        mode = self.entries.get(key + MODE_SUFFIX)
+        return None if mode is None else str(mode)
+
+    def put(self, key, dag, mode=None):
+        self.entries[key] = np.asarray(dag)
+        self.new_entries[key] = self.entries[key]
+        if mode is not None:
+            self.entries[key + MODE_SUFFIX] = np.array(mode)
+            self.new_entries[key + MODE_SUFFIX] = self.entries[key + MODE_SUFFIX]
+
+    def save(self):
+        if len(self.new_entries) == 0:
+            return
+        # merge with entries written by other runs since we loaded the archive
+        entries = self.load()
+        entries.update(self.new_entries)
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **entries)
+            os.replace(tmp_path, self.path)
+            self.new_entries = {}
+        except OSError as e:
+            log(f"could not write LF cache {self.path}: {e}")
+
+def get_lf_cache(model_cfg, load_path):
+    if 'lf_cache' in model_cfg and not model_cfg['lf_cache']:
+        return None
+    return LFCache(load_path)
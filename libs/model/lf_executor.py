@@ -0,0 +1,408 @@
+import time
+import resource
+import multiprocessing as mp
+from queue import Empty
+
+import numpy as np
+from libs.utils.logger import log, save_graph
+from .lf_cache import feature_digest, get_lf_params, get_cache_key
+
+# rough relative cost of each LF, the most expensive ones are launched first so that
+# the total wall time is close to max(LF time) instead of sum(LF time)
+LF_COST = {
+    'Exact Search': 100,
+    'NoTears MLP': 80,
+    'NoTears Sobolev': 70,
+    'RCD': 50,
+    'FCI': 40,
+    'PC': 30,
+    'MMPC': 25,
+    'GS': 25,
+    'IAMB': 25,
+    'Inter_IAMB': 25,
+    'ICA_Lingam': 20,
+    'Var_Lingam': 20,
+    'Direct_Lingam': 20,
+    'Lingam': 20,
+    'fges': 15,
+    'rfci': 15,
+    'pc-all': 15,
+    'fask': 15,
+}
+DEFAULT_LF_COST = 10
+# LFs that share the per-task CI oracle of the LF factory
+CONSTRAINT_BASED_LFS = ['PC', 'FCI', 'MMPC', 'GS', 'IAMB', 'Inter_IAMB', 'Exact Search']
+LF_TYPES = ['notears', 'classic', 'pycausal']
+# LFs that can also report the mode that produced their graph (called with return_mode=True)
+MODE_LFS = ['Exact Search']
+
+class LFJob:
+    '''
+    Unit of work of the executor: a single (LF, task) pair, or for pycausal every
+    (Tetrad algorithm, task) pair, which run in one JVM session.
+    '''
+    def __init__(self, lf_type, pairs):
+        self.lf_type = lf_type
+        self.pairs = pairs
+
+    def get_lf_names(self):
+        return list(dict.fromkeys([lf_name for lf_name, _ in self.pairs]))
+
+    def get_tasks(self):
+        return list(dict.fromkeys([task for _, task in self.pairs]))
+
+    def __repr__(self):
+        if len(self.pairs) == 1:
+            return f"{self.pairs[0][0]} ({self.pairs[0][1]})"
+        return f"{self.lf_type} {self.get_lf_names()} ({', '.join(self.get_tasks())})"
+
+def get_lf_func(lf_factory, lf_type, lf_name, load=True):
+    # load=False returns the LF method without importing its backend
+    if lf_type == 'pycausal':
+        lf_name = 'pycausal'
+    if not load:
+        return lf_factory.lf_dict.get_method(lf_name)
+    return lf_factory.lf_dict[lf_name]
+
+def run_lf(lf_factory, lf_type, lf_name, pca_features, lf_params={}):
+    '''
+    Run a single LF on a single task, same graph as run_notears_lfs / run_classic_lfs
+    with use_cpdag=False and transpose=False, and the mode that produced it (None for LFs not in MODE_LFS)
+    '''
+    lf_func = get_lf_func(lf_factory, lf_type, lf_name)
+    mode = None
+    if lf_type == 'notears':
+        dag, _, _ = lf_func(pca_features, **lf_params)
+    elif lf_type == 'pycausal':
+        dag = lf_func(pca_features, lf_name, **lf_params)
+    elif lf_name in MODE_LFS:
+        dag, mode = lf_func(pca_features, return_mode=True, **lf_params)
+    else:
+        dag = lf_func(pca_features, **lf_params)
+    return dag, mode
+
+def run_job(lf_factory, job, samples_dict, lf_params={}, sampler=None):
+    '''
+    Returns {(lf_name, task): dag}, {(lf_name, task): wall time}, {(lf_name, task): sampling info}
+    and {(lf_name, task): mode} (LFs of MODE_LFS) for every pair of the job.
+    Pairs of sampled LFs run through the AdaptiveSampler, their mode lists the modes of every sampled run.
+    '''
+    if job.lf_type == 'pycausal':
+        features = {task: samples_dict[task]['pca_features'] for task in job.get_tasks()}
+        dags, wall_times = lf_factory.LF_pycausal_batch(features, job.get_lf_names())
+        return {pair: dags[pair] for pair in job.pairs}, {pair: wall_times[pair] for pair in job.pairs}, {}, {}
+    dags = {}
+    wall_times = {}
+    infos = {}
+    modes = {}
+    for lf_name, task in job.pairs:
+        start = time.time()
+        features = samples_dict[task]['pca_features']
+        params = lf_params.get(lf_name, {})
+        if sampler is not None and sampler.is_sampled(lf_name, features.shape[0]):
+            run_modes = []
+            def lf_run(rows):
+                dag, mode = run_lf(lf_factory, job.lf_type, lf_name, rows, params)
+                run_modes.append(mode)
+                return dag
+            dags[(lf_name, task)], infos[(lf_name, task)] = sampler.run(lf_run, features, lf_name)
+            mode = '+'.join(sorted(set([m for m in run_modes if m is not None]))) or None
+        else:
+            dags[(lf_name, task)], mode = run_lf(lf_factory, job.lf_type, lf_name, features, params)
+        if mode is not None:
+            modes[(lf_name, task)] = mode
+        wall_times[(lf_name, task)] = time.time() - start
+    return dags, wall_times, infos, modes
+
+def get_peak_rss_mb():
+    # peak rss of the whole current process so far (ru_maxrss is in kilobytes on linux),
+    # per job only in a worker that ran that single job
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def _lf_worker(lf_factory, job_idx, job, samples_dict, lf_params, sampler, queue):
+    try:
+        dags, wall_times, infos, modes = run_job(lf_factory, job, samples_dict, lf_params, sampler)
+        error = None
+    except Exception as e:
+        dags, wall_times, infos, modes = {}, {}, {}, {}
+        error = repr(e)
+    queue.put((job_idx, dags, wall_times, infos, modes, error, get_peak_rss_mb()))
+
+class LFExecutor:
+    '''
+    Runs the (LF, task) pairs of active_lfs in worker processes.
+    Jobs are launched in decreasing cost order, each LF has its own wall clock budget and
+    LFs that time out on any task are dropped from the returned G_estimates.
+    An LF that raises re-raises the error, unless drop_failed is set: the LF is then logged and dropped too.
+    Estimates found in lf_cache are reused instead of being recomputed.
+    The mode that produced the graph of an LF of MODE_LFS (e.g. exact or greedy Exact Search) is kept in
+    self.modes and in the 'mode' of its stats, also for cached estimates.
+    With a sampler, LFs run on adaptively sized row subsets (see lf_sampling.AdaptiveSampler).
+    '''
+    def __init__(self, n_workers=1, timeout=None, lf_timeouts={}, lf_cost={}, lf_params={}, lf_cache=None, sampler=None, \
+                    drop_failed=False):
+        self.n_workers = max(1, int(n_workers))
+        self.drop_failed = drop_failed
+        self.timeout = timeout
+        self.lf_timeouts = lf_timeouts
+        self.lf_params = lf_params
+        self.lf_cache = lf_cache
+        self.sampler = sampler
+        self.lf_cost = dict(LF_COST)
+        self.lf_cost.update(lf_cost)
+        self.stats = []
+        self.sampling_infos = {}
+        self.modes = {}
+
+    def get_timeout(self, job):
+        # the pycausal batch job has a single budget, configured under 'pycausal'
+        lf_name = 'pycausal' if job.lf_type == 'pycausal' else job.pairs[0][0]
+        if lf_name in self.lf_timeouts:
+            return self.lf_timeouts[lf_name]
+        return self.timeout
+
+    def get_cost(self, job):
+        return sum([self.lf_cost.get(lf_name, DEFAULT_LF_COST) for lf_name, _ in job.pairs])
+
+    def get_params(self, lf_name):
+        return self.lf_params.get(lf_name, {})
+
+    def get_pairs(self, tasks, active_lfs):
+        pairs = []
+        for lf_type in LF_TYPES:
+            for lf_name in active_lfs.get(lf_type, []):
+                for task in tasks:
+                    pairs.append((lf_type, lf_name, task))
+        return pairs
+
+    def get_jobs(self, pairs):
+        jobs = []
+        pycausal_pairs = []
+        for lf_type, lf_name, task in pairs:
+            if lf_type == 'pycausal':
+                pycausal_pairs.append((lf_name, task))
+            else:
+                jobs.append(LFJob(lf_type, [(lf_name, task)]))
+        if len(pycausal_pairs) > 0:
+            jobs.append(LFJob('pycausal', pycausal_pairs))
+        # sorted is stable, configured order is kept among jobs of the same cost
+        return sorted(jobs, key=lambda job: -self.get_cost(job))
+
+    def get_cache_keys(self, samples_dict, pairs, lf_factory):
+        digests = {}
+        cache_keys = {}
+        for lf_type, lf_name, task in pairs:
+            if task not in digests:
+                digests[task] = feature_digest(samples_dict[task]['pca_features'])
+            lf_func = get_lf_func(lf_factory, lf_type, lf_name, load=False)
+            params = get_lf_params(lf_func, self.get_params(lf_name))
+            if self.sampler is not None and lf_type != 'pycausal' and \
+                    self.sampler.is_sampled(lf_name, samples_dict[task]['pca_features'].shape[0]):
+                params['sampling'] = self.sampler.get_params(lf_name)
+            cache_keys[(lf_name, task)] = get_cache_key(digests[task], lf_name, params)
+        return cache_keys
+
+    def run(self, samples_dict, tasks, active_lfs, lf_factory, log_graph=True):
+        pairs = self.get_pairs(tasks, active_lfs)
+        self.stats = []
+        self.sampling_infos = {}
+        self.modes = {}
+        results = {}
+        if self.lf_cache is not None:
+            cache_keys = self.get_cache_keys(samples_dict, pairs, lf_factory)
+            for _, lf_name, task in pairs:
+                dag = self.lf_cache.get(cache_keys[(lf_name, task)])
+                if dag is not None:
+                    results[(lf_name, task)] = dag
+                    mode = self.lf_cache.get_mode(cache_keys[(lf_name, task)])
+                    if mode is not None:
+                        self.modes[(lf_name, task)] = mode
+                    self.add_stats(lf_name, task, 'cached', 0., np.nan)
+            log(f"{len(results)} of {len(pairs)} (LF, task) estimates found in {self.lf_cache.path}")
+        jobs = self.get_jobs([pair for pair in pairs if (pair[1], pair[2]) not in results])
+        if self.n_workers == 1 and self.timeout is None and len(self.lf_timeouts) == 0:
+            new_results = self.run_serial(samples_dict, jobs, lf_factory)
+        else:
+            new_results = self.run_parallel(samples_dict, jobs, lf_factory)
+        results.update(new_results)
+        if self.lf_cache is not None:
+            for pair, dag in new_results.items():
+                self.lf_cache.put(cache_keys[pair], dag, self.modes.get(pair))
+            self.lf_cache.save()
+        G_estimates = self.collect(results, tasks, active_lfs)
+        if log_graph:
+            for lf_name in G_estimates:
+                for task in G_estimates[lf_name]:
+                    save_graph(G_estimates[lf_name][task], title=f"{task} LF {lf_name}")
+        self.log_stats()
+        return G_estimates
+
+    def run_serial(self, samples_dict, jobs, lf_factory):
+        results = {}
+        for job in jobs:
+            log(f"Running {job}...")
+            start = time.time()
+            try:
+                dags, wall_times, infos, modes = run_job(lf_factory, job, samples_dict, self.lf_params, self.sampler)
+            except Exception as e:
+                if not self.drop_failed:
+                    raise
+                self.job_failed(job, repr(e), time.time() - start, np.nan)
+                continue
+            results.update(dags)
+            self.sampling_infos.update(infos)
+            self.modes.update(modes)
+            for lf_name, task in job.pairs:
+                # every job runs in this process, there is no per job peak rss
+                self.add_stats(lf_name, task, 'done', wall_times[(lf_name, task)], np.nan)
+        log("process peak rss {:.1f} MB".format(get_peak_rss_mb()))
+        return results
+
+    def job_failed(self, job, error, wall_time, peak_rss):
+        if not self.drop_failed:
+            raise RuntimeError(f"{job} failed: {error}")
+        for lf_name, task in job.pairs:
+            log(f"{lf_name} failed on {task}, dropping it: {error}")
+        self.add_job_stats(job, f"failed: {error}", wall_time, peak_rss)
+
+    def prepare_ci_oracles(self, samples_dict, jobs, lf_factory):
+        # build the correlation matrices once in the parent, the workers inherit them
+        for job in jobs:
+            for lf_name, task in job.pairs:
+                if lf_name in CONSTRAINT_BASED_LFS:
+                    # the test each LF runs with, its default or the configured score_func
+                    lf_func = get_lf_func(lf_factory, job.lf_type, lf_name, load=False)
+                    lf_factory.get_ci_oracle(samples_dict[task]['pca_features'], \
+                                            get_lf_params(lf_func, self.get_params(lf_name)).get('score_func'))
+
+    def run_parallel(self, samples_dict, jobs, lf_factory):
+        self.prepare_ci_oracles(samples_dict, jobs, lf_factory)
+        # fork so that the features and the LF factory are inherited instead of pickled
+        ctx = mp.get_context('fork')
+        queue = ctx.Queue()
+        results = {}
+        pending = list(range(len(jobs)))
+        running = {}
+        try:
+            self.poll_jobs(samples_dict, jobs, lf_factory, ctx, queue, pending, running, results)
+        finally:
+            for process, _ in running.values():
+                process.terminate()
+                process.join()
+        return results
+
+    def poll_jobs(self, samples_dict, jobs, lf_factory, ctx, queue, pending, running, results):
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < self.n_workers:
+                job_idx = pending.pop(0)
+                log(f"Running {jobs[job_idx]}...")
+                process = ctx.Process(target=_lf_worker, \
+                                    args=(lf_factory, job_idx, jobs[job_idx], samples_dict, self.lf_params, self.sampler, queue))
+                process.start()
+                running[job_idx] = (process, time.time())
+            try:
+                self.handle_result(queue.get(timeout=1.), jobs, running, results)
+            except Empty:
+                pass
+            now = time.time()
+            for job_idx in list(running.keys()):
+                process, start = running[job_idx]
+                job = jobs[job_idx]
+                timeout = self.get_timeout(job)
+                if timeout is not None and now - start > timeout:
+                    # the result may have landed since the last get, never kill a worker that is writing to the queue
+                    self.drain_queue(queue, jobs, running, results)
+                    if job_idx not in running:
+                        continue
+                    process.terminate()
+                    process.join()
+                    running.pop(job_idx)
+                    log(f"{job} timed out after {timeout}s")
+                    self.add_job_stats(job, 'timeout', now - start, np.nan)
+                elif not process.is_alive() and process.exitcode != 0:
+                    running.pop(job_idx)
+                    self.job_failed(job, f"exit code {process.exitcode}", now - start, np.nan)
+
+    def drain_queue(self, queue, jobs, running, results):
+        while True:
+            try:
+                self.handle_result(queue.get_nowait(), jobs, running, results)
+            except Empty:
+                return
+
+    def handle_result(self, result, jobs, running, results):
+        job_idx, dags, wall_times, infos, modes, error, peak_rss = result
+        job = jobs[job_idx]
+        if job_idx not in running:
+            # the job was already dropped, e.g. it timed out
+            log(f"ignoring the late result of {job}")
+            return
+        process, start = running.pop(job_idx)
+        process.join()
+        if error is not None:
+            self.job_failed(job, error, time.time() - start, peak_rss)
+        else:
+            results.update(dags)
+            self.sampling_infos.update(infos)
+            self.modes.update(modes)
+            for lf_name, task in job.pairs:
+                self.add_stats(lf_name, task, 'done', wall_times[(lf_name, task)], peak_rss)
+
+    def collect(self, results, tasks, active_lfs):
+        # keep the configured LF and task order, the fusers index LFs by position
+        G_estimates = {}
+        for lf_type in LF_TYPES:
+            for lf_name in active_lfs.get(lf_type, []):
+                missing = [task for task in tasks if (lf_name, task) not in results]
+                if len(missing) > 0:
+                    log(f"Dropping {lf_name}: no estimate for {', '.join(missing)}")
+                    continue
+                G_estimates[lf_name] = {task: results[(lf_name, task)] for task in tasks}
+        return G_estimates
+
+    def add_stats(self, lf_name, task, status, wall_time, peak_rss):
+        self.stats.append({
+            'lf': lf_name,
+            'task': task,
+            'status': status,
+            'wall_time': wall_time,
+            'peak_rss_mb': peak_rss,
+            'mode': self.modes.get((lf_name, task)),
+        })
+
+    def add_job_stats(self, job, status, wall_time, peak_rss):
+        for lf_name, task in job.pairs:
+            self.add_stats(lf_name, task, status, wall_time, peak_rss)
+
+    def log_stats(self):
+        log("LF RUNTIME (slowest first)")
+        for stat in sorted(self.stats, key=lambda s: -s['wall_time']):
+            status = stat['status'] if stat['mode'] is None else f"{stat['status']} ({stat['mode']})"
+            log("{} | {} | {:.2f}s | worker peak rss {:.1f} MB | {}".format(stat['lf'], stat['task'], \
+                                                                    stat['wall_time'], stat['peak_rss_mb'], status))
+        for (lf_name, task), info in self.sampling_infos.items():
+            log(f"{lf_name} | {task} | sampled {info['n_rows']} rows")
+            if info['edge_frequencies'] is not None:
+                log(f"{lf_name} | {task} | bootstrap edge frequencies\n{np.round(info['edge_frequencies'], 2)}")
+
+def get_lf_executor(model_cfg, lf_cache=None, sampler=None):
+    '''
+    Build the executor from the optional `lf_executor` entry of the model config, e.g.
+        lf_executor:
+            n_workers: 8
+            timeout: 600
+            lf_timeouts: {'Exact Search': 1800}
+            drop_failed: False   # True: log and drop an LF that raises instead of stopping the run
+    Without it, LFs run serially in the current process as before.
+    Per-LF keyword arguments are read from `lf_params`, e.g. lf_params: {'PC': {'p_threshold': 0.01}}
+    '''
+    lf_params = model_cfg.get('lf_params', {})
+    if 'lf_executor' not in model_cfg:
+        return LFExecutor(lf_params=lf_params, lf_cache=lf_cache, sampler=sampler)
+    executor_cfg = model_cfg['lf_executor']
+    return LFExecutor(n_workers=executor_cfg.get('n_workers', 1), \
+                        timeout=executor_cfg.get('timeout', None), \
+                        lf_timeouts=executor_cfg.get('lf_timeouts', {}), \
+                        lf_cost=executor_cfg.get('lf_cost', {}), \
+                        lf_params=lf_params, lf_cache=lf_cache, sampler=sampler, \
+                        drop_failed=executor_cfg.get('drop_failed', False))
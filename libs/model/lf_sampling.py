@@ -0,0 +1,113 @@
+import numpy as np
+from libs.utils.fork_pool import run_configs
+
+def graph_distance(G_1, G_2):
+    # number of differing entries of the binarized graphs (SHD counting a reversal twice)
+    return int(((np.asarray(G_1) != 0) != (np.asarray(G_2) != 0)).sum())
+
+class AdaptiveSampler:
+    '''
+    Runs an LF on a growing random subset of the rows instead of the full training set.
+    Starting from initial_size rows, the sample grows geometrically (x growth) until the
+    estimated graph changes by at most tolerance edges between two rounds, or every row is used.
+    With n_bootstrap > 0, the LF is then run on n_bootstrap resamples of the final size in
+    n_workers processes; the returned graph keeps the edges found in at least
+    bootstrap_threshold of the resamples and the edge frequencies are reported with it.
+
+    Only datasets with more than min_rows rows are sampled, and only the LFs in lfs if given.
+    '''
+    def __init__(self, initial_size=1000, growth=2., tolerance=0, max_size=None, min_rows=None, \
+                initial_sizes={}, lfs=None, n_bootstrap=0, bootstrap_threshold=0.5, n_workers=1, seed=123):
+        if growth <= 1:
+            raise ValueError(f"growth should be > 1, got {growth}")
+        self.initial_size = initial_size
+        self.growth = growth
+        self.tolerance = tolerance
+        self.max_size = max_size
+        self.min_rows = min_rows if min_rows is not None else 2 * initial_size
+        self.initial_sizes = initial_sizes
+        self.lfs = lfs
+        self.n_bootstrap = n_bootstrap
+        self.bootstrap_threshold = bootstrap_threshold
+        self.n_workers = max(1, int(n_workers))
+        self.seed = seed
+
+    def is_sampled(self, lf_name, n_rows):
+        if self.lfs is not None and lf_name not in self.lfs:
+            return False
+        return n_rows > self.min_rows
+
+    def get_sizes(self, lf_name, n_rows):
+        max_size = n_rows if self.max_size is None else min(self.max_size, n_rows)
+        size = min(self.initial_sizes.get(lf_name, self.initial_size), max_size)
+        sizes = [size]
+        while size < max_size:
+            size = min(int(np.ceil(size * self.growth)), max_size)
+            sizes.append(size)
+        return sizes
+
+    def get_params(self, lf_name):
+        # everything that changes the returned graph, part of the LF cache key
+        return {
+            'sizes_from': self.initial_sizes.get(lf_name, self.initial_size),
+            'growth': self.growth,
+            'tolerance': self.tolerance,
+            'max_size': self.max_size,
+            'n_bootstrap': self.n_bootstrap,
+            'bootstrap_threshold': self.bootstrap_threshold,
+            'seed': self.seed,
+        }
+
+    def run(self, lf_run, features, lf_name):
+        '''
+        lf_run: features -> dag
+        returns the dag and {'n_rows': rows used, 'edge_frequencies': bootstrap frequencies or None}
+        '''
+        rng = np.random.RandomState(self.seed)
+        order = rng.permutation(features.shape[0])
+        dag = None
+        for size in self.get_sizes(lf_name, features.shape[0]):
+            new_dag = lf_run(features[order[:size]])
+            converged = dag is not None and graph_distance(dag, new_dag) <= self.tolerance
+            dag = new_dag
+            if converged:
+                break
+        info = {'n_rows': size, 'edge_frequencies': None}
+        if self.n_bootstrap > 0:
+            frequencies = self.bootstrap(lf_run, features, size)
+            if frequencies is not None:
+                dag = (frequencies >= self.bootstrap_threshold).astype(float)
+                info['edge_frequencies'] = frequencies
+        return dag, info
+
+    def bootstrap(self, lf_run, features, size):
+        '''
+        Edge frequencies over n_bootstrap resamples of size rows, None if every resample failed.
+        Plain (non daemonic) processes of the shared fork pool are used so that LFs can start their own workers.
+        A worker that dies without a result (e.g. killed) counts as a failed resample.
+        '''
+        def resample(seed):
+            rows = np.random.RandomState(seed).choice(features.shape[0], size, replace=True)
+            try:
+                return (np.asarray(lf_run(features[rows])) != 0).astype(float)
+            except Exception:
+                return None
+        seeds = [self.seed + i + 1 for i in range(self.n_bootstrap)]
+        dags = [dag for dag in run_configs(resample, seeds, self.n_workers) if dag is not None]
+        if len(dags) == 0:
+            return None
+        return np.mean(dags, axis=0)
+
+def get_lf_sampler(model_cfg):
+    '''
+    Build the sampler from the optional `lf_sampling` entry of the model config, e.g.
+        lf_sampling:
+            initial_size: 2000
+            growth: 2
+            n_bootstrap: 8
+            n_workers: 8
+    Without it every LF runs on all rows.
+    '''
+    if 'lf_sampling' not in model_cfg or not model_cfg['lf_sampling']:
+        return None
+    return AdaptiveSampler(**model_cfg['lf_sampling'])
@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from causallearn.search.FCMBased.lingam import DirectLiNGAM
+
+# constants of the maximum entropy approximation used by DirectLiNGAM._entropy
+K1 = 79.047
+K2 = 7.4129
+GAMMA = 0.37457
+
+def entropy(U):
+    '''
+    Column-wise DirectLiNGAM._entropy: Hyvarinen, A. (1998). New approximations of differential entropy
+    for independent component analysis and projection pursuit.
+    '''
+    return (1 + np.log(2 * np.pi)) / 2 - \
+        K1 * (np.mean(np.log(np.cosh(U)), axis=0) - GAMMA) ** 2 - \
+        K2 * (np.mean(U * np.exp((-U ** 2) / 2), axis=0)) ** 2
+
+class ParallelDirectLiNGAM(DirectLiNGAM):
+    '''
+    DirectLiNGAM with a vectorized causal order search (pwling measure).
+    At each step the entropies of the d^2 pairwise residuals are computed in batched NumPy,
+    one candidate row at a time, with the rows spread over n_workers threads (NumPy releases the GIL).
+    Same causal order, adjacency_matrix_ and adaptive lasso as causal-learn's DirectLiNGAM.
+    '''
+    def __init__(self, random_state=None, n_workers=1):
+        super().__init__(random_state=random_state)
+        self.n_workers = max(1, int(n_workers))
+
+    def residual_entropy(self, Z, coef, rows):
+        '''
+        H[k, j] = entropy of the standardized residual of z_rows[k] regressed on z_j
+        '''
+        H = np.zeros((len(rows), Z.shape[1]))
+        for k, i in enumerate(rows):
+            R = Z[:, [i]] - Z * coef[i]
+            std = R.std(axis=0)
+            # the residual of z_i on itself is 0, its entry is ignored
+            std[std == 0] = 1.
+            H[k] = entropy(R / std)
+        return H
+
+    def _search_causal_order(self, X, U):
+        if getattr(self, '_Aknw', None) is not None:
+            return super()._search_causal_order(X, U)
+        if len(U) == 1:
+            return U[0]
+        Z = X[:, U]
+        Z = (Z - Z.mean(axis=0)) / Z.std(axis=0)
+        # cov(z_i, z_j) / var(z_j) of DirectLiNGAM._residual, np.cov has ddof=1 and var(z_j) = 1
+        coef = Z.T @ Z / (Z.shape[0] - 1)
+        H_z = entropy(Z)
+        if self.n_workers > 1:
+            chunks = np.array_split(np.arange(len(U)), min(self.n_workers, len(U)))
+            with ThreadPoolExecutor(self.n_workers) as executor:
+                H_res = np.vstack(list(executor.map(lambda rows: self.residual_entropy(Z, coef, rows), chunks)))
+        else:
+            H_res = self.residual_entropy(Z, coef, np.arange(len(U)))
+        # diff[i, j] = (H(z_j) + H(r_i|j)) - (H(z_i) + H(r_j|i)), as in DirectLiNGAM._diff_mutual_info
+        diff = H_z[None, :] + H_res - H_z[:, None] - H_res.T
+        np.fill_diagonal(diff, 0)
+        M = (np.minimum(0, diff) ** 2).sum(axis=1)
+        return U[np.argmax(-M)]
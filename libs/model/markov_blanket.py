@@ -0,0 +1,189 @@
+from itertools import combinations
+
+import numpy as np
+
+'''
+In-process Markov blanket based structure learning (GS, IAMB, Inter-IAMB, MMPC) on top of
+the partial correlation tests of a CIOracle. Replaces the bnlearn versions wrapped by cdt,
+and returns the same adjacency format as cdt's retrieve_adjacency_matrix:
+directed edges have a single 1, undirected edges a 1 in both directions.
+'''
+
+def get_subsets(nodes, max_size=None):
+    nodes = sorted(nodes)
+    if max_size is None or max_size > len(nodes):
+        max_size = len(nodes)
+    for size in range(max_size + 1):
+        for S in combinations(nodes, size):
+            yield S
+
+def shrink(ci_oracle, x, mb, alpha):
+    for v in list(mb):
+        others = [u for u in mb if u != v]
+        if ci_oracle.pvalue(x, v, others) > alpha:
+            mb.remove(v)
+    return mb
+
+def grow_shrink_blanket(ci_oracle, x, alpha):
+    '''
+    Grow-Shrink: Margaritis, D., & Thrun, S. (1999). Bayesian network induction via local neighborhoods.
+    '''
+    mb = []
+    grown = True
+    while grown:
+        grown = False
+        for v in range(ci_oracle.n_vars):
+            if v == x or v in mb:
+                continue
+            if ci_oracle.pvalue(x, v, mb) <= alpha:
+                mb.append(v)
+                grown = True
+    return shrink(ci_oracle, x, mb, alpha)
+
+def iamb_blanket(ci_oracle, x, alpha, interleaved=False):
+    '''
+    IAMB / Inter-IAMB: Tsamardinos, I., Aliferis, C. F., & Statnikov, A. (2003). Algorithms for Large Scale Markov Blanket Discovery.
+    The association of every candidate with x given the current blanket is computed in one vectorized pass.
+    '''
+    mb = []
+    visited = set([])
+    while True:
+        candidates = [v for v in range(ci_oracle.n_vars) if v != x and v not in mb]
+        if len(candidates) == 0:
+            break
+        pvalues = ci_oracle.pvalue_vector(x, candidates, mb)
+        best = np.argmin(pvalues)
+        if pvalues[best] > alpha:
+            break
+        mb.append(candidates[best])
+        if interleaved:
+            mb = shrink(ci_oracle, x, mb, alpha)
+            # a variable that is added and removed again would loop forever
+            state = frozenset(mb)
+            if state in visited:
+                break
+            visited.add(state)
+    if not interleaved:
+        mb = shrink(ci_oracle, x, mb, alpha)
+    return mb
+
+def mmpc_parents_children(ci_oracle, x, alpha, max_k=None):
+    '''
+    Max-Min Parents and Children: Tsamardinos, I., Brown, L. E., & Aliferis, C. F. (2006). The max-min hill-climbing Bayesian network structure learning algorithm.
+    The minimum association of every candidate (max p-value over the subsets of the current set) is updated in one vectorized pass per subset.
+    '''
+    cpc = []
+    while True:
+        candidates = [v for v in range(ci_oracle.n_vars) if v != x and v not in cpc]
+        if len(candidates) == 0:
+            break
+        max_pvalues = np.zeros(len(candidates))
+        for S in get_subsets(cpc, max_k):
+            max_pvalues = np.maximum(max_pvalues, ci_oracle.pvalue_vector(x, candidates, S))
+        best = np.argmin(max_pvalues)
+        if max_pvalues[best] > alpha:
+            break
+        cpc.append(candidates[best])
+    for v in list(cpc):
+        others = [u for u in cpc if u != v]
+        if any([ci_oracle.pvalue(x, v, S) > alpha for S in get_subsets(others, max_k)]):
+            cpc.remove(v)
+    return cpc
+
+def get_blanket_matrix(blankets, n_vars):
+    # keep only the symmetric part, as bnlearn does when blankets disagree
+    mb = np.zeros((n_vars, n_vars), dtype=bool)
+    for x, blanket in enumerate(blankets):
+        mb[x, blanket] = True
+    return mb & mb.T
+
+def get_smaller_set(set_a, set_b):
+    return set_a if len(set_a) <= len(set_b) else set_b
+
+def blanket_to_skeleton(ci_oracle, mb, alpha):
+    '''
+    Neighbours of x are the blanket members y that no subset of the smaller of
+    MB(x) - {y} and MB(y) - {x} separates from x
+    '''
+    skeleton = np.copy(mb)
+    n_vars = mb.shape[0]
+    for x in range(n_vars):
+        for y in range(x + 1, n_vars):
+            if not mb[x, y]:
+                continue
+            T = get_smaller_set([v for v in np.flatnonzero(mb[x]) if v != y], \
+                                [v for v in np.flatnonzero(mb[y]) if v != x])
+            if any([ci_oracle.pvalue(x, y, S) > alpha for S in get_subsets(T)]):
+                skeleton[x, y] = skeleton[y, x] = False
+    return skeleton
+
+def orient_v_structures(ci_oracle, skeleton, mb, alpha):
+    '''
+    x -> y <- z for non adjacent neighbours x, z of y that stay dependent given
+    S + {y} for every subset S of the smaller of MB(x) - {y, z} and MB(z) - {x, y}
+    '''
+    G = skeleton.astype(int)
+    n_vars = skeleton.shape[0]
+    for y in range(n_vars):
+        neighbors = np.flatnonzero(skeleton[y])
+        for x, z in combinations(neighbors, 2):
+            if skeleton[x, z]:
+                continue
+            T = get_smaller_set([v for v in np.flatnonzero(mb[x]) if v not in [y, z]], \
+                                [v for v in np.flatnonzero(mb[z]) if v not in [x, y]])
+            if all([ci_oracle.pvalue(x, z, tuple(S) + (y,)) <= alpha for S in get_subsets(T)]):
+                # leave conflicting orientations undirected
+                if G[x, y] and G[z, y]:
+                    G[y, x] = 0
+                    G[y, z] = 0
+    return G
+
+def apply_meek_rules(G):
+    '''
+    Propagate orientations with Meek's rules 1-3 until nothing changes
+    '''
+    G = np.copy(G)
+    n_vars = G.shape[0]
+    changed = True
+    while changed:
+        changed = False
+        directed = (G == 1) & (G.T == 0)
+        undirected = (G == 1) & (G.T == 1)
+        adjacent = (G + G.T) > 0
+        for u, v in zip(*np.nonzero(undirected)):
+            not_v = np.arange(n_vars) != v
+            # R1: a -> u - v with a, v not adjacent
+            rule_1 = np.any(directed[:, u] & ~adjacent[:, v] & not_v)
+            # R2: u -> w -> v and u - v
+            rule_2 = np.any(directed[u, :] & directed[:, v])
+            # R3: u - c -> v, u - d -> v with c, d not adjacent
+            parents = np.flatnonzero(undirected[u] & directed[:, v])
+            rule_3 = any([not adjacent[c, d] for c, d in combinations(parents, 2)])
+            if rule_1 or rule_2 or rule_3:
+                G[v, u] = 0
+                changed = True
+                break
+    return G
+
+def markov_blanket_dag(ci_oracle, blankets, alpha):
+    mb = get_blanket_matrix(blankets, ci_oracle.n_vars)
+    skeleton = blanket_to_skeleton(ci_oracle, mb, alpha)
+    G = orient_v_structures(ci_oracle, skeleton, mb, alpha)
+    return apply_meek_rules(G).astype(float)
+
+def gs(ci_oracle, alpha=0.05):
+    blankets = [grow_shrink_blanket(ci_oracle, x, alpha) for x in range(ci_oracle.n_vars)]
+    return markov_blanket_dag(ci_oracle, blankets, alpha)
+
+def iamb(ci_oracle, alpha=0.05):
+    blankets = [iamb_blanket(ci_oracle, x, alpha) for x in range(ci_oracle.n_vars)]
+    return markov_blanket_dag(ci_oracle, blankets, alpha)
+
+def inter_iamb(ci_oracle, alpha=0.05):
+    blankets = [iamb_blanket(ci_oracle, x, alpha, interleaved=True) for x in range(ci_oracle.n_vars)]
+    return markov_blanket_dag(ci_oracle, blankets, alpha)
+
+def mmpc(ci_oracle, alpha=0.05, max_k=None):
+    # like bnlearn's mmpc, only the (undirected) skeleton is learned
+    parents_children = [mmpc_parents_children(ci_oracle, x, alpha, max_k) for x in range(ci_oracle.n_vars)]
+    return get_blanket_matrix(parents_children, ci_oracle.n_vars).astype(float)
@@ -0,0 +1,92 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import javabridge
+from pycausal.pycausal import pycausal
+from pycausal import search as s
+
+# endpoint symbols of a Tetrad edge string, as named in the DOT export
+ARROWTAILS = {'<': 'normal', 'o': 'odot', '-': 'none'}
+ARROWHEADS = {'>': 'normal', 'o': 'odot', '-': 'none'}
+
+def apply_endpoints(matrix, source, dest, arrowtail, arrowhead):
+    if arrowhead == 'none' and arrowtail == 'none':
+        matrix[source, dest] = 0
+    elif arrowhead == 'none' and arrowtail == 'normal':
+        matrix[dest, source] = 1
+    else:
+        matrix[source, dest] = 1
+
+def set_edge(matrix, node_index, edge_str):
+    # edge_str: "node1 <arc> node2", possibly followed by edge properties
+    tokens = edge_str.split()
+    arc = tokens[1]
+    apply_endpoints(matrix, node_index[tokens[0]], node_index[tokens[2]], ARROWTAILS[arc[0]], ARROWHEADS[arc[-1]])
+
+class PycausalSession:
+    '''
+    Long lived py-causal session: the JVM is started once per process and a single
+    tetradrunner is reused for every Tetrad algorithm and task.
+    https://github.com/bd2kccd/py-causal
+    '''
+    def __init__(self, score_id='sem-bic', data_type='continuous', max_degree=-1, faithfulness_assumed=True, verbose=True):
+        self.score_id = score_id
+        self.data_type = data_type
+        self.max_degree = max_degree
+        self.faithfulness_assumed = faithfulness_assumed
+        self.verbose = verbose
+        self.pc = None
+        self.tetrad = None
+        self.pid = None
+
+    def start(self):
+        # the JVM can only be started once per process, a forked worker gets its own session
+        if self.pc is not None and self.pid == os.getpid():
+            return
+        self.pc = pycausal()
+        self.pc.start_vm()
+        self.tetrad = s.tetradrunner()
+        self.pid = os.getpid()
+
+    def stop(self):
+        if self.pc is not None and self.pid == os.getpid():
+            self.pc.stop_vm()
+        self.pc = None
+        self.tetrad = None
+
+    def graph_to_adjacency(self, graph, columns):
+        '''
+        Read the edges of the Tetrad graph object into an adjacency matrix.
+        Each edge is parsed from its string form ("X1 --> X2", "X1 o-> X2", ...) as pycausal's tetradGraphToDot does:
+        tail-tail edges are dropped, tail <- arrow edges are reversed, any other edge is kept as node1 -> node2
+        '''
+        node_index = {str(column): i for i, column in enumerate(columns)}
+        matrix = np.zeros((len(columns), len(columns)))
+        for java_edge in javabridge.iterate_collection(graph.getEdges().o):
+            set_edge(matrix, node_index, javabridge.JWrapper(java_edge).toString())
+        return matrix
+
+    def run(self, feature, algoId):
+        self.start()
+        df = pd.DataFrame(feature)
+        self.tetrad.run(algoId, dfs = df, scoreId = self.score_id, dataType = self.data_type,
+                maxDegree = self.max_degree, faithfulnessAssumed = self.faithfulness_assumed, verbose = self.verbose)
+        return self.graph_to_adjacency(self.tetrad.getTetradGraph(), df.columns)
+
+    def run_batch(self, features, algo_ids):
+        '''
+        Run every algorithm on every task in this session.
+        features: dict task -> feature array
+        returns {(algoId, task): adjacency matrix} and {(algoId, task): wall time}
+        '''
+        self.start()
+        G_estimates = {}
+        wall_times = {}
+        for algoId in algo_ids:
+            for task in features:
+                start = time.time()
+                G_estimates[(algoId, task)] = self.run(features[task], algoId)
+                wall_times[(algoId, task)] = time.time() - start
+        return G_estimates, wall_times
@@ -0,0 +1,170 @@
+from itertools import combinations
+from contextlib import contextmanager
+import multiprocessing as mp
+
+import numpy as np
+from causallearn.graph.GraphClass import CausalGraph
+from causallearn.graph.GeneralGraph import GeneralGraph
+from causallearn.graph.Edge import Edge
+from causallearn.graph.Endpoint import Endpoint
+from causallearn.utils.PCUtils import UCSepset, Meek
+from causallearn.utils.PCUtils.Helper import append_value
+import causallearn.search.ConstraintBased.FCI as fci_module
+
+from .ci_oracle import CIOracle
+
+# oracle of the skeleton search in progress, inherited by the forked workers
+_ci_oracle = None
+
+def _test_pair(job):
+    '''
+    Test x _||_ y | S for every S of size depth drawn from the neighbours of x (without y).
+    As in causal-learn's stable skeleton discovery all subsets are tested and the
+    separating nodes are merged into one separating set.
+    '''
+    x, y, neighbors, depth, alpha = job
+    independent = False
+    sepset = set()
+    pvalues = []
+    for S in combinations(neighbors, depth):
+        p = _ci_oracle.pvalue(x, y, S)
+        pvalues.append((_ci_oracle.get_key(x, y, S), p))
+        if p > alpha:
+            independent = True
+            sepset.update(S)
+    return x, y, independent, tuple(sepset), pvalues
+
+def stable_skeleton(ci_oracle, alpha, n_workers=1):
+    '''
+    Order independent ("stable") adjacency phase of PC. Edges are only removed once every
+    test of a depth is done, so the CI tests of a depth are independent of each other and
+    are fanned out over n_workers processes. Gives the same skeleton and separating sets as
+    the serial causal-learn implementation with stable=True.
+
+    returns the boolean adjacency matrix and {(x, y): [separating sets]}
+    '''
+    adjacency, sepsets, _ = search_skeleton(ci_oracle, alpha, n_workers)
+    return adjacency, sepsets
+
+def search_skeleton(ci_oracle, alpha, n_workers=1):
+    '''
+    stable_skeleton, also returns the separating sets as causal-learn's FAS stores them:
+    {(x, y): set} keyed by the first endpoint (in node order) whose tests removed the edge,
+    the union of its separating subsets
+    '''
+    global _ci_oracle
+    _ci_oracle = ci_oracle
+    n_vars = ci_oracle.n_vars
+    adjacency = np.ones((n_vars, n_vars), dtype=bool)
+    np.fill_diagonal(adjacency, False)
+    sepsets = {}
+    fas_sepsets = {}
+    pool = None
+    if n_workers > 1:
+        pool = mp.get_context('fork').Pool(n_workers)
+    try:
+        depth = -1
+        while adjacency.sum(axis=1).max() - 1 > depth:
+            depth += 1
+            jobs = []
+            for x in range(n_vars):
+                neighbors_x = np.flatnonzero(adjacency[x])
+                if len(neighbors_x) < depth - 1:
+                    continue
+                for y in neighbors_x:
+                    jobs.append((x, y, [v for v in neighbors_x if v != y], depth, alpha))
+            if pool is not None:
+                chunksize = max(1, len(jobs) // (4 * n_workers))
+                results = pool.map(_test_pair, jobs, chunksize)
+            else:
+                results = [_test_pair(job) for job in jobs]
+            # replay the results in the serial order so the separating sets are appended identically
+            edge_removal = set([])
+            for x, y, independent, sepset, pvalues in results:
+                ci_oracle.pvalues.update(pvalues)
+                if independent:
+                    if (x, y) not in edge_removal:
+                        fas_sepsets[(x, y)] = set(sepset)
+                    edge_removal.add((x, y))
+                    edge_removal.add((y, x))
+                if (x, y) in edge_removal:
+                    sepsets.setdefault((x, y), []).append(sepset)
+                    sepsets.setdefault((y, x), []).append(sepset)
+            for x, y in edge_removal:
+                adjacency[x, y] = False
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        _ci_oracle = None
+    return adjacency, sepsets, fas_sepsets
+
+def pc_parallel(data, alpha, ci_oracle, uc_rule=0, uc_priority=-1, n_workers=1):
+    '''
+    PC with the skeleton from stable_skeleton and causal-learn's orientation rules,
+    mirrors causallearn.search.ConstraintBased.PC.pc_alg
+    '''
+    adjacency, sepsets = stable_skeleton(ci_oracle, alpha, n_workers)
+    n_vars = data.shape[1]
+    cg = CausalGraph(n_vars)
+    cg.set_ind_test(ci_oracle)
+    cg.data = data
+    for i in range(n_vars):
+        for j in range(i + 1, n_vars):
+            if not adjacency[i, j]:
+                edge = cg.G.get_edge(cg.G.nodes[i], cg.G.nodes[j])
+                if edge is not None:
+                    cg.G.remove_edge(edge)
+    for (x, y), values in sepsets.items():
+        for sepset in values:
+            append_value(cg.sepset, x, y, sepset)
+
+    if uc_rule == 0:
+        if uc_priority != -1:
+            cg_2 = UCSepset.uc_sepset(cg, uc_priority)
+        else:
+            cg_2 = UCSepset.uc_sepset(cg)
+        cg = Meek.meek(cg_2)
+    elif uc_rule == 1:
+        if uc_priority != -1:
+            cg_2 = UCSepset.maxp(cg, uc_priority)
+        else:
+            cg_2 = UCSepset.maxp(cg)
+        cg = Meek.meek(cg_2)
+    elif uc_rule == 2:
+        if uc_priority != -1:
+            cg_2 = UCSepset.definite_maxp(cg, alpha, uc_priority)
+        else:
+            cg_2 = UCSepset.definite_maxp(cg, alpha)
+        cg_before = Meek.definite_meek(cg_2)
+        cg = Meek.meek(cg_before)
+    else:
+        raise ValueError("uc_rule should be in [0, 1, 2]")
+    return cg
+
+@contextmanager
+def stable_fas(n_workers=1):
+    '''
+    Swap the adjacency search of causal-learn's FCI for stable_skeleton while the context is active.
+    causal-learn's fas is stable by default, the skeleton and separating sets are the same, only the CI tests
+    of each depth are spread over n_workers processes.
+    '''
+    serial_fas = fci_module.fas
+
+    def fas(data, nodes, independence_test_method=None, alpha=0.05, *args, **kwargs):
+        ci_oracle = independence_test_method
+        if not isinstance(ci_oracle, CIOracle):
+            ci_oracle = CIOracle(data, independence_test_method)
+        adjacency, _, sep_sets = search_skeleton(ci_oracle, alpha, n_workers)
+        graph = GeneralGraph(nodes)
+        for i in range(len(nodes)):
+            for j in range(i + 1, len(nodes)):
+                if adjacency[i, j]:
+                    graph.add_edge(Edge(nodes[i], nodes[j], Endpoint.TAIL, Endpoint.TAIL))
+        return graph, sep_sets
+
+    fci_module.fas = fas
+    try:
+        yield
+    finally:
+        fci_module.fas = serial_fas
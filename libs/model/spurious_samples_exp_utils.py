@@ -43,6 +43,13 @@ def get_data(samples_dict, G_estimates):
         test_baseline = np.hstack((test_baseline, y_test.reshape(-1,1)))
     return train_baseline, val_baseline, test_baseline, pca_nodes
 
+def get_pca_nodes(samples_dict, G_estimates):
+    # nodes CausalClassifier trains on for every task, as in get_data
+    pca_nodes = {}
+    for task in samples_dict:
+        pca_nodes[task] = CausalClassifier(G_estimates[task]).nodes_to_train
+    return pca_nodes
+
 def translate_pca_weight_to_full_weights(feature_map, pca_weights, n_orig_features):
     weights_full = np.zeros((1, n_orig_features-1))
     for node_idx, weight in enumerate(pca_weights):
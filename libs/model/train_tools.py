@@ -1,5 +1,5 @@
 import os
-from libs.model import CausalClassifier, PretrainedCausalClf, MLP, CLIPMLP
+from libs.model import CausalClassifier, MLP, CLIPMLP
 from libs.utils import *
 from libs.utils.logger import save_graph, log, set_log_path
 
@@ -206,6 +206,7 @@ def test_empty_nodes(pca_nodes):
 
 def pretrained_model_inference(dataset_name, model_path=None, features=[], nodes_to_train=[], n_feats_orig=0, \
     metadata=[], evaluate_func=None):
+    from libs.model import PretrainedCausalClf
     model = PretrainedCausalClf(dataset_name, model_path)
     preds, labels = model.infer(features, nodes_to_train, n_feats_orig)
     results_obj_test, results_str_test = evaluate_func(preds, labels, metadata)
@@ -0,0 +1,125 @@
+import numpy as np
+import networkx as nx
+
+class CompactGraph:
+    '''
+    Directed graph stored as n x n uint8 edge indicators (any non zero entry of the source matrix is an edge).
+    Behaves as its adjacency matrix for numpy (np.asarray, indexing, shape), so the fusion and search code
+    accepts it in place of a dense matrix; numpy and indexing get read-only views, edges change through
+    __setitem__, set_edge and flip_edge only. Reachability is computed on bit-packed rows and cached until the
+    next edge change. Hashing and equality use the packed edges; do not modify a graph used as a dict key.
+    '''
+    def __init__(self, adjacency):
+        if isinstance(adjacency, CompactGraph):
+            adjacency = adjacency.edges
+        self.edges = (np.asarray(adjacency) != 0).astype(np.uint8)
+        assert self.edges.ndim == 2 and self.edges.shape[0] == self.edges.shape[1]
+        self._reachability = None
+
+    @classmethod
+    def from_networkx(cls, G, nodelist=None):
+        return cls(nx.to_numpy_array(G, nodelist=nodelist, weight=None))
+
+    @classmethod
+    def from_bytes(cls, packed, n_nodes):
+        edges = np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=n_nodes * n_nodes)
+        return cls(edges.reshape(n_nodes, n_nodes))
+
+    @property
+    def shape(self):
+        return self.edges.shape
+
+    @property
+    def n_nodes(self):
+        return self.edges.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        if copy or (dtype is not None and np.dtype(dtype) != self.edges.dtype):
+            if copy is False:
+                raise ValueError("CompactGraph cannot be converted to another dtype without a copy")
+            return self.edges.astype(self.edges.dtype if dtype is None else dtype)
+        return self.read_only()
+
+    def read_only(self):
+        edges = self.edges.view()
+        edges.flags.writeable = False
+        return edges
+
+    def __getitem__(self, idx):
+        return self.read_only()[idx]
+
+    def __setitem__(self, idx, value):
+        self.edges[idx] = np.asarray(value) != 0
+        self._reachability = None
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactGraph):
+            return NotImplemented
+        return self.shape == other.shape and np.array_equal(self.edges, other.edges)
+
+    def __hash__(self):
+        return hash(self.to_bytes())
+
+    def copy(self):
+        return CompactGraph(self.edges)
+
+    def to_bytes(self):
+        # n * n bits, the key of the graph for caches
+        return np.packbits(self.edges, axis=None).tobytes()
+
+    def to_numpy(self, dtype=float):
+        return self.edges.astype(dtype)
+
+    def to_networkx(self):
+        return nx.from_numpy_array(self.edges, create_using=nx.DiGraph)
+
+    def has_edge(self, i, j):
+        return self.edges[i, j] != 0
+
+    def set_edge(self, i, j, value=True):
+        self.edges[i, j] = 1 if value else 0
+        self._reachability = None
+
+    def flip_edge(self, i, j):
+        self.edges[i, j] ^= 1
+        self._reachability = None
+
+    def reachability(self):
+        '''
+        R[i, j] is True iff there is a directed path of length >= 1 from i to j.
+        Warshall on bit-packed rows: for every k, the rows reaching k are or-ed with row k.
+        '''
+        if self._reachability is None:
+            n = self.n_nodes
+            R = np.packbits(self.edges, axis=1)
+            for k in range(n):
+                reaches_k = ((R[:, k >> 3] >> (7 - (k & 7))) & 1).astype(bool)
+                R[reaches_k] |= R[k]
+            self._reachability = np.unpackbits(R, axis=1, count=n).astype(bool)
+            # shared by every caller until the next edge change
+            self._reachability.flags.writeable = False
+        return self._reachability
+
+    def ancestors(self, node):
+        return np.flatnonzero(self.reachability()[:, node])
+
+    def descendants(self, node):
+        return np.flatnonzero(self.reachability()[node, :])
+
+    def parents(self, node):
+        return np.flatnonzero(self.edges[:, node])
+
+    def children(self, node):
+        return np.flatnonzero(self.edges[node, :])
+
+def as_compact(G):
+    if isinstance(G, CompactGraph):
+        return G
+    if isinstance(G, nx.DiGraph):
+        return CompactGraph.from_networkx(G)
+    return CompactGraph(G)
+
+def graph_key(G):
+    # hashable key of the edges of a dense matrix, networkx graph or CompactGraph
+    G = as_compact(G)
+    return (G.n_nodes, G.to_bytes())
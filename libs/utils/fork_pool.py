@@ -0,0 +1,73 @@
+'''
+Fork pool shared by the cb sweep, the annealing of COmnivore_G and the LF bootstrap.
+'''
+import sys
+import multiprocessing as mp
+from queue import Empty
+
+from libs.utils.logger import log
+
+# function of the run in progress, inherited by the forked workers
+_run_config = None
+
+def cuda_initialized():
+    # without importing torch in processes that do not use it
+    torch = sys.modules.get('torch')
+    return torch is not None and torch.cuda.is_available() and torch.cuda.is_initialized()
+
+def _fork_worker(idx, config, queue):
+    try:
+        result = _run_config(config)
+        error = None
+    except Exception as e:
+        result = None
+        error = repr(e)
+    queue.put((idx, result, error))
+
+def run_configs(run_config, configs, n_workers=1):
+    '''
+    Returns [run_config(config) for config in configs], evaluated in up to n_workers forked processes.
+    The workers inherit the data of the parent (features, metadata, ...) read-only instead of pickling it.
+    A config that fails in a worker, or whose worker dies without a result, gets None.
+    CUDA cannot be used in a forked child once the parent initialized it; the configs then run serially.
+    '''
+    if n_workers <= 1 or len(configs) <= 1:
+        return [run_config(config) for config in configs]
+    if cuda_initialized():
+        log("CUDA is initialized in the parent process, running the configs serially")
+        return [run_config(config) for config in configs]
+    global _run_config
+    _run_config = run_config
+    ctx = mp.get_context('fork')
+    queue = ctx.Queue()
+    results = [None for _ in configs]
+    pending = list(range(len(configs)))
+    running = {}
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            while len(pending) > 0 and len(running) < n_workers:
+                idx = pending.pop(0)
+                process = ctx.Process(target=_fork_worker, args=(idx, configs[idx], queue))
+                process.start()
+                running[idx] = process
+            try:
+                idx, result, error = queue.get(timeout=1.)
+            except Empty:
+                # a worker that exited without a result, once its result cannot still be in the queue
+                dead = [idx for idx, process in running.items() if not process.is_alive()]
+                if len(dead) > 0 and queue.empty():
+                    for idx in dead:
+                        process = running.pop(idx)
+                        process.join()
+                        log(f"config {idx} failed: exit code {process.exitcode}")
+                continue
+            running.pop(idx).join()
+            if error is not None:
+                log(f"config {idx} failed: {error}")
+            results[idx] = result
+    finally:
+        for process in running.values():
+            process.terminate()
+            process.join()
+        _run_config = None
+    return results
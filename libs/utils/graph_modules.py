@@ -3,8 +3,16 @@ import os
 import networkx as nx
 import matplotlib.pyplot as plt
 from libs.utils.metrics import shd, sid
+from libs.utils.compact_graph import CompactGraph, as_compact
 
 def modify_single_edge(G, edge, value=None):
+    if isinstance(G, CompactGraph):
+        G_modified = G.copy()
+        if not value:
+            G_modified.flip_edge(edge[0], edge[1])
+        else:
+            G_modified.set_edge(edge[0], edge[1], value)
+        return G_modified
     G_modified = np.copy(G)
     if not value:
         G_modified[edge[0], edge[1]] = np.abs(G[edge[0], edge[1]] - 1)
@@ -21,6 +29,14 @@ def get_ordered_edge_sets(G):
                 edges.append((row, col))
     return edges
 
+def reachability(G):
+    '''
+    Transitive closure of the graph with adjacency G (any non zero entry is an edge, as in nx.DiGraph(G)):
+    R[i, j] is True iff there is a directed path of length >= 1 from i to j, read-only.
+    Bit-packed Warshall of CompactGraph, cached on CompactGraph inputs.
+    '''
+    return as_compact(G).reachability()
+
 def store_graph(target_dir, filename, G):
     if not os.path.exists(target_dir):
         os.makedirs(target_dir)
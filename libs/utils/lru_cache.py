@@ -0,0 +1,34 @@
+from collections import OrderedDict
+
+class LRUCache:
+    '''
+    dict like cache that keeps the max_size most recently used entries, the oldest one is evicted first
+    '''
+    def __init__(self, max_size):
+        assert max_size > 0
+        self.max_size = max_size
+        self.entries = OrderedDict()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, key):
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def __setitem__(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        return self[key]
+
+    def clear(self):
+        self.entries.clear()
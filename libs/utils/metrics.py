@@ -1,8 +1,15 @@
 import networkx as nx
-from cdt.metrics import retrieve_adjacency_matrix, SHD, SID
 
 import numpy as np
+from libs.utils.compact_graph import CompactGraph
 
+def to_adjacency(G, nodelist=None):
+    """
+    Binary adjacency matrix of an nx.DiGraph (in nodelist or G.nodes() order) or of an array (non zero entries are edges)
+    """
+    if isinstance(G, nx.DiGraph):
+        return nx.to_numpy_array(G, nodelist=nodelist, weight=None) != 0
+    return np.asarray(G) != 0
 
 def edge_errors(pred, target):
     """
@@ -20,8 +27,8 @@ def edge_errors(pred, target):
     fn, fp, rev
 
     """
-    true_labels = retrieve_adjacency_matrix(target)
-    predictions = retrieve_adjacency_matrix(pred, target.nodes() if isinstance(target, nx.DiGraph) else None)
+    true_labels = to_adjacency(target).astype(int)
+    predictions = to_adjacency(pred, target.nodes() if isinstance(target, nx.DiGraph) else None).astype(int)
 
     diff = true_labels - predictions
 
@@ -50,8 +57,8 @@ def edge_accurate(pred, target):
     total_edges, tp, tn
 
     """
-    true_labels = retrieve_adjacency_matrix(target)
-    predictions = retrieve_adjacency_matrix(pred, target.nodes() if isinstance(target, nx.DiGraph) else None)
+    true_labels = to_adjacency(target).astype(int)
+    predictions = to_adjacency(pred, target.nodes() if isinstance(target, nx.DiGraph) else None).astype(int)
 
     total_edges = (true_labels).sum()
 
@@ -60,7 +67,131 @@ def edge_accurate(pred, target):
 
     return total_edges, tp, tn
 
-# @jit(target = "cuda")
+def shd_matrix(candidates, references):
+    """
+    Structural hamming distance (as cdt's SHD with double_for_anticausal: a reversed edge counts twice)
+    between every candidate and every reference graph
+
+    Parameters:
+    -----------
+    candidates: ndarray
+        ... x k_c x n x n adjacency matrices
+    references: ndarray
+        ... x k_r x n x n adjacency matrices
+
+    Returns:
+    --------
+    ... x k_c x k_r distances
+
+    """
+    candidates = np.asarray(candidates)
+    references = np.asarray(references)
+    c_edges = (candidates != 0).reshape(candidates.shape[:-2] + (-1,)).astype(float)
+    r_edges = (references != 0).reshape(references.shape[:-2] + (-1,)).astype(float)
+    # |a - b| summed over binary entries = |a| + |b| - 2 a.b
+    shared = c_edges @ np.swapaxes(r_edges, -1, -2)
+    return np.rint(c_edges.sum(axis=-1)[..., :, None] + r_edges.sum(axis=-1)[..., None, :] - 2 * shared).astype(int)
+
+def pairwise_shd(graphs):
+    """
+    SHD between every pair of graphs in a stack
+
+    Parameters:
+    -----------
+    graphs: ndarray
+        ... x k x n x n adjacency matrices
+
+    Returns:
+    --------
+    ... x k x k distances
+
+    """
+    return shd_matrix(graphs, graphs)
+
+def _reachability(G):
+    # R[a, b]: directed path of length >= 1 from a to b, bit-packed Warshall
+    return CompactGraph(G).reachability()
+
+def _sid_errors(pred, target, R):
+    """
+    Pairs (i, j) whose interventional distribution p(x_j | do(x_i)) is wrong when adjusting for the parents
+    of i in pred (Peters & Buehlmann 2015, Proposition 8), target the true graph with reachability R
+    returns n x n boolean errors
+    """
+    n = target.shape[0]
+    D = target.astype(float)
+    R_refl = R | np.eye(n, dtype=bool)
+    errors = np.zeros((n, n), dtype=bool)
+    for i in range(n):
+        Z = pred[:, i]
+        # j a parent of i in pred: no effect predicted, wrong iff j is a descendant of i
+        errors[i] = Z & R[i]
+        # W[j]: nodes on a directed path from i to j (but i), forbidden with all their descendants
+        W = R[i][None, :] & R_refl.T
+        forbidden = (W.astype(float) @ R_refl.astype(float)) > 0
+        invalid = (forbidden & Z[None, :]).any(axis=1)
+        # proper back-door graph of every j: drop i -> w for the children w of i on a directed path to j
+        allowed = D[i][None, :] * ~R_refl.T
+        S_i = np.zeros(n)
+        S_i[i] = 1.
+        def parents(S):
+            P = S @ D.T
+            P[:, i] = (S * allowed).sum(axis=1)
+            return P > 0
+        def children(S):
+            C = (S * (1 - S_i)) @ D + S[:, i:i+1] * allowed
+            return C > 0
+        # ancestors of Z (including Z) in every back-door graph
+        Z_rows = np.repeat(Z[None, :], n, axis=0)
+        A = Z_rows.copy()
+        while True:
+            A_next = A | parents(A.astype(float))
+            if (A_next == A).all():
+                break
+            A = A_next
+        # Bayes-ball from i: up reached from a child, down reached from a parent
+        up = np.repeat((D[:, i] > 0)[None, :], n, axis=0)
+        down = allowed > 0
+        while True:
+            pass_up = (up & ~Z_rows).astype(float)
+            pass_down = (down & ~Z_rows).astype(float)
+            collider = (down & A).astype(float)
+            up_next = up | parents(pass_up + collider)
+            down_next = down | children(pass_up + pass_down)
+            if (up_next == up).all() and (down_next == down).all():
+                break
+            up, down = up_next, down_next
+        connected = (up | down)[np.arange(n), np.arange(n)]
+        errors[i] = errors[i] | (~Z & (invalid | connected))
+        errors[i, i] = False
+    return errors
+
+def sid_matrix(candidates, references):
+    """
+    Structural Intervention Distance (https://arxiv.org/pdf/1306.1043.pdf) of every candidate DAG
+    with respect to every reference (true) DAG, from reachability and parent sets
+
+    Parameters:
+    -----------
+    candidates: ndarray
+        k_c x n x n adjacency matrices
+    references: ndarray
+        k_r x n x n adjacency matrices
+
+    Returns:
+    --------
+    k_c x k_r distances
+
+    """
+    candidates = np.asarray(candidates) != 0
+    references = np.asarray(references) != 0
+    dist = np.zeros((candidates.shape[0], references.shape[0]), dtype=int)
+    for r, target in enumerate(references):
+        R = _reachability(target)
+        for c, pred in enumerate(candidates):
+            dist[c, r] = _sid_errors(pred, target, R).sum()
+    return dist
+
 def sid(pred, target):
     """
     Calculates Structural Intervention Distance (SID): https://arxiv.org/pdf/1306.1043.pdf
@@ -68,7 +199,9 @@ def sid(pred, target):
     :param target:
     :return:
     """
-    return SID(nx.DiGraph(target), nx.DiGraph(pred))
+    target = to_adjacency(target)
+    pred = to_adjacency(pred)
+    return sid_matrix(pred[None], target[None])[0, 0]
 
 def shd(pred, target):
     """
@@ -86,7 +219,9 @@ def shd(pred, target):
     shd
 
     """
-    return(SHD(nx.DiGraph(target), nx.DiGraph(pred)))
+    true_labels = to_adjacency(target)
+    predictions = to_adjacency(pred, target.nodes() if isinstance(target, nx.DiGraph) else None)
+    return shd_matrix(predictions[None], true_labels[None])[0, 0]
 
 def get_max_shd(g):
     max_dist_graph = np.zeros(g.shape)
@@ -0,0 +1,8 @@
+import pytest
+
+from libs.utils.logger import set_log_path
+
+@pytest.fixture(autouse=True)
+def log_path(tmp_path):
+    # libs.utils.logger writes every log line to <log path>/log.txt
+    set_log_path(str(tmp_path))
@@ -0,0 +1,38 @@
+import numpy as np
+import torch
+
+from libs.model import batch_iterator
+from libs.model.batch_iterator import TensorBatches, get_inference_batch_size, to_tensor
+
+def test_every_row_once_per_epoch():
+    X = to_tensor(np.arange(23, dtype=float)[:, None])
+    y = to_tensor(np.arange(23) % 2)
+    batches = TensorBatches([X, y], 5, shuffle=True, generator=torch.Generator().manual_seed(0))
+    assert len(batches) == 5
+    orders = []
+    for epoch in range(3):
+        chunks = list(batches)
+        assert [len(chunk[0]) for chunk in chunks] == [5, 5, 5, 5, 3]
+        rows = torch.cat([chunk[0] for chunk in chunks]).flatten()
+        # the rows stay aligned across tensors
+        assert torch.equal(torch.cat([chunk[1] for chunk in chunks]), rows % 2)
+        assert sorted(rows.tolist()) == list(range(23))
+        orders.append(rows.tolist())
+    assert orders[0] != orders[1]
+
+def test_unshuffled_batches_keep_the_row_order():
+    X = to_tensor(np.arange(7, dtype=float)[:, None])
+    chunks = list(TensorBatches([X], 3, shuffle=False))
+    assert [chunk[0].flatten().tolist() for chunk in chunks] == [[0, 1, 2], [3, 4, 5], [6]]
+
+def test_inference_batch_size(monkeypatch):
+    monkeypatch.setattr(batch_iterator, 'INFERENCE_BATCH_ELEMENTS', 1000)
+    # about INFERENCE_BATCH_ELEMENTS elements per batch
+    assert get_inference_batch_size(10000, 10) == 100
+    # never more than the rows
+    assert get_inference_batch_size(50, 10) == 50
+    # never less than the training batch size, nor 1
+    assert get_inference_batch_size(10000, 10, min_batch_size=256) == 256
+    assert get_inference_batch_size(10000, 5000) == 1
+    assert get_inference_batch_size(10000, 0) == 1000
+    assert get_inference_batch_size(0, 10) == 1
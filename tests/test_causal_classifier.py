@@ -0,0 +1,221 @@
+import numpy as np
+import torch
+
+from libs.model.model_backbone import CLIPMLP
+from libs.model.CausalClassifier import CausalClassifier, MAX_SELECTION_CACHE, set_early_stopping
+from libs.utils.compact_graph import as_compact
+from libs.utils.lru_cache import LRUCache
+from test_metrics import random_dag
+
+class ReferenceSelection:
+    '''
+    node selection of CausalClassifier before the ancestor search was vectorized. Only change: the children
+    of the target are dropped with np.isin, the original np.delete(ancestors, np.argwhere(ancestors==edge_towards))
+    raises in numpy 2 when several of them are ancestors.
+    '''
+    def __init__(self, G_causal):
+        G_causal = np.array(G_causal, dtype=float)
+        self.nodes_to_train = self.get_all_label_ancestors(G_causal, G_causal.shape[1]-1)
+        self.unsure_nodes = np.copy(self.nodes_to_train)
+        self.nodes_to_train = self.get_directly_dependent_nodes(G_causal)
+        self.unsure_nodes = np.setdiff1d(self.unsure_nodes, self.nodes_to_train)
+
+    def get_directly_dependent_nodes(self, G_causal):
+        direct_dependent_nodes = []
+        for node in self.nodes_to_train:
+            other_label_parents = np.delete(self.nodes_to_train, np.argwhere(self.nodes_to_train==node))
+            node_parents = self.get_all_label_ancestors(G_causal, node)
+            intersection = list(set(other_label_parents) & set(node_parents))
+            if len(intersection) == 0:
+                direct_dependent_nodes.append(node)
+        return direct_dependent_nodes
+
+    def get_all_label_ancestors(self, G_causal, label_node):
+        G_causal[-1,-1] = 0
+        ancestors = np.argwhere(G_causal[:, label_node] != 0).flatten()
+        edge_towards = np.argwhere(G_causal[label_node, :] != 0).flatten()
+        edge_towards = np.array([e for e in edge_towards if e in ancestors])
+        if len(edge_towards) > 0:
+            ancestors = ancestors[~np.isin(ancestors, edge_towards)]
+        to_visit = np.copy(ancestors).tolist()
+        visited = set([])
+        while len(to_visit) > 0:
+            curr_node = to_visit[0]
+            parents = np.argwhere(G_causal[:, curr_node]).flatten()
+            edge_towards = np.argwhere(G_causal[label_node, :] != 0).flatten()
+            edge_towards = np.array([e for e in edge_towards if e in ancestors])
+            if len(edge_towards) > 0:
+                ancestors = ancestors[~np.isin(ancestors, edge_towards)]
+            parents = np.asarray([node for node in parents if node not in visited and node != label_node])
+            ancestors = np.append(ancestors, parents)
+            ancestors = np.unique(ancestors)
+            if len(parents) > 0:
+                to_visit = np.append(to_visit, parents)
+            to_visit = np.unique(to_visit)
+            visited.add(curr_node)
+            to_visit = np.delete(to_visit, np.argwhere(to_visit == curr_node))
+        return list(set(ancestors.astype(int).tolist()))
+
+def selection(nodes_to_train, unsure_nodes):
+    return sorted([int(v) for v in nodes_to_train]), sorted([int(v) for v in unsure_nodes])
+
+def random_cyclic_graph(rs, n_nodes):
+    G = (rs.rand(n_nodes, n_nodes) < rs.uniform(0.05, 0.6)).astype(float)
+    np.fill_diagonal(G, 0)
+    return G
+
+def test_selection_matches_reference():
+    rs = np.random.RandomState(0)
+    n_cyclic = 0
+    for trial in range(600):
+        n_nodes = rs.randint(2, 10)
+        if trial % 2 == 0:
+            G = random_dag(rs, n_nodes, rs.uniform(0.1, 0.7))
+        else:
+            G = random_cyclic_graph(rs, n_nodes)
+            n_cyclic += int(as_compact(G).reachability().diagonal().any())
+        original = G.copy()
+        CausalClassifier.selection_cache.clear()
+        classifier = CausalClassifier(G)
+        reference = ReferenceSelection(G)
+        assert selection(classifier.nodes_to_train, classifier.unsure_nodes) == \
+            selection(reference.nodes_to_train, reference.unsure_nodes), G
+        assert np.array_equal(G, original)
+    assert n_cyclic > 100
+
+def test_paths_through_children_of_the_label():
+    # 0 -> 1 <-> 2 (label): 1 is a child of the label, 0 only reaches it through 1
+    G = np.zeros((3, 3))
+    G[0, 1] = G[1, 2] = G[2, 1] = 1
+    classifier = CausalClassifier(G)
+    assert classifier.get_all_label_ancestors(G, 2) == []
+    # 0 -> 2 -> 1 -> 0: 0 reaches the label directly, 1 is its child
+    G = np.zeros((3, 3))
+    G[0, 2] = G[2, 1] = G[1, 0] = 1
+    assert classifier.get_all_label_ancestors(G, 2) == [0]
+    assert classifier.get_all_label_ancestors(G, 0) == [1]
+
+def test_self_loops_are_ignored():
+    rs = np.random.RandomState(1)
+    for trial in range(50):
+        G = random_cyclic_graph(rs, rs.randint(2, 8))
+        with_loops = G.copy()
+        np.fill_diagonal(with_loops, rs.rand(G.shape[0]) < 0.5)
+        CausalClassifier.selection_cache.clear()
+        expected = selection(*CausalClassifier().select_nodes(G))
+        assert selection(*CausalClassifier().select_nodes(with_loops)) == expected
+
+def test_selection_cache_is_bounded(monkeypatch):
+    assert CausalClassifier.selection_cache.max_size == MAX_SELECTION_CACHE
+    monkeypatch.setattr(CausalClassifier, 'selection_cache', LRUCache(4))
+    rs = np.random.RandomState(2)
+    graphs = [random_dag(rs, 6, 0.5) for i in range(10)]
+    for G in graphs:
+        CausalClassifier(G)
+    assert len(CausalClassifier.selection_cache) == 4
+    # cached selections are copies, callers may modify them
+    nodes_to_train, unsure_nodes = CausalClassifier().select_nodes(graphs[-1])
+    nodes_to_train.append(-1)
+    assert -1 not in CausalClassifier().select_nodes(graphs[-1])[0]
+
+def classification_data(seed, n_rows=200, n_features=4):
+    rs = np.random.RandomState(seed)
+    X = rs.randn(n_rows, n_features)
+    y = (X[:, 0] + 0.5 * rs.randn(n_rows) > 0).astype(float)
+    return np.hstack([X, y[:, None]]), rs.randint(3, size=(n_rows, 2)).astype(float)
+
+def accuracy(y_pred, labels, metadata):
+    acc = float((y_pred == labels).mean())
+    return {'acc': acc}, f"acc {acc}"
+
+def test_cached_eval_loader_matches_fresh_loader():
+    torch.manual_seed(0)
+    data, metadata = classification_data(0)
+    model = CLIPMLP(3, 2, n_hidden=8)
+    classifier = CausalClassifier()
+    outputs = [classifier.evaluate(model, data, batch_size=16, nodes_to_train=[0, 1, 2], metadata=metadata) \
+                for i in range(2)]
+    loader = classifier.eval_loader_cache[3]
+    assert classifier.get_eval_loader(data, 16, [0, 1, 2], metadata) is loader
+    fresh = CausalClassifier().evaluate(model, data, batch_size=16, nodes_to_train=[0, 1, 2], metadata=metadata)
+    for cached in outputs:
+        for a, b in zip(cached, fresh):
+            assert np.array_equal(a, b)
+    # another array, or other nodes, get their own loader
+    assert classifier.get_eval_loader(data.copy(), 16, [0, 1, 2], metadata) is not loader
+    assert classifier.get_eval_loader(data, 16, [0, 1], metadata) is not classifier.get_eval_loader(data, 16, [0, 1, 2], metadata)
+
+def test_eval_loader_released_after_training():
+    torch.manual_seed(0)
+    data, metadata = classification_data(1)
+    classifier = CausalClassifier()
+    classifier.train_baseline(CLIPMLP, data, batch_size=32, epochs=2, valdata=data, metadata_val=metadata, \
+                              evaluate_func=accuracy, tune_by_metric='acc')
+    assert classifier.eval_loader_cache is None
+
+class CountingBatches:
+    # trainloader that counts its epochs
+    def __init__(self, batches):
+        self.batches = batches
+        self.n_epochs = 0
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        self.n_epochs += 1
+        return iter(self.batches)
+
+def scripted_training(metrics, epochs, **train_kwargs):
+    '''
+    trains with the validation metric read from metrics at every evaluation,
+    returns the epochs that were evaluated, the model weights at every evaluation and train's outputs
+    '''
+    torch.manual_seed(0)
+    data, metadata = classification_data(2)
+    classifier = CausalClassifier()
+    trainloader, _, _ = classifier.features_to_dataloader(data, 32, [0, 1, 2, 3])
+    trainloader = CountingBatches(trainloader)
+    model = CLIPMLP(4, 2, n_hidden=8)
+    evaluated_epochs = []
+    weights = []
+    evaluate = classifier.evaluate
+    def recording_evaluate(model, *args, **kwargs):
+        evaluated_epochs.append(trainloader.n_epochs - 1)
+        weights.append({name: tensor.clone() for name, tensor in model.state_dict().items()})
+        return evaluate(model, *args, **kwargs)
+    classifier.evaluate = recording_evaluate
+    scores = iter(metrics)
+    evaluate_func = lambda y_pred, labels, metadata: ({'acc': next(scores)}, '')
+    outputs = classifier.train(model, trainloader, epochs=epochs, valdata=data, metadata_val=metadata, batch_size=32, \
+                               evaluate_func=evaluate_func, tune_by_metric='acc', **train_kwargs)
+    return evaluated_epochs, weights, outputs
+
+def state_equal(state, expected):
+    return state.keys() == expected.keys() and all([torch.equal(state[name], expected[name]) for name in state])
+
+def test_stops_after_patience_evaluations_without_improvement(monkeypatch):
+    # set_early_stopping changes the class defaults, restored by monkeypatch
+    monkeypatch.setattr(CausalClassifier, 'patience', None)
+    monkeypatch.setattr(CausalClassifier, 'eval_interval', 1)
+    set_early_stopping(patience=2)
+    evaluated_epochs, weights, (model, val_perf, best_chkpt) = \
+        scripted_training([0.1, 0.5, 0.3, 0.5, 0.9, 0.9], epochs=10)
+    # 0.3 and 0.5 do not improve on the best 0.5
+    assert evaluated_epochs == [0, 1, 2, 3]
+    assert len(val_perf) == 4
+    assert state_equal(best_chkpt.state_dict(), weights[1])
+    assert not state_equal(model.state_dict(), weights[1])
+
+def test_eval_interval_always_evaluates_the_last_epoch():
+    evaluated_epochs, weights, (model, val_perf, best_chkpt) = \
+        scripted_training([0.2, 0.7, 0.4], epochs=7, eval_interval=3)
+    assert evaluated_epochs == [2, 5, 6]
+    assert state_equal(best_chkpt.state_dict(), weights[1])
+
+def test_best_checkpoint_without_early_stopping():
+    metrics = [0.3, 0.2, 0.6, 0.6, 0.1]
+    evaluated_epochs, weights, (model, val_perf, best_chkpt) = scripted_training(metrics, epochs=5)
+    assert evaluated_epochs == [0, 1, 2, 3, 4]
+    # the first epoch reaching the best metric
+    assert state_equal(best_chkpt.state_dict(), weights[2])
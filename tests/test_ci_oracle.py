@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from causallearn.utils.cit import fisherz, mv_fisherz
+from causallearn.search.ConstraintBased.PC import pc
+from causallearn.search.ConstraintBased.FCI import fci
+
+from libs.model.LF import LF
+from libs.model.ci_oracle import CIOracle
+
+def linear_gaussian(seed, n_vars=6, n_samples=300):
+    rs = np.random.RandomState(seed)
+    weights = np.triu(rs.uniform(0.5, 1.5, (n_vars, n_vars)) * (rs.rand(n_vars, n_vars) < 0.4), 1)
+    data = np.zeros((n_samples, n_vars))
+    for j in range(n_vars):
+        data[:, j] = data @ weights[:, j] + rs.randn(n_samples)
+    return data
+
+@pytest.mark.parametrize('test', [fisherz, mv_fisherz])
+def test_pvalues_match_causallearn(test):
+    data = linear_gaussian(0)
+    oracle = CIOracle(data, test)
+    for X, Y, condition_set in [(0, 1, ()), (1, 3, (0,)), (2, 5, (0, 1, 3, 4)), (0, 4, (2, 3))]:
+        assert np.isclose(oracle.pvalue(X, Y, condition_set), test(data, X, Y, condition_set))
+    vector = oracle.pvalue_vector(0, [2, 3], (1,))
+    assert np.allclose(vector, [test(data, 0, c, (1,)) for c in [2, 3]])
+
+def test_default_is_mv_fisherz():
+    oracle = LF().get_ci_oracle(linear_gaussian(0))
+    assert oracle.test is mv_fisherz
+
+def test_pc_fci_match_baseline():
+    lf = LF()
+    for seed in range(30):
+        data = linear_gaussian(seed)
+        assert np.array_equal(lf.LF_pc(data), pc(data, 0.04, mv_fisherz, True, 0, -1).G.dpath)
+        G, _ = fci(data, mv_fisherz, 0.04, verbose=False)
+        assert np.array_equal(lf.LF_fci(data), lf.get_adjacency(G.graph))
+
+def test_ci_oracles_bounded():
+    lf = LF()
+    for seed in range(20):
+        lf.get_ci_oracle(linear_gaussian(seed, n_samples=50))
+    assert len(lf.ci_oracles) <= 16
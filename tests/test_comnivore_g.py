@@ -0,0 +1,79 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from libs.model.Best_G_Estimator import State
+from libs.model.COmnivore_G import COmnivore_G
+
+def random_estimates(seed, n_lfs=4, n_tasks=2, n_nodes=5):
+    rs = np.random.RandomState(seed)
+    return {f"lf_{i}": {f"task_{t}": np.triu(rs.rand(n_nodes, n_nodes) < 0.4, 1).astype(float) \
+                        for t in range(n_tasks)} for i in range(n_lfs)}
+
+def get_comnivore(G_estimates, n_workers=1):
+    return COmnivore_G(G_estimates, n_triplets=None, min_iters=10, max_iters=30, step=10, n_chains=2, \
+                        n_workers=n_workers)
+
+def test_random_init_reproducible_with_workers():
+    G_estimates = random_estimates(0)
+    runs = []
+    for n_workers in [1, 2, 2]:
+        np.random.seed(0)
+        runs.append(get_comnivore(G_estimates, n_workers).fuse_estimates())
+    for g_hats in runs[1:]:
+        for task in runs[0]:
+            assert np.array_equal(g_hats[task], runs[0][task])
+
+def test_checkpoint_resumed_only_on_same_lf_graphs(tmp_path):
+    checkpoint_path = str(tmp_path / 'annealing.pkl')
+    np.random.seed(0)
+    snapshots = list(get_comnivore(random_estimates(0)).iter_estimates(checkpoint_path))
+    resumed = get_comnivore(random_estimates(0))
+    assert resumed.load_checkpoint(checkpoint_path) is not None
+    resumed_snapshots = list(resumed.iter_estimates(checkpoint_path))
+    assert all([np.array_equal(a[2], b[2]) for a, b in zip(snapshots, resumed_snapshots)])
+    assert get_comnivore(random_estimates(1)).load_checkpoint(checkpoint_path) is None
+
+def snapshots_equal(a, b):
+    return len(a) == len(b) and all([x[0] == y[0] and x[1] == y[1] and np.array_equal(x[2], y[2]) and x[3] == y[3] \
+                                     for x, y in zip(a, b)])
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_interrupted_run_resumes(tmp_path, n_workers):
+    checkpoint_path = str(tmp_path / 'annealing.pkl')
+    np.random.seed(0)
+    uninterrupted = list(get_comnivore(random_estimates(0), n_workers).iter_estimates())
+    np.random.seed(0)
+    estimates = get_comnivore(random_estimates(0), n_workers).iter_estimates(checkpoint_path)
+    # the snapshots of every task for the first budget
+    interrupted = [next(estimates) for i in range(2)]
+    estimates.close()
+    with open(checkpoint_path, 'rb') as f:
+        checkpoint = pickle.load(f)
+    assert checkpoint['budget_idx'] == 1 and 'snapshots' not in checkpoint
+    # snapshots of a budget whose checkpoint was never written are dropped
+    get_comnivore(random_estimates(0)).write_snapshots([interrupted], checkpoint_path, append=True)
+    np.random.seed(1)
+    resumed = list(get_comnivore(random_estimates(0), n_workers).iter_estimates(checkpoint_path))
+    assert snapshots_equal(interrupted, uninterrupted[:2])
+    assert snapshots_equal(resumed, uninterrupted)
+    # each budget is appended once to the snapshots file
+    assert len(get_comnivore(random_estimates(0)).load_snapshots(checkpoint_path, 3)) == 3
+
+def test_swap_accepts_lower_cost_exchange():
+    comnivore = get_comnivore(random_estimates(0))
+    temperatures = [1., 0.5]
+    for seed in range(100):
+        np.random.seed(seed)
+        # the exchange moves the lower cost state to the colder chain
+        states = comnivore.swap_chains([State(None, 1.), State(None, 5.)], temperatures, 0)
+        assert [state.cost for state in states] == [5., 1.]
+
+def test_swap_pairs_alternate():
+    comnivore = get_comnivore(random_estimates(0))
+    temperatures = [1., 0.5, 0.25, 0.125]
+    # costs growing towards the colder chains: every exchange lowers the cost and is accepted
+    for offset, order in [(0, [1, 0, 3, 2]), (1, [0, 2, 1, 3])]:
+        states = comnivore.swap_chains([State(k, float(k)) for k in range(4)], temperatures, offset)
+        assert [state.G for state in states] == order
@@ -0,0 +1,28 @@
+import numpy as np
+
+from libs.model.COmnivore_V import COmnivore_V
+
+def random_estimates(seed, n_lfs=4, n_tasks=2, n_pca_features=8):
+    rs = np.random.RandomState(seed)
+    return {f"lf_{i}": {f"task_{t}": np.triu(rs.rand(n_pca_features, n_pca_features) < 0.4, 1).astype(float) \
+                        for t in range(n_tasks)} for i in range(n_lfs)}
+
+def fuse(comnivore, cbs, n_pca_features=8):
+    return {cb: comnivore.fuse_estimates(cb, n_pca_features, return_probs=True)[1] for cb in cbs}
+
+def test_warm_start_does_not_depend_on_fit_order():
+    G_estimates = random_estimates(0)
+    cbs = [0.2, 0.35, 0.5, 0.65, 0.8]
+    grid = COmnivore_V(G_estimates, snorkel_lr=1e-2, snorkel_ep=50, warm_start_ep=10)
+    grid.fit_label_models(cbs, 8)
+    grid_probs = fuse(grid, cbs)
+    for order in [cbs[::-1], [0.65, 0.2], [0.8]]:
+        comnivore = COmnivore_V(G_estimates, snorkel_lr=1e-2, snorkel_ep=50, warm_start_ep=10)
+        for cb, probs in fuse(comnivore, order).items():
+            assert np.array_equal(probs, grid_probs[cb])
+
+def test_anchor_is_a_cold_fit():
+    G_estimates = random_estimates(1)
+    warm = COmnivore_V(G_estimates, snorkel_lr=1e-2, snorkel_ep=50, warm_start_ep=10)
+    cold = COmnivore_V(G_estimates, snorkel_lr=1e-2, snorkel_ep=50)
+    assert np.array_equal(fuse(warm, [0.2, 0.5])[0.5], fuse(cold, [0.5])[0.5])
@@ -0,0 +1,89 @@
+import warnings
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from libs.model.Best_G_Estimator import SimulatedAnnealing
+from libs.utils.compact_graph import CompactGraph, as_compact, graph_key
+from libs.utils.graph_modules import modify_single_edge, reachability
+from libs.utils.metrics import shd, sid, shd_matrix, sid_matrix
+from test_metrics import random_dag
+
+def random_graph(rs, n_nodes):
+    return (rs.rand(n_nodes, n_nodes) < rs.uniform(0.05, 0.5)).astype(float)
+
+def test_reachability_matches_networkx():
+    rs = np.random.RandomState(0)
+    for trial in range(100):
+        G = random_graph(rs, rs.randint(1, 20))
+        H = nx.DiGraph(G)
+        expected = np.zeros(G.shape, dtype=bool)
+        for i in range(G.shape[0]):
+            # descendants do not include i, unless it is on a cycle
+            expected[i, list(nx.descendants(H, i))] = True
+            expected[i, i] = any([H.has_edge(j, i) for j in nx.descendants(H, i) | set([i])])
+        assert np.array_equal(CompactGraph(G).reachability(), expected)
+        assert np.array_equal(reachability(G), expected)
+
+def test_bytes_round_trip_hash_and_eq():
+    rs = np.random.RandomState(1)
+    for n_nodes in [1, 3, 8, 13]:
+        G = CompactGraph(random_graph(rs, n_nodes))
+        H = CompactGraph.from_bytes(G.to_bytes(), n_nodes)
+        assert H == G and hash(H) == hash(G)
+        assert graph_key(G) == graph_key(np.asarray(G) * 2.) == graph_key(G.to_networkx())
+        H.flip_edge(0, n_nodes - 1)
+        assert H != G
+    assert len(set([CompactGraph(np.eye(3)), CompactGraph(np.eye(3) * 5)])) == 1
+
+def test_array_views_are_read_only():
+    G = CompactGraph(np.zeros((3, 3)))
+    assert not G.reachability()[0, 1]
+    with pytest.raises(ValueError):
+        np.asarray(G)[0, 1] = 1
+    with pytest.raises(ValueError):
+        G[0][1] = 1
+    G[0, 1] = 1
+    assert G.reachability()[0, 1]
+    with warnings.catch_warnings():
+        # numpy 2 warns when __array__ does not accept copy
+        warnings.simplefilter('error')
+        dense = np.array(G, dtype=float)
+        dense[1, 2] = 1
+        edges = np.array(G)
+        edges[1, 2] = 1
+    assert not G.has_edge(1, 2) and not G.reachability()[0, 2]
+    assert dense.dtype == float and np.array_equal(np.asarray(G, dtype=float), [[0, 1, 0], [0, 0, 0], [0, 0, 0]])
+
+def test_modify_single_edge():
+    G = CompactGraph(np.zeros((3, 3)))
+    H = modify_single_edge(G, (0, 2))
+    assert H.has_edge(0, 2) and not G.has_edge(0, 2)
+    assert not modify_single_edge(H, (0, 2)).has_edge(0, 2)
+
+def test_metrics_accept_compact_graphs():
+    rs = np.random.RandomState(2)
+    for trial in range(20):
+        pred, target = random_dag(rs, 6), random_dag(rs, 6)
+        assert shd(CompactGraph(pred), CompactGraph(target)) == shd(pred, target)
+        assert sid(CompactGraph(pred), CompactGraph(target)) == sid(pred, target)
+    graphs = [random_dag(rs, 5) for i in range(4)]
+    compact = np.stack([np.asarray(CompactGraph(G)) for G in graphs])
+    assert np.array_equal(shd_matrix(compact, compact), shd_matrix(np.stack(graphs), np.stack(graphs)))
+    assert np.array_equal(sid_matrix(compact, compact), sid_matrix(np.stack(graphs), np.stack(graphs)))
+
+def test_simulated_annealing_accepts_compact_graphs():
+    rs = np.random.RandomState(3)
+    G_lambdas = [random_dag(rs, 6) for i in range(5)]
+    results = []
+    for graphs in [G_lambdas, [as_compact(G) for G in G_lambdas]]:
+        np.random.seed(0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            sa = SimulatedAnnealing(graphs, maxiter=200, decrease_t_iter=20)
+        state = sa.optimize(verbose=False)
+        results.append((np.copy(state.G), state.cost))
+    assert np.array_equal(results[0][0], results[1][0]) and results[0][1] == results[1][1]
+    # the annealer works on its own copy
+    assert all([np.array_equal(np.asarray(G), G_dense) for G, G_dense in zip(graphs, G_lambdas)])
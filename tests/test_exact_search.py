@@ -0,0 +1,39 @@
+import numpy as np
+from causallearn.search.ScoreBased.ExactSearch import bic_exact_search, bic_score_node
+
+from libs.model.LF import LF
+from libs.model.exact_search import LocalBIC, EXACT, GREEDY
+from libs.model.skeleton import stable_skeleton
+
+from test_ci_oracle import linear_gaussian
+
+def test_local_bic_matches_causallearn():
+    data = linear_gaussian(0) + 3.
+    local_bic = LocalBIC(data)
+    for node, parents in [(0, ()), (3, (0, 1)), (5, (1, 2, 4))]:
+        assert np.isclose(local_bic(node, parents), bic_score_node(data, node, parents))
+
+def test_default_matches_bic_exact_search():
+    lf = LF()
+    for seed in range(10):
+        data = linear_gaussian(seed)
+        dag, _ = bic_exact_search(data)
+        assert np.array_equal(lf.LF_bic_exact_search(data), dag)
+
+def test_mode_returned():
+    lf = LF()
+    data = linear_gaussian(0)
+    dag, mode = lf.LF_bic_exact_search(data, return_mode=True)
+    assert mode == EXACT and np.array_equal(dag, lf.LF_bic_exact_search(data))
+    assert lf.LF_bic_exact_search(data, max_vars=2, max_degree=0, return_mode=True)[1] == GREEDY
+
+def test_exact_over_sparse_skeleton_above_max_vars():
+    lf = LF()
+    for seed in range(5):
+        data = linear_gaussian(seed, n_vars=8)
+        adjacency, _ = stable_skeleton(lf.get_ci_oracle(data), 0.04)
+        max_degree = adjacency.sum(axis=0).max()
+        dag, mode = lf.LF_bic_exact_search(data, max_vars=4, max_degree=max_degree, return_mode=True)
+        assert mode == EXACT
+        assert np.array_equal(dag, bic_exact_search(data, super_graph=adjacency.astype(int))[0])
+        assert lf.LF_bic_exact_search(data, max_vars=4, max_degree=max_degree - 1, return_mode=True)[1] == GREEDY
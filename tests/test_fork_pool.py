@@ -0,0 +1,16 @@
+import os
+
+from libs.utils.fork_pool import run_configs
+
+def square_or_fail(x):
+    if x == 2:
+        raise ValueError(x)
+    if x == 3:
+        os._exit(0)
+    return x * x
+
+def test_results_in_config_order():
+    assert run_configs(lambda x: x * x, list(range(6)), n_workers=3) == [x * x for x in range(6)]
+
+def test_failed_configs_get_none():
+    assert run_configs(square_or_fail, [0, 1, 2, 3, 4], n_workers=2) == [0, 1, None, None, 16]
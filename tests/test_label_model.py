@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from libs.model.label_model import BatchedLabelModel
+
+LabelModel = pytest.importorskip('snorkel.labeling.model').LabelModel
+
+def random_votes(seed, n=200, m=5):
+    rs = np.random.RandomState(seed)
+    y = rs.randint(2, size=n)
+    accuracies = rs.uniform(0.55, 0.9, m)
+    L = np.where(rs.rand(n, m) < accuracies, y[:, None], 1 - y[:, None])
+    L[rs.rand(n, m) < 0.3] = -1
+    return L
+
+def test_same_posteriors_as_snorkel():
+    L = np.stack([random_votes(seed) for seed in range(3)])
+    class_balances = np.array([[0.3, 0.7], [0.5, 0.5], [0.8, 0.2]])
+    model = BatchedLabelModel(cardinality=2).fit(L, class_balances, n_epochs=100, lr=0.01, seed=123)
+    preds, probs = model.predict(L, return_probs=True)
+    for c, class_balance in enumerate(class_balances):
+        for b in range(L.shape[0]):
+            snorkel_model = LabelModel(cardinality=2, verbose=False)
+            snorkel_model.fit(L[b], n_epochs=100, lr=0.01, seed=123, class_balance=class_balance, progress_bar=False)
+            assert np.allclose(probs[c, b], snorkel_model.predict_proba(L[b]), atol=1e-4)
+            assert np.array_equal(preds[c, b], snorkel_model.predict(L[b]))
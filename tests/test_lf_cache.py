@@ -0,0 +1,26 @@
+import numpy as np
+
+from libs.model import lf_cache
+from libs.model.lf_cache import LFCache, feature_digest, get_cache_key
+
+def test_key_changes_with_lf_version(monkeypatch):
+    digest = feature_digest(np.zeros((4, 3)))
+    key = get_cache_key(digest, 'GS', {'alpha': 0.05})
+    assert get_cache_key(digest, 'GS', {'alpha': 0.05}) == key
+    monkeypatch.setitem(lf_cache.LF_VERSIONS, 'GS', lf_cache.LF_VERSIONS['GS'] + 1)
+    assert get_cache_key(digest, 'GS', {'alpha': 0.05}) != key
+
+def test_entries_persist(tmp_path):
+    cache = LFCache(str(tmp_path))
+    cache.put('a', np.eye(3), 'greedy')
+    cache.put('b', np.ones((3, 3)))
+    cache.save()
+    reloaded = LFCache(str(tmp_path))
+    assert np.array_equal(reloaded.get('a'), np.eye(3)) and reloaded.get_mode('a') == 'greedy'
+    assert np.array_equal(reloaded.get('b'), np.ones((3, 3))) and reloaded.get_mode('b') is None
+    assert reloaded.get('c') is None
+
+def test_unreadable_cache_is_logged(tmp_path):
+    (tmp_path / lf_cache.CACHE_FILE_NAME).write_bytes(b'not an archive')
+    assert LFCache(str(tmp_path)).entries == {}
+    assert 'could not read LF cache' in (tmp_path / 'log.txt').read_text()
@@ -0,0 +1,88 @@
+import time
+import numpy as np
+import pytest
+
+from libs.model.lf_cache import LFCache
+from libs.model.lf_executor import LFExecutor
+
+class FakeLFDict(dict):
+    def get_method(self, lf_name):
+        return self[lf_name]
+
+class FakeLFFactory:
+    def __init__(self, lfs):
+        self.lf_dict = FakeLFDict(lfs)
+
+    def get_ci_oracle(self, features, score_func=None):
+        return None
+
+def failing_lf(features):
+    raise ValueError("singular matrix")
+
+def empty_lf(features):
+    return np.zeros((features.shape[1], features.shape[1]))
+
+@pytest.fixture
+def setup():
+    samples_dict = {'task_0': {'pca_features': np.random.RandomState(0).randn(20, 3)}}
+    lf_factory = FakeLFFactory({'PC': failing_lf, 'GS': empty_lf})
+    return samples_dict, lf_factory
+
+def test_failed_lf_raises_by_default(setup):
+    samples_dict, lf_factory = setup
+    with pytest.raises(ValueError):
+        LFExecutor().run(samples_dict, ['task_0'], {'classic': ['PC', 'GS']}, lf_factory, log_graph=False)
+
+def test_failed_lf_raises_in_workers(setup):
+    samples_dict, lf_factory = setup
+    with pytest.raises(RuntimeError, match='PC'):
+        LFExecutor(n_workers=2).run(samples_dict, ['task_0'], {'classic': ['PC', 'GS']}, lf_factory, log_graph=False)
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_failed_lf_dropped(setup, n_workers):
+    samples_dict, lf_factory = setup
+    executor = LFExecutor(n_workers=n_workers, drop_failed=True)
+    G_estimates = executor.run(samples_dict, ['task_0'], {'classic': ['PC', 'GS']}, lf_factory, log_graph=False)
+    assert list(G_estimates.keys()) == ['GS']
+    assert [stat['status'].startswith('failed') for stat in executor.stats if stat['lf'] == 'PC'] == [True]
+
+def sleeping_lf(features):
+    time.sleep(30)
+    return np.ones((features.shape[1], features.shape[1]))
+
+def test_timed_out_lf_dropped(setup):
+    samples_dict, lf_factory = setup
+    lf_factory.lf_dict['PC'] = sleeping_lf
+    executor = LFExecutor(n_workers=2, lf_timeouts={'PC': 1})
+    start = time.time()
+    G_estimates = executor.run(samples_dict, ['task_0'], {'classic': ['PC', 'GS']}, lf_factory, log_graph=False)
+    assert time.time() - start < 10
+    assert list(G_estimates.keys()) == ['GS']
+    assert np.array_equal(G_estimates['GS']['task_0'], np.zeros((3, 3)))
+    assert {stat['lf']: stat['status'] for stat in executor.stats} == {'PC': 'timeout', 'GS': 'done'}
+
+def test_late_result_ignored(setup):
+    # result of a job that was already dropped after its timeout
+    samples_dict, lf_factory = setup
+    executor = LFExecutor(n_workers=2)
+    jobs = executor.get_jobs([('classic', 'PC', 'task_0'), ('classic', 'GS', 'task_0')])
+    results = {}
+    executor.handle_result((0, {('PC', 'task_0'): np.ones((3, 3))}, {('PC', 'task_0'): 1.}, {}, {}, None, 0.), \
+                            jobs, {}, results)
+    assert results == {} and executor.stats == []
+
+def greedy_lf(features, max_vars=20, return_mode=False):
+    dag = np.zeros((features.shape[1], features.shape[1]))
+    return (dag, 'greedy') if return_mode else dag
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_mode_returned_and_cached(setup, tmp_path, n_workers):
+    samples_dict, lf_factory = setup
+    lf_factory.lf_dict['Exact Search'] = greedy_lf
+    for status in ['done', 'cached']:
+        executor = LFExecutor(n_workers=n_workers, lf_cache=LFCache(str(tmp_path)))
+        G_estimates = executor.run(samples_dict, ['task_0'], {'classic': ['Exact Search', 'GS']}, lf_factory, log_graph=False)
+        assert list(G_estimates.keys()) == ['Exact Search', 'GS']
+        assert executor.modes == {('Exact Search', 'task_0'): 'greedy'}
+        assert {stat['lf']: (stat['status'], stat['mode']) for stat in executor.stats} == \
+            {'Exact Search': (status, 'greedy'), 'GS': (status, None)}
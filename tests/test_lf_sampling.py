@@ -0,0 +1,32 @@
+import os
+
+import numpy as np
+import pytest
+
+from libs.model.lf_sampling import AdaptiveSampler
+
+def test_growth_must_be_above_one():
+    with pytest.raises(ValueError):
+        AdaptiveSampler(growth=1.)
+
+def test_sizes_grow_to_max():
+    sampler = AdaptiveSampler(initial_size=100, growth=1.5)
+    sizes = sampler.get_sizes('PC', 1000)
+    assert sizes[0] == 100 and sizes[-1] == 1000
+    assert all([a < b for a, b in zip(sizes[:-1], sizes[1:])])
+
+def dies_on_small_sample(features):
+    # the resamples have fewer distinct rows than the full sample
+    if len(np.unique(features, axis=0)) < features.shape[0]:
+        os._exit(1)
+    return np.eye(features.shape[1])
+
+def test_dead_bootstrap_worker():
+    sampler = AdaptiveSampler(initial_size=10, n_bootstrap=2, n_workers=2)
+    features = np.random.RandomState(0).randn(40, 3)
+    assert sampler.bootstrap(dies_on_small_sample, features, 20) is None
+
+def test_bootstrap_frequencies():
+    sampler = AdaptiveSampler(initial_size=10, n_bootstrap=3, n_workers=2)
+    frequencies = sampler.bootstrap(lambda rows: np.eye(rows.shape[1]), np.random.RandomState(0).randn(40, 3), 20)
+    assert np.array_equal(frequencies, np.eye(3))
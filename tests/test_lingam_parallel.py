@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+from causallearn.search.FCMBased.lingam import DirectLiNGAM
+
+from libs.model.lingam_parallel import ParallelDirectLiNGAM
+
+def linear_non_gaussian(seed, n_vars=6, n_samples=500):
+    rs = np.random.RandomState(seed)
+    order = rs.permutation(n_vars)
+    weights = np.triu(rs.uniform(0.5, 1.5, (n_vars, n_vars)) * (rs.rand(n_vars, n_vars) < 0.5), 1)
+    data = np.zeros((n_samples, n_vars))
+    for j in range(n_vars):
+        data[:, j] = data @ weights[:, j] + rs.uniform(-1, 1, n_samples)
+    return data[:, order]
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_same_graphs_as_direct_lingam(n_workers):
+    for seed in range(5):
+        data = linear_non_gaussian(seed)
+        expected = DirectLiNGAM().fit(data)
+        model = ParallelDirectLiNGAM(n_workers=n_workers).fit(data)
+        assert model.causal_order_ == expected.causal_order_
+        assert np.allclose(model.adjacency_matrix_, expected.adjacency_matrix_)
@@ -0,0 +1,30 @@
+import inspect
+
+import numpy as np
+from causallearn.utils.cit import fisherz
+
+from libs.model.LF import LF
+
+from test_ci_oracle import linear_gaussian
+
+def test_defaults_follow_bnlearn():
+    lf = LF()
+    for lf_name in ['MMPC', 'GS', 'IAMB', 'Inter_IAMB']:
+        params = inspect.signature(lf.lf_dict[lf_name]).parameters
+        assert params['alpha'].default == 0.05
+        assert params['score_func'].default == 'fisherz'
+
+def test_chain_blankets():
+    # x -> y -> z, plus independent noise columns
+    rs = np.random.RandomState(0)
+    x = rs.randn(1000)
+    y = x + 0.5 * rs.randn(1000)
+    z = y + 0.5 * rs.randn(1000)
+    data = np.column_stack([x, y, z, rs.randn(1000, 3)])
+    lf = LF()
+    for lf_name in ['MMPC', 'GS', 'IAMB', 'Inter_IAMB']:
+        dag = lf.lf_dict[lf_name](data)
+        skeleton = (dag + dag.T) > 0
+        assert skeleton[0, 1] and skeleton[1, 2] and not skeleton[0, 2]
+        assert not skeleton[3:, :].any()
+    assert lf.get_ci_oracle(data, 'fisherz').test is fisherz
@@ -0,0 +1,87 @@
+import networkx as nx
+import numpy as np
+
+from libs.utils.metrics import shd, sid, shd_matrix, sid_matrix, pairwise_shd
+
+def random_dag(rs, n_nodes, p=0.4):
+    order = rs.permutation(n_nodes)
+    G = np.triu(rs.rand(n_nodes, n_nodes) < p, 1).astype(float)
+    return G[np.ix_(order, order)]
+
+def reference_shd(pred, target):
+    # cdt.metrics.SHD with double_for_anticausal=True
+    diff = np.abs((np.asarray(target) != 0).astype(int) - (np.asarray(pred) != 0).astype(int))
+    return np.sum(diff)
+
+def reference_sid(pred, target):
+    '''
+    SID by definition (Peters & Buehlmann 2015): (i, j) is an error when the parents of i in pred are not
+    a valid adjustment set for the effect of i on j in target (adjustment criterion, checked with d-separation)
+    '''
+    H = nx.DiGraph(np.asarray(target) != 0)
+    n = H.number_of_nodes()
+    errors = 0
+    for i in range(n):
+        Z = set(np.flatnonzero(np.asarray(pred)[:, i]).tolist())
+        descendants_i = nx.descendants(H, i)
+        for j in range(n):
+            if i == j:
+                continue
+            if j in Z:
+                errors += int(j in descendants_i)
+                continue
+            on_path = set([w for w in descendants_i if w == j or j in nx.descendants(H, w)])
+            forbidden = set(on_path)
+            for w in on_path:
+                forbidden |= nx.descendants(H, w)
+            if len(Z & forbidden) > 0:
+                errors += 1
+                continue
+            back_door = H.copy()
+            back_door.remove_edges_from([(i, w) for w in on_path if H.has_edge(i, w)])
+            errors += int(not nx.is_d_separator(back_door, {i}, {j}, Z))
+    return errors
+
+def test_shd_reference():
+    rs = np.random.RandomState(0)
+    for _ in range(50):
+        n_nodes = rs.randint(2, 8)
+        target = random_dag(rs, n_nodes)
+        pred = random_dag(rs, n_nodes)
+        assert shd(pred, target) == reference_shd(pred, target)
+        assert shd(nx.DiGraph(pred), nx.DiGraph(target)) == reference_shd(pred, target)
+
+def test_shd_reversed_and_empty():
+    target = np.array([[0, 1, 0], [0, 0, 1], [0, 0, 0]])
+    assert shd(target.T, target) == 4
+    assert shd(np.zeros((3, 3)), np.zeros((3, 3))) == 0
+    assert shd(np.zeros((3, 3)), target) == 2
+    assert shd(-target, target) == 0
+
+def test_sid_reference():
+    rs = np.random.RandomState(1)
+    for _ in range(100):
+        n_nodes = rs.randint(2, 7)
+        target = random_dag(rs, n_nodes)
+        pred = random_dag(rs, n_nodes)
+        assert sid(pred, target) == reference_sid(pred, target)
+        # reversed edges and empty graphs
+        assert sid(target.T, target) == reference_sid(target.T, target)
+        assert sid(np.zeros_like(target), target) == reference_sid(np.zeros_like(target), target)
+        assert sid(target, np.zeros_like(target)) == reference_sid(target, np.zeros_like(target))
+        assert sid(target, target) == 0
+
+def test_sid_chain():
+    chain = np.array([[0, 1, 0], [0, 0, 1], [0, 0, 0]])
+    assert sid(np.zeros((3, 3)), chain) == 3
+    assert sid(chain.T, chain) == reference_sid(chain.T, chain)
+
+def test_batched_matrices():
+    rs = np.random.RandomState(2)
+    candidates = np.stack([random_dag(rs, 5) for _ in range(4)])
+    references = np.stack([random_dag(rs, 5) for _ in range(3)])
+    shd_expected = [[reference_shd(c, r) for r in references] for c in candidates]
+    sid_expected = [[reference_sid(c, r) for r in references] for c in candidates]
+    assert np.array_equal(shd_matrix(candidates, references), shd_expected)
+    assert np.array_equal(sid_matrix(candidates, references), sid_expected)
+    assert np.array_equal(pairwise_shd(candidates[None])[0], shd_matrix(candidates, candidates))
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('pycausal')
+from libs.model.pycausal_session import PycausalSession, apply_endpoints
+
+def dot_to_adjacency(pc, graph, columns):
+    # the DOT export parsing of the original LF_pycausal, with node names of any length
+    node_index = {str(column): i for i, column in enumerate(columns)}
+    matrix = np.zeros((len(columns), len(columns)))
+    for line in pc.tetradGraphToDot(graph).split("\n")[1:-1]:
+        if "->" not in line:
+            continue
+        source = node_index[line.split("->")[0].strip()]
+        dest_str, attributes = line.split("->")[1].split("[", 1)
+        dest = node_index[dest_str.strip()]
+        for item in attributes.rstrip("];").split(", "):
+            if 'arrowhead' in item:
+                arrowhead = item.split('=')[1]
+            elif 'arrowtail' in item:
+                arrowtail = item.split('=')[1]
+        apply_endpoints(matrix, source, dest, arrowtail, arrowhead)
+    return matrix
+
+def test_edges_match_dot_export():
+    rs = np.random.RandomState(0)
+    x = rs.randn(500, 1)
+    y = x + 0.5 * rs.randn(500, 1)
+    z = y + 0.5 * rs.randn(500, 1)
+    feature = np.hstack([x, y, z, rs.randn(500, 8)])
+    session = PycausalSession(verbose=False)
+    try:
+        for algoId in ['fges', 'pc-all']:
+            matrix = session.run(feature, algoId)
+            graph = session.tetrad.getTetradGraph()
+            columns = [str(i) for i in range(feature.shape[1])]
+            assert np.array_equal(matrix, dot_to_adjacency(session.pc, graph, columns))
+    finally:
+        session.stop()
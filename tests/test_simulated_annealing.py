@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from libs.model.Best_G_Estimator import SimulatedAnnealing, State
+from libs.utils.graph_modules import modify_single_edge, get_ordered_edge_sets
+from libs.utils.metrics import shd, sid
+
+from test_metrics import reference_shd
+
+class ReferenceSimulatedAnnealing:
+    '''
+    SimulatedAnnealing before the incremental objective: every move copies the graph and recomputes the objective
+    '''
+    def __init__(self, G_lambdas, initial_state, maxiter, decrease_t_iter, dist_metric, T, alpha, weights):
+        self.G_lambdas = G_lambdas
+        self.maxiter = maxiter
+        self.decrease_t_iter = decrease_t_iter
+        self.T = T
+        self.alpha = alpha
+        self.dist_metric = dist_metric
+        self.weights = weights
+        self.state = State(np.copy(initial_state), self.objective(initial_state))
+        self.edge_set = get_ordered_edge_sets(self.state.G)
+
+    def objective(self, G_candidate):
+        sum_dist = 0
+        for i, G in enumerate(self.G_lambdas):
+            sum_dist += self.weights[i] * self.dist_metric(G_candidate, G)
+        return sum_dist/len(self.G_lambdas)
+
+    def optimize(self):
+        for i in range(0, self.maxiter, self.decrease_t_iter):
+            for j in range(self.decrease_t_iter):
+                edge_idx = np.random.choice([i for i in range(len(self.edge_set))])
+                candidate = modify_single_edge(self.state.G, self.edge_set[edge_idx])
+                possible_state = State(candidate, self.objective(candidate))
+                if possible_state.cost < self.state.cost:
+                    self.state = possible_state
+                else:
+                    p_accept = np.exp(-(possible_state.cost - self.state.cost)/self.T)
+                    self.state = np.random.choice([self.state, possible_state], p=[1-p_accept, p_accept])
+            self.T = self.T*self.alpha
+        return self.state
+
+def random_lfs(seed, n_lfs=4, n_nodes=6, signed=False):
+    rs = np.random.RandomState(seed)
+    G_lambdas = [np.triu(rs.rand(n_nodes, n_nodes) < 0.4, 1).astype(float) for _ in range(n_lfs)]
+    if signed:
+        # e.g. -1 entries of CPDAG based LFs
+        G_lambdas = [G * np.where(rs.rand(n_nodes, n_nodes) < 0.3, -1, 1) for G in G_lambdas]
+    return G_lambdas, rs.uniform(0.5, 2., n_lfs).tolist()
+
+@pytest.mark.parametrize('dist_metric,reference_metric', [(shd, reference_shd), (sid, sid)])
+@pytest.mark.parametrize('signed', [False, True])
+def test_same_trajectory(dist_metric, reference_metric, signed):
+    for seed in range(5 if dist_metric is shd else 2):
+        G_lambdas, weights = random_lfs(seed, signed=signed)
+        initial_state = G_lambdas[seed % len(G_lambdas)]
+        initial_copy = np.copy(initial_state)
+        for T in [1., 10000.]:
+            np.random.seed(seed)
+            reference = ReferenceSimulatedAnnealing(G_lambdas, initial_state, 300, 100, reference_metric, T, 0.1, weights)
+            expected = reference.optimize()
+            expected_rng = np.random.get_state()[1]
+            np.random.seed(seed)
+            annealing = SimulatedAnnealing(G_lambdas, initial_state, 300, 100, dist_metric, T=T, weights=weights)
+            state = annealing.optimize(verbose=False)
+            assert np.array_equal(state.G, expected.G)
+            assert state.cost == expected.cost
+            assert np.array_equal(np.random.get_state()[1], expected_rng)
+            # the initial graph is not modified in place
+            assert np.array_equal(initial_state, initial_copy)
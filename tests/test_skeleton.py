@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from causallearn.utils.cit import mv_fisherz, fisherz
+from causallearn.search.ConstraintBased.PC import pc
+
+from libs.model.LF import LF
+from libs.model.ci_oracle import CIOracle
+from libs.model.skeleton import pc_parallel
+
+from test_ci_oracle import linear_gaussian
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_stable_fci_matches_fci(n_workers):
+    for seed in range(10):
+        data = linear_gaussian(seed, n_vars=7)
+        lf = LF()
+        expected = lf.LF_fci(data)
+        assert np.array_equal(LF().LF_fci(data, stable=True, n_workers=n_workers), expected)
+
+@pytest.mark.parametrize('test', [fisherz, mv_fisherz])
+def test_pc_parallel_matches_pc(test):
+    for seed in range(10):
+        data = linear_gaussian(seed, n_vars=7)
+        cg = pc_parallel(data, 0.04, CIOracle(data, test), n_workers=2)
+        assert np.array_equal(cg.G.graph, pc(data, 0.04, test, True, 0, -1).G.graph)